@@ -0,0 +1,39 @@
+from pyper import Str4R
+from r_garch.r_utilities import BinaryTransport
+
+
+class FakeR(object):
+    """
+    Stand-in for the pyper R object that needs no R install: commands are built and counted exactly as
+    pyper sends them, but never run
+    responses: dict<R variable name: value returned by r_conn[name]>, None for anything else
+
+    Attributes:
+        bytes_sent: (int) bytes of R source sent, as CountingR counts them
+        n_commands: (int) commands sent
+    """
+    def __init__(self, responses=None):
+        self.responses = {} if responses is None else responses
+        self.bytes_sent = 0
+        self.n_commands = 0
+
+    def __call__(self, CMDS=[], use_try=None):
+        self.bytes_sent += len(CMDS) if isinstance(CMDS, str) else len('; '.join(CMDS))
+        self.n_commands += 1
+        return ''
+
+    def __setitem__(self, obj, val):
+        self.__call__('%s <- %s' % (obj, Str4R(val)))
+
+    def __getitem__(self, obj):
+        return self.responses.get(obj)
+
+
+class FakeBinaryR(BinaryTransport, FakeR):
+    """
+    FakeR moving bulk data as BinaryR does: transfer files are written and counted in bytes_sent, R never
+    reads them, and fetches fall back to the canned responses
+    """
+    def __init__(self, responses=None, transfer_path=None):
+        FakeR.__init__(self, responses)
+        self.open_transfers(transfer_path)
@@ -0,0 +1,297 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import matplotlib
+matplotlib.use('Agg')
+import numpy as np
+import pandas as pd
+from py_garch import result_viz
+from py_garch.figure_render import FigureRenderer, summary_figure_specs
+from py_garch.garch_backend import NumpyGarchBackend
+from py_garch.garch_engine import simulation_seed, result_prefix, supports_forecast_mode
+from py_garch.result_store import RVMResultStore
+from py_garch.window_plan import DateWindowPlan
+from py_garch.price_store import PriceStore, PRICE_STORE_SUFFIX
+from py_garch.realized import RealizedTargets
+from py_garch.simulation import ADAPTIVE, ANALYTIC
+from r_garch.r_model_run import RGarchBackend
+from exercise.comparison import load_full_data_set, populate_result_holders
+from exercise.default_inputs import TEST_DISTS, MODEL_TYPES, LOOK_BACKS, N_FORECAST
+from exercise.planner import WorkPlan
+
+from .fake_r import FakeR, FakeBinaryR
+from .synthetic import synthetic_prices, synthetic_results
+
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+DEFAULT_DAYS = 5000
+DEFAULT_REPEATS = 3
+DEFAULT_SIMULATIONS = 1000
+# a stage is flagged when its best time exceeds the baseline's by more than this fraction
+REGRESSION_TOLERANCE = .2
+
+
+class BenchmarkContext(object):
+    """
+    Inputs shared by every stage, built once per suite run from synthetic prices
+    n_days: length of the synthetic price history, the second half of it is swept
+    n_simulations: simulations per fit in the fit stage
+    work_path: directory for the data file, result stores and figures
+    seed: synthetic data seed
+    """
+    def __init__(self, n_days, n_simulations, work_path, seed=0):
+        self.n_days = n_days
+        self.n_simulations = n_simulations
+        self.work_path = work_path
+        os.makedirs(work_path, exist_ok=True)
+        self.prices = synthetic_prices(n_days, seed)
+        self.data_file = os.path.join(work_path, 'prices.txt')
+        self.prices.rename(columns={'Date': 'date'}).to_csv(self.data_file, sep='\t', index=False,
+                                                             date_format='%Y-%m-%d')
+        self.price_store_path = os.path.join(work_path, 'prices' + PRICE_STORE_SUFFIX)
+        self.fit_from = self.prices.iloc[n_days // 2:]
+        self.start_points = np.arange(0, self.fit_from.shape[0] - N_FORECAST - 1, N_FORECAST)
+        self.window_plan = DateWindowPlan.from_data_sets(self.start_points, LOOK_BACKS, self.fit_from, self.prices)
+        self.model_results = populate_result_holders(LOOK_BACKS, TEST_DISTS, MODEL_TYPES, N_FORECAST, 5000)
+        self.results = synthetic_results([h.params for h in self.model_results], self.window_plan.end_dates,
+                                         self.window_plan, seed)
+        self.plan_store_path = os.path.join(work_path, 'plan.sqlite')
+        self.store_path = os.path.join(work_path, 'results.sqlite')
+        with RVMResultStore(self.store_path) as result_store:
+            result_store.append(self.results)
+        end_date = self.window_plan.end_dates[-1]
+        start_date = self.window_plan.get_start_end_dates(len(self.start_points) - 1, LOOK_BACKS[0])[0]
+        self.fit_jobs = [
+            (start_date, end_date, N_FORECAST, model_type, test_dist, n_simulations,
+             simulation_seed(result_prefix(model_type, test_dist, n_simulations, N_FORECAST, start_date, end_date)))
+            for model_type in MODEL_TYPES for test_dist in TEST_DISTS]
+        self.plot_path = os.path.join(work_path, 'plots')
+        os.makedirs(self.plot_path, exist_ok=True)
+
+
+def stage_data_load(context):
+    load_full_data_set(context.data_file)
+    return {}
+
+
+def stage_price_store(context):
+    # converted on the first run, opened memory-mapped on the following ones
+    price_store = PriceStore.for_data_file(context.data_file, load_full_data_set, context.price_store_path)
+    for job in context.fit_jobs:
+        price_store.split_returns(job[0], job[1])
+    return {'n_rows': len(price_store)}
+
+
+def stage_window_planning(context):
+    window_plan = DateWindowPlan.from_data_sets(context.start_points, LOOK_BACKS, context.fit_from, context.prices)
+    with RVMResultStore(context.plan_store_path) as result_store:
+        plan = WorkPlan.build(result_store, window_plan, context.model_results)
+    return {'n_tasks': plan.n_to_fit}
+
+
+def stage_data_transfer(context):
+    r_conn = FakeR({'result': {}})
+    backend = RGarchBackend(r_conn)
+    backend.data_handle(context.prices)
+    backend.multi_run(context.prices, context.fit_jobs)
+    return {'bytes_sent': r_conn.bytes_sent, 'n_commands': r_conn.n_commands}
+
+
+def stage_data_transfer_binary(context):
+    # the same transfer as stage_data_transfer with the bulk data written as binary files, see BinaryR
+    r_conn = FakeBinaryR({'result': {}}, os.path.join(context.work_path, 'transfer'))
+    backend = RGarchBackend(r_conn)
+    backend.data_handle(context.prices)
+    backend.multi_run(context.prices, context.fit_jobs)
+    return {'bytes_sent': r_conn.bytes_sent, 'bytes_transferred': r_conn.bytes_transferred,
+            'n_commands': r_conn.n_commands}
+
+
+def stage_fit(context):
+    backend = NumpyGarchBackend(0)
+    backend.multi_run(context.prices, context.fit_jobs)
+    return {'n_fits': len(context.fit_jobs), 'sim_peak_bytes': backend.last_peak_bytes}
+
+
+def stage_fit_price_store(context):
+    price_store = PriceStore.for_data_file(context.data_file, load_full_data_set, context.price_store_path)
+    NumpyGarchBackend(0).multi_run(price_store, context.fit_jobs)
+    return {'n_fits': len(context.fit_jobs)}
+
+
+def _stage_fit_mode(forecast_mode):
+    def stage_fit_mode(context):
+        # the fit stage's jobs summarized in another forecast mode, n_simulations is the adaptive cap
+        jobs = [tuple(job) + (None, None, None, forecast_mode) for job in context.fit_jobs
+                if supports_forecast_mode(job[3], forecast_mode)]
+        backend = NumpyGarchBackend(0)
+        result_dict = backend.multi_run(context.prices, jobs)
+        n_sims_used = [value for key, value in result_dict.items() if key.endswith('_n.sims.used')]
+        return {'n_fits': len(jobs), 'mean_sims_used': float(np.mean(n_sims_used)),
+                'sim_peak_bytes': backend.last_peak_bytes}
+    return stage_fit_mode
+
+
+def stage_realized(context):
+    vol_realized_ann, _ = RealizedTargets(context.prices).at(context.window_plan.end_dates, N_FORECAST)
+    return {'n_end_dates': len(vol_realized_ann)}
+
+
+def stage_cache_write(context):
+    path = os.path.join(context.work_path, 'write.sqlite')
+    if os.path.exists(path):
+        os.remove(path)
+    with RVMResultStore(path) as result_store:
+        result_store.append(context.results)
+    return {'n_results': len(context.results)}
+
+
+def stage_cache_read(context):
+    with RVMResultStore(context.store_path) as result_store:
+        n_found = len([result for result in context.results if result_store.lookup(
+            result.data_start_date, result.data_end_date, result.params) is not None])
+    return {'n_results': n_found}
+
+
+def _filled_holders(context):
+    model_results = populate_result_holders(LOOK_BACKS, TEST_DISTS, MODEL_TYPES, N_FORECAST, 5000)
+    holders = dict((result_holder.params, result_holder) for result_holder in model_results)
+    for result in context.results:
+        holders[result.params].add_result(result)
+    return model_results
+
+
+def stage_summary(context):
+    summary = result_viz.SummaryResults(_filled_holders(context))
+    summary.summary_error_frame()
+    return {}
+
+
+def stage_figures(context):
+    # drop the manifest so every figure is drawn, stage_figures_cached times the skip path
+    renderer = FigureRenderer(context.plot_path)
+    if os.path.exists(renderer.manifest_path):
+        os.remove(renderer.manifest_path)
+    n_rendered, _ = renderer.render(summary_figure_specs(result_viz.SummaryResults(_filled_holders(context))))
+    return {'n_figures': n_rendered}
+
+
+def stage_figures_cached(context):
+    renderer = FigureRenderer(context.plot_path)
+    specs = summary_figure_specs(result_viz.SummaryResults(_filled_holders(context)))
+    if not os.path.exists(renderer.manifest_path):
+        renderer.render(specs)
+    n_rendered, n_current = renderer.render(specs)
+    return {'n_figures': n_rendered, 'n_current': n_current}
+
+
+def _stage_startup(command):
+    def stage_startup(context):
+        # a fresh interpreter loading only what the subcommand imports, the counters flag heavy imports
+        output = subprocess.run([sys.executable, '-m', 'exercise', '--import-only', command], cwd=REPO_PATH,
+                                capture_output=True, text=True, check=True).stdout
+        return dict(('imports_{!s}'.format(name), loaded) for name, loaded in json.loads(output).items())
+    return stage_startup
+
+
+STAGES = [('data_load', stage_data_load),
+          ('price_store', stage_price_store),
+          ('window_planning', stage_window_planning),
+          ('data_transfer', stage_data_transfer),
+          ('data_transfer_binary', stage_data_transfer_binary),
+          ('fit', stage_fit),
+          ('fit_price_store', stage_fit_price_store),
+          ('fit_adaptive', _stage_fit_mode(ADAPTIVE)),
+          ('fit_analytic', _stage_fit_mode(ANALYTIC)),
+          ('realized', stage_realized),
+          ('cache_write', stage_cache_write),
+          ('cache_read', stage_cache_read),
+          ('summary', stage_summary),
+          ('figures', stage_figures),
+          ('figures_cached', stage_figures_cached)] + \
+    [('startup_{!s}'.format(command), _stage_startup(command)) for command in ['plan', 'compute', 'report', 'status']]
+
+
+def run_suite(n_days=DEFAULT_DAYS, repeats=DEFAULT_REPEATS, n_simulations=DEFAULT_SIMULATIONS, stages=None,
+              work_path=None, seed=0):
+    """
+    Time each stage separately, repeats times
+    :param stages: names of the stages to run, all when None
+    :param work_path: scratch directory, a new temporary one when None
+    :return: dict with meta and per-stage best, median and all run seconds, plus stage counters
+    """
+    work_path = tempfile.mkdtemp(prefix='vol_bench_') if work_path is None else work_path
+    context = BenchmarkContext(n_days, n_simulations, work_path, seed)
+    report = {'meta': {'n_days': n_days,
+                       'repeats': repeats,
+                       'n_simulations': n_simulations,
+                       'seed': seed,
+                       'python': platform.python_version(),
+                       'numpy': np.__version__,
+                       'pandas': pd.__version__,
+                       'timestamp': pd.Timestamp.now().isoformat()},
+              'stages': {}}
+    for name, stage in STAGES:
+        if stages is not None and name not in stages:
+            continue
+        runs = []
+        counters = {}
+        for _ in range(repeats):
+            time_start = time.perf_counter()
+            counters = stage(context)
+            runs.append(time.perf_counter() - time_start)
+        report['stages'][name] = dict(best=min(runs), median=float(np.median(runs)), runs=runs, **counters)
+        print('{:<16s} best {:9.4f}s  median {:9.4f}s'.format(name, min(runs), float(np.median(runs))))
+    return report
+
+
+def compare(report, baseline, tolerance=REGRESSION_TOLERANCE):
+    """
+    Compare best stage times against a saved baseline report
+    :return: list of (stage, baseline seconds, seconds, ratio, regressed) for stages in both reports
+    """
+    rows = []
+    for name, timing in report['stages'].items():
+        if name not in baseline['stages']:
+            continue
+        baseline_best = baseline['stages'][name]['best']
+        ratio = timing['best'] / baseline_best if baseline_best > 0 else float('inf')
+        rows.append((name, baseline_best, timing['best'], ratio, ratio > 1. + tolerance))
+    return rows
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Time each stage of the volatility sweep on synthetic data')
+    parser.add_argument('--days', type=int, default=DEFAULT_DAYS, help='synthetic price history length')
+    parser.add_argument('--repeats', type=int, default=DEFAULT_REPEATS)
+    parser.add_argument('--simulations', type=int, default=DEFAULT_SIMULATIONS, help='simulations per fit')
+    parser.add_argument('--stages', default=None, help='comma separated stage names, all by default')
+    parser.add_argument('--work-dir', default=None, help='scratch directory, temporary by default')
+    parser.add_argument('--output', default=None, help='write the JSON report here')
+    parser.add_argument('--baseline', default=None, help='JSON report to compare against')
+    parser.add_argument('--tolerance', type=float, default=REGRESSION_TOLERANCE,
+                        help='allowed slowdown fraction before a stage is flagged')
+    args = parser.parse_args(argv)
+    stages = None if args.stages is None else args.stages.split(',')
+    report = run_suite(args.days, args.repeats, args.simulations, stages, args.work_dir)
+    if args.output is not None:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+    if args.baseline is None:
+        return 0
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+    rows = compare(report, baseline, args.tolerance)
+    for name, baseline_best, best, ratio, regressed in rows:
+        print('{!s} {:<16s} {:9.4f}s -> {:9.4f}s  x{:.2f}'.format(
+            'REGRESSION' if regressed else 'ok        ', name, baseline_best, best, ratio))
+    return 1 if any(row[4] for row in rows) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
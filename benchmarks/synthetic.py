@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+from py_garch.garch_engine import VARIANCE_MODELS, INNOVATION_DISTS
+from py_garch.vol_estimator import RVolModelSingleResult
+
+
+def synthetic_prices(n_days, seed=0, start_date='1990-01-02', mu=3e-4, omega=2e-6, alpha=.03, gamma=.1, beta=.9,
+                     start_price=100.):
+    """
+    Deterministic GJR-GARCH(1,1) price history with normal innovations on business days
+    :param n_days: number of prices
+    :param seed: random generator seed, the same seed always gives the same prices
+    :return: DataFrame with Date and Close columns, as exercise.comparison.load_full_data_set returns
+    """
+    rng = np.random.default_rng(seed)
+    z = rng.standard_normal(n_days - 1)
+    returns = np.empty(n_days - 1)
+    sigma2 = omega / (1. - alpha - .5 * gamma - beta)
+    for t in range(n_days - 1):
+        returns[t] = mu + np.sqrt(sigma2) * z[t]
+        shock = (returns[t] - mu) ** 2
+        sigma2 = omega + (alpha + gamma * (returns[t] < mu)) * shock + beta * sigma2
+    log_prices = np.log(start_price) + np.concatenate([[0.], np.cumsum(returns)])
+    dates = pd.bdate_range(start_date, periods=n_days)
+    return pd.DataFrame({'Date': dates, 'Close': np.round(np.exp(log_prices), 2)})
+
+
+def synthetic_returns(n_days, model_type, test_dist, coef, seed=0):
+    """
+    Deterministic log returns of a constant-mean GARCH(1,1) family model, drawn through the numpy engine's own
+    variance recursion and innovations after 1000 burn-in steps
+    :param model_type: eGARCH, gjrGARCH, csGARCH
+    :param test_dist: std, norm
+    :param coef: dict of coefficients, rugarch names as garch_engine.fit_garch returns them
+    :return: array of n_days returns
+    """
+    model = VARIANCE_MODELS[model_type]
+    dist = INNOVATION_DISTS[test_dist]
+    var_params = np.array([coef[name] for name in model.variance_names])
+    shape = np.array([coef[name] for name in dist.shape_names])
+    abs_moment = dist.abs_moment(shape)
+    rng = np.random.default_rng(seed)
+    z = dist.draw(rng, n_days + 1000, shape)
+    resid = np.empty(n_days + 1000)
+    # sigma^2, and the permanent component of csGARCH, start at a daily variance of 1e-4
+    state = np.full(1, 1e-4), np.full(1, 1e-4)
+    for t in range(len(resid)):
+        resid[t] = np.sqrt(state[0][0]) * z[t]
+        state = model.step(var_params, state, resid[t:t + 1], abs_moment)
+    return coef['mu'] + resid[1000:]
+
+
+def synthetic_results(params_list, end_dates, window_plan=None, seed=0):
+    """
+    Filled RVolModelSingleResult objects with random values, for timing storage and aggregation
+    :param params_list: list of AllDatesVolModelRunParams
+    :param end_dates: sequence of Timestamps
+    :param window_plan: optional DateWindowPlan giving each start date, otherwise the end date is used
+    :return: list of RVolModelSingleResult
+    """
+    rng = np.random.default_rng(seed)
+    results = []
+    for params in params_list:
+        for index, end_date in enumerate(end_dates):
+            start_date = end_date
+            if window_plan is not None:
+                start_date = window_plan.get_start_end_dates(index, params.window)[0]
+            result = RVolModelSingleResult(start_date, end_date, params)
+            quantiles = np.sort(rng.uniform(.05, .4, 5))
+            result.quantile0_pct, result.quantile25_pct, result.quantile50_pct, result.quantile75_pct, \
+                result.quantile100_pct = quantiles.tolist()
+            result.mean_sim_ann = float(quantiles.mean())
+            result.vol_realized_ann = float(rng.uniform(.05, .4))
+            result.forecast_error = result.vol_realized_ann - result.mean_sim_ann
+            results.append(result)
+    return results
@@ -0,0 +1,78 @@
+import argparse
+import json
+import sys
+import time
+from r_garch.r_utilities import RUtilities, r_connection, binary_r_connection
+from exercise.comparison import load_full_data_set
+from exercise.default_inputs import DATA_FILE
+
+
+DEFAULT_REPEATS = 5
+# entries of the fetched result list, about a batch of 1000 fits at 12 fields each
+DEFAULT_RESULTS = 12000
+
+
+def _best(function, repeats):
+    runs = []
+    for _ in range(repeats):
+        time_start = time.perf_counter()
+        function()
+        runs.append(time.perf_counter() - time_start)
+    return min(runs)
+
+
+def time_transfers(r_conn, prices, n_results, repeats=DEFAULT_REPEATS):
+    """
+    Best seconds of each transfer over one connection
+    :param r_conn: connection from r_connection or binary_r_connection
+    :param prices: DataFrame with Date and Close columns
+    :param n_results: entries of the result list fetched, 11 in 12 numeric and the rest character
+    :return: dict<transfer: (seconds, payload bytes)>
+    """
+    n_rows = prices.shape[0]
+    r_conn('bench.result <- as.list(setNames(runif({n}), paste0("k", seq_len({n}))))'.format(n=n_results))
+    r_conn('bench.result[seq(12, {n}, 12)] <- "mu=0.1;omega=0.2"'.format(n=n_results))
+    timings = {
+        'send_prices': (_best(lambda: RUtilities.create_time_series_frame(r_conn, prices.copy(), 'Date',
+                                                                          'bench.prices'), repeats),
+                        n_rows * 12),
+        'fetch_prices': (_best(lambda: r_conn['bench.prices$Close'], repeats), n_rows * 8),
+        'fetch_result': (_best(lambda: r_conn['bench.result'], repeats), n_results * 8)}
+    return timings
+
+
+def run_transfer_benchmark(data_file=DATA_FILE, n_results=DEFAULT_RESULTS, repeats=DEFAULT_REPEATS):
+    """
+    Time the same transfers of the full price history and a batch sized result list through pyper's R source
+    text and through binary files, needs an R install at R_PATH
+    :return: dict<transport: dict<transfer: (seconds, payload bytes)>>
+    """
+    prices = load_full_data_set(data_file)
+    report = {}
+    for transport, connection in [('text', r_connection), ('binary', binary_r_connection)]:
+        with connection() as r_conn:
+            report[transport] = time_transfers(r_conn, prices, n_results, repeats)
+    for transfer in sorted(report['text']):
+        (text_seconds, n_bytes), (binary_seconds, _) = report['text'][transfer], report['binary'][transfer]
+        print('{:<14s} text {:8.4f}s {:8.2f} MB/s  binary {:8.4f}s {:8.2f} MB/s  x{:.1f}'.format(
+            transfer, text_seconds, n_bytes / text_seconds / 1e6, binary_seconds, n_bytes / binary_seconds / 1e6,
+            text_seconds / binary_seconds))
+    return report
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Compare pyper text and binary file transfers to and from R')
+    parser.add_argument('--data-file', default=DATA_FILE, help='price history sent to R')
+    parser.add_argument('--results', type=int, default=DEFAULT_RESULTS, help='entries of the fetched result list')
+    parser.add_argument('--repeats', type=int, default=DEFAULT_REPEATS)
+    parser.add_argument('--output', default=None, help='write the JSON report here')
+    args = parser.parse_args(argv)
+    report = run_transfer_benchmark(args.data_file, args.results, args.repeats)
+    if args.output is not None:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,17 +1,13 @@
-
+# Defaults for py_garch.settings, each overridable by a VOL_TUNING_<NAME> environment variable or on the
+# command line; a setting is only checked when first used
 # Set to your machine's R installation
 # 'C:/Program Files/R/R-3.4.4/bin/R'
 R_PATH = 'C:/Program Files/R/R-3.4.4/bin/R'
 # Set to a location for caching data files
 TMP_PATH = 'c:/tmp'
-# Set to a location for storing images
+# Set to a location for storing images, TMP_PATH when left empty
 PLOT_PATH = ''
-
-if PLOT_PATH == '':
-    PLOT_PATH = TMP_PATH
-
-if R_PATH == '':
-    raise Exception('R_PATH must be set')
-
-if TMP_PATH == '':
-    raise Exception('TMP_PATH must be set')
+# Set to the engine used for fitting: 'r' (rugarch via pyper) or 'numpy' (no R required)
+GARCH_BACKEND = 'r'
+# Set to how bulk data crosses to R: 'pyper' (R source text) or 'binary' (files read by scripts/rBridge.r)
+R_TRANSPORT = 'pyper'
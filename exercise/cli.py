@@ -0,0 +1,110 @@
+import argparse
+import importlib
+import json
+import sys
+from py_garch import settings
+
+
+# modules that make a subcommand slow to start, reported by --import-only
+HEAVY_MODULES = ['pyper', 'matplotlib', 'seaborn', 'scipy']
+
+
+def command_plan(args):
+    from .comparison import run_compute
+    run_compute(args.data_file, dry_run=True, panel_file=args.panel_file, layout=args.layout)
+
+
+def command_compute(args):
+    from .comparison import run_compute
+    run_compute(args.data_file, args.workers, args.warm_start, panel_file=args.panel_file, layout=args.layout)
+
+
+def command_queue(args):
+    from .work_queue import WorkQueue, seed_queue, drain_queue
+    if args.action == 'seed':
+        seed_queue(args.data_file, args.panel_file, args.layout, args.warm_start, args.queue_file)
+    elif args.action == 'work':
+        drain_queue(args.queue_file, args.worker_id, args.lease)
+    else:
+        with WorkQueue(args.queue_file) as work_queue:
+            print(work_queue.progress_line())
+            print(work_queue.progress())
+
+
+def command_report(args):
+    from .report import run_report
+    run_report(n_render_workers=args.render_workers)
+
+
+def command_status(args):
+    from py_garch.result_store import RVMResultStore, LAST_DATE_KEY
+    with RVMResultStore() as result_store:
+        status = result_store.status()
+        last_date = result_store.get_meta(LAST_DATE_KEY)
+    print('result store {!s}: {!s} results, {!s} incomplete realized targets, {!s} failed fits, prices up to '
+          '{!s}'.format(result_store.path, int(status.n_results.sum()), int(status.n_incomplete.sum()),
+                        int(status.n_failed.sum()), last_date or '--'))
+    if len(status) > 0:
+        print(status)
+
+
+# subcommand: (handler, modules it imports)
+COMMANDS = {'plan': (command_plan, ['exercise.comparison']),
+            'compute': (command_compute, ['exercise.comparison']),
+            'queue': (command_queue, ['exercise.work_queue']),
+            'report': (command_report, ['exercise.report']),
+            'status': (command_status, ['py_garch.result_store'])}
+
+
+def build_parser():
+    from .default_inputs import DATA_FILE, N_WORKERS, WARM_START, N_RENDER_WORKERS, PANEL_FILE, PANEL_LAYOUT, \
+        QUEUE_LEASE_SECONDS
+    parser = argparse.ArgumentParser(prog='python -m exercise', description='GARCH look-back window sweep')
+    parser.add_argument('--tmp-path', help='result store and cache directory, overrides TMP_PATH')
+    parser.add_argument('--plot-path', help='figure directory, overrides PLOT_PATH')
+    parser.add_argument('--r-path', help='R executable, overrides R_PATH')
+    parser.add_argument('--backend', choices=['r', 'numpy'], help='fitting backend, overrides GARCH_BACKEND')
+    parser.add_argument('--r-transport', choices=['pyper', 'binary'],
+                        help='how bulk data crosses to R, overrides R_TRANSPORT')
+    parser.add_argument('--import-only', action='store_true',
+                        help='load the subcommand\'s modules, print which heavy modules they pulled in and exit')
+    commands = parser.add_subparsers(dest='command', required=True)
+    plan = commands.add_parser('plan', help='report the fits still missing from the result store')
+    compute = commands.add_parser('compute', help='run the missing fits, without plotting')
+    work_queue = commands.add_parser('queue', help='seed a shared work queue, drain it from any number of '
+                                                   'processes or hosts, or report its progress')
+    work_queue.add_argument('action', choices=['seed', 'work', 'status'])
+    work_queue.add_argument('--queue-file', help='queue SQLite file, work_queue.sqlite under TMP_PATH by default')
+    work_queue.add_argument('--warm-start', action='store_true', default=WARM_START, help='seed fit chains')
+    work_queue.add_argument('--worker-id', help='name of this worker in leases, host:pid by default')
+    work_queue.add_argument('--lease', type=float, default=QUEUE_LEASE_SECONDS, help='lease seconds')
+    for subcommand in [plan, compute, work_queue]:
+        subcommand.add_argument('--data-file', default=DATA_FILE)
+        subcommand.add_argument('--panel-file', default=PANEL_FILE,
+                                help='multi-asset price file, run in place of --data-file')
+        subcommand.add_argument('--layout', choices=['wide', 'long'], default=PANEL_LAYOUT,
+                                help='panel file layout, a close column per asset or a row per date and asset')
+    compute.add_argument('--workers', type=int, default=N_WORKERS, help='backend sessions')
+    compute.add_argument('--warm-start', action='store_true', default=WARM_START)
+    report = commands.add_parser('report', help='summary figures from the result store, without R')
+    report.add_argument('--render-workers', type=int, default=N_RENDER_WORKERS)
+    commands.add_parser('status', help='stored results per config')
+    return parser
+
+
+def main(argv):
+    args = build_parser().parse_args(argv)
+    settings.configure(TMP_PATH=args.tmp_path, PLOT_PATH=args.plot_path, R_PATH=args.r_path,
+                       GARCH_BACKEND=args.backend, R_TRANSPORT=args.r_transport)
+    handler, modules = COMMANDS[args.command]
+    if args.import_only:
+        for module in modules:
+            importlib.import_module(module)
+        print(json.dumps(dict((module, module in sys.modules) for module in HEAVY_MODULES)))
+        return 0
+    handler(args)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
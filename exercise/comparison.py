@@ -1,107 +1,317 @@
-from py_garch.vol_estimator import AllDatesVolModelRunParams, RVMSingleResultCache, RVolModelSingleResult, \
-    RVolModelMultiDateResult
-from py_garch.result_viz import *
-from r_garch.r_utilities import r_connection_initialized
-from r_garch.r_model_run import initialized_single_run
+import sys
+import time
+from contextlib import nullcontext
+import numpy as np
+import pandas as pd
+from py_garch import settings
+from py_garch.vol_estimator import AllDatesVolModelRunParams, RVolModelMultiDateResult, ResultArrays
+from py_garch.result_store import RVMResultStore
+from py_garch.sample_store import SampleStore
+from py_garch.window_plan import DateWindowPlan
+from py_garch.price_store import PriceStore
+from py_garch.realized import RealizedTargets
+from py_garch.garch_backend import backend_connection
+from py_garch.garch_engine import supports_forecast_mode
+from py_garch.instrumentation import RunMonitor
 
 
 from .default_inputs import DATA_COLUMNS, TEST_DISTS, MODEL_TYPES, LOOK_BACKS, \
-    START_DATE, N_FORECAST, N_SIM, DATA_FILE, R_CONN_INITIALIZATION_STRING
+    START_DATE, N_FORECAST, N_SIM, DATA_FILE, R_CONN_INITIALIZATION_STRING, N_WORKERS, \
+    WARM_START, REFIT_EVERY, FORECAST_MODES, FIT_TIMEOUT, RECYCLE_AFTER, MAX_RETRIES, PANEL_FILE, PANEL_LAYOUT, \
+    KEEP_SAMPLES
+from .worker_pool import BackendWorkerPool
+from .planner import WorkPlan, FIT_STAGE, FILTER_STAGE, REFIT_UNAVAILABLE
 
 
-def populate_result_holders(look_backs, test_dists, model_types, n_forecast, n_simulations):
+def populate_result_holders(look_backs, test_dists, model_types, n_forecast, n_simulations, refit_everys=(1,),
+                            forecast_modes=('simulate',), assets=('',)):
+    # every holder writes into one set of arrays, the summary frames are sliced from it; analytic configs of a
+    # model with no closed-form forecast are left out rather than simulated under the analytic name
+    arrays = ResultArrays()
     model_results = []
-    for window in look_backs:
-        for test_dist in test_dists:
-            for model_type in model_types:
-                params = AllDatesVolModelRunParams(model_type, test_dist, n_forecast, n_simulations, window)
-                cross_date_holder = RVolModelMultiDateResult(params)
-                model_results.append(cross_date_holder)
+    for asset in assets:
+        for window in look_backs:
+            for test_dist in test_dists:
+                for model_type in model_types:
+                    for refit_every in refit_everys:
+                        for forecast_mode in forecast_modes:
+                            if not supports_forecast_mode(model_type, forecast_mode):
+                                continue
+                            params = AllDatesVolModelRunParams(model_type, test_dist, n_forecast, n_simulations,
+                                                               window, refit_every, forecast_mode, asset)
+                            cross_date_holder = RVolModelMultiDateResult(params, arrays)
+                            model_results.append(cross_date_holder)
     return model_results
 
 
-def populate_single_run_results(r_conn, start_point, result_holder, data_set_test, data_set_full):
-    input_start_date, input_end_date = result_holder.params.get_start_end_dates(
-        start_point,
-        data_set_test,
-        data_set_full)
-
-    result = RVMSingleResultCache.check_exists(input_start_date, input_end_date, result_holder.params)
-
-    if result is None:
-        result_dict = initialized_single_run(r_conn,
-                                             data_set_full,
-                                             input_start_date,
-                                             input_end_date,
-                                             result_holder.params.n_forecast,
-                                             result_holder.params.model_type,
-                                             result_holder.params.test_dist,
-                                             result_holder.params.n_sims)
-        result = RVolModelSingleResult(input_start_date, input_end_date, result_holder.params)
+def asset_data_sets(data_set_full):
+    """
+    :param data_set_full: price history, or dict<asset: price history> of a multi-asset panel
+    :return: dict<asset: price history>, a single history keyed ''
+    """
+    return data_set_full if isinstance(data_set_full, dict) else {'': data_set_full}
+
+
+def open_sample_store():
+    """
+    :return: SampleStore when KEEP_SAMPLES is set, else a context giving None
+    """
+    return SampleStore() if KEEP_SAMPLES else nullcontext()
+
+
+def store_results(result_store, pending, result_dict, realized, sample_store=None):
+    """
+    Fill pending results from a backend result dict and their realized targets, write them to the store as
+    one batch and add them to their holders
+    :param pending: list of (result_holder, RVolModelSingleResult), the holder None for results only written
+        to the store, as by work queue workers
+    :param realized: RealizedTargets of the price history the results were fitted on
+    :param sample_store: SampleStore receiving the simulated samples found in result_dict, None to keep none
+    :return: seconds spent writing to the stores
+    """
+    for _, result in pending:
         result.set_from(result_dict)
-        RVMSingleResultCache.cache_local(result)
+    realized.set_realized([result for _, result in pending])
+    for result_holder, result in pending:
+        if result_holder is not None:
+            result_holder.add_result(result)
+    time_start = time.perf_counter()
+    result_store.append([result for _, result in pending])
+    if sample_store is not None:
+        sample_keys = [(result, '{!s}_samples'.format(result.prefix)) for _, result in pending]
+        sample_store.append([(result, result_dict[key]) for result, key in sample_keys if key in result_dict])
+    return time.perf_counter() - time_start
+
+
+def store_failed(result_store, pending, failure):
+    """
+    Mark pending results failed and write them to the store, so the sweep can report them; they are left out
+    of their holders and planned again by the next run
+    :param pending: list of (result_holder, RVolModelSingleResult)
+    :param failure: reason, see RVolModelSingleResult.failure
+    :return: None
+    """
+    for _, result in pending:
+        result.set_failed(failure)
+    result_store.append([result for _, result in pending])
+
 
-    result_holder.add_result(result)
+def fail_unavailable_filters(plan, stage, result_store, monitor):
+    """
+    At the filter stage, store the filter tasks whose refit is unavailable as failed, see
+    WorkPlan.unavailable_filters
+    :return: None
+    """
+    pending = plan.unavailable_filters() if stage == FILTER_STAGE else []
+    if len(pending) > 0:
+        store_failed(result_store, pending, REFIT_UNAVAILABLE)
+        monitor.tasks_failed(pending, REFIT_UNAVAILABLE)
 
 
-def run_all_params():
-    full_data_set = pd.read_table(DATA_FILE, sep='\t')
+def run_plan(plan, result_store, data_set_full, warm_start=False, monitor=None, sample_store=None):
+    """
+    Fit the plan's batches in one backend session, one batched call per start_point, or per chain when
+    warm-starting, then filter between refits. Realized targets come from one pass over each price history
+    An R session runs in a supervised worker process, see run_plan_parallel, so a hung or crashed fit is
+    killed and retried instead of stalling the sweep
+    :param plan: WorkPlan
+    :param data_set_full: price history, or dict<asset: price history> for a plan built by WorkPlan.build_panel
+    :param monitor: RunMonitor recording each batch, a new one writing to run_metrics.jsonl when None
+    :param sample_store: SampleStore keeping each simulated fit's samples, None to keep none
+    """
+    if settings.get('GARCH_BACKEND') == 'r':
+        return run_plan_parallel(plan, result_store, data_set_full, 1, warm_start, monitor, sample_store)
+    if monitor is None:
+        with RunMonitor(plan.n_to_fit) as monitor:
+            return run_plan(plan, result_store, data_set_full, warm_start, monitor, sample_store)
+    data_sets = asset_data_sets(data_set_full)
+    realized = dict((asset, RealizedTargets(data_set)) for asset, data_set in data_sets.items())
+    with backend_connection(settings.get('GARCH_BACKEND'), R_CONN_INITIALIZATION_STRING) as r_conn:
+        r_conn.keep_samples = sample_store is not None
+        for stage in range(plan.n_stages):
+            stage_warm_start = warm_start and stage == FIT_STAGE
+            fail_unavailable_filters(plan, stage, result_store, monitor)
+            batches = plan.work_batches(stage_warm_start, stage)
+            for pending, jobs in zip(batches, plan.job_batches(stage_warm_start, stage)):
+                asset = pending[0][1].params.asset
+                result_dict = r_conn.multi_run(data_sets[asset], jobs, stage_warm_start)
+                store_seconds = store_results(result_store, pending, result_dict, realized[asset], sample_store)
+                monitor.batch_done(pending, r_conn.last_timings, r_conn.last_fit_bytes, store_seconds,
+                                   r_conn.last_peak_bytes)
+
+
+def run_plan_parallel(plan, result_store, data_set_full, n_workers, warm_start=False, monitor=None,
+                      sample_store=None):
+    """
+    Worker-pool counterpart of run_plan: each batch goes to a supervised worker and results are written to the
+    store from this process only. Fits that time out or lose their session are retried on their own, and
+    stored as failed once out of retries. A panel's batches of every asset share the one pool
+    :param plan: WorkPlan
+    :param data_set_full: price history, or dict<asset: price history> for a plan built by WorkPlan.build_panel
+    :param monitor: RunMonitor recording each batch, a new one writing to run_metrics.jsonl when None
+    :param sample_store: SampleStore keeping each simulated fit's samples, None to keep none
+    """
+    if monitor is None:
+        with RunMonitor(plan.n_to_fit) as monitor:
+            return run_plan_parallel(plan, result_store, data_set_full, n_workers, warm_start, monitor,
+                                     sample_store)
+    data_sets = asset_data_sets(data_set_full)
+    realized = dict((asset, RealizedTargets(data_set)) for asset, data_set in data_sets.items())
+    with BackendWorkerPool(settings.get('GARCH_BACKEND'), R_CONN_INITIALIZATION_STRING, data_sets,
+                           n_workers, FIT_TIMEOUT, RECYCLE_AFTER, MAX_RETRIES, sample_store is not None) as pool:
+        for stage in range(plan.n_stages):
+            stage_warm_start = warm_start and stage == FIT_STAGE
+            fail_unavailable_filters(plan, stage, result_store, monitor)
+            batches = plan.work_batches(stage_warm_start, stage)
+            assets = [pending[0][1].params.asset for pending in batches]
+            for batch_index, positions, result_dict, backend_metrics, failure in pool.run(
+                    plan.job_batches(stage_warm_start, stage), stage_warm_start, assets):
+                pending = [batches[batch_index][position] for position in positions]
+                if failure is not None:
+                    store_failed(result_store, pending, failure)
+                    monitor.tasks_failed(pending, failure)
+                    continue
+                timings, fit_bytes, peak_bytes = backend_metrics
+                store_seconds = store_results(result_store, pending, result_dict, realized[assets[batch_index]],
+                                              sample_store)
+                monitor.batch_done(pending, timings, fit_bytes, store_seconds, peak_bytes)
+
+
+def load_full_data_set(data_file=DATA_FILE):
+    full_data_set = pd.read_table(data_file, sep='\t')
     full_data_set.date=pd.to_datetime(full_data_set.date)
     full_data_set.columns = DATA_COLUMNS
-    look_backs = LOOK_BACKS
-    test_dists = TEST_DISTS
-    model_types = MODEL_TYPES
-    start_date_full_set = START_DATE
-    data_set_fit_from = full_data_set[full_data_set.Date >= start_date_full_set]
-    n_forecast = N_FORECAST
-    start_offset = 0
-    n_total = data_set_fit_from.shape[0]
-    start_points = np.arange(start_offset, n_total - n_forecast - 1, n_forecast)
-    n_dates_run = start_points.shape[0]
-    n_simulations = N_SIM
-
-    model_results = populate_result_holders(look_backs, test_dists, model_types, n_forecast, n_simulations)
-
-    with r_connection_initialized(R_CONN_INITIALIZATION_STRING) as r_conn:
-        for i, start_point in enumerate(start_points):
-            for result_holder in model_results:
-                populate_single_run_results(r_conn, start_point, result_holder, data_set_fit_from, full_data_set)
-            print('completed across models, windows, test_dists {!s} of {!s}'.format(i, n_dates_run))
-
-    summary = SummaryResults(model_results)
-    summary_frame = summary.summary_error_frame() 
-    
-    summary_frame_metric_plots('mse', summary_frame, -1, True)
-    summary_frame_metric_plots('mae', summary_frame, -1, True)
-    summary_frame_metric_plots('q3_abs', summary_frame, -1, True)
-    sim_frame = summary.sim_frame
-    realized_series = summary.realized_series
-    error_frame = summary.forecast_error_frame
-    plot_sim_realized_timeseries_group(sim_frame, realized_series, 'gjrGARCH', 'std')
-    plot_sim_realized_timeseries_group(sim_frame, realized_series, 'eGARCH', 'std')
-    
-    plot_resid_realized_timeseries_group(error_frame, realized_series, 'gjrGARCH', 'std')
-    plot_resid_realized_timeseries_group(error_frame, realized_series, 'eGARCH', 'std')
-    
-    plot_resid_rolling_realized_timeseries_group(error_frame, realized_series, 'gjrGARCH', 'std')
-    plot_resid_rolling_realized_timeseries_group(error_frame, realized_series, 'eGARCH', 'std')
-    
-    plot_sim_realized_timeseries_window_group(sim_frame, realized_series, '504', 'std')
-    plot_resid_realized_timeseries_window_group(error_frame, realized_series, '504', 'std')
-    plot_resid_rolling_realized_timeseries_window_group(error_frame, realized_series, '504', 'std')
-    
-    splits = summary.sim_frame.shape[0] // 3
-    split_0 = (0, splits)
-    split_1 = (splits, splits*2)
-    split_2 = (splits*2, -1)
-    summary_frame_split_0 = summary.summary_error_frame(*split_0)
-    summary_frame_split_1 = summary.summary_error_frame(*split_1)
-    summary_frame_split_2 = summary.summary_error_frame(*split_2)
-    
-    summary_frame_metric_plots('mse', summary_frame_split_0, 0, False)
-    summary_frame_metric_plots('mse', summary_frame_split_1, 1, False)
-    summary_frame_metric_plots('mse', summary_frame_split_2, 2, False)
+    return full_data_set
+
+
+def load_price_store(data_file=DATA_FILE):
+    """
+    Memory-mapped price history of data_file, converted under TMP_PATH on first use and whenever the file changes
+    :return: PriceStore
+    """
+    return PriceStore.for_data_file(data_file, load_full_data_set)
+
+
+def load_panel(data_file=PANEL_FILE, layout=PANEL_LAYOUT):
+    """
+    Price histories of a multi-asset file, tab separated with the dates in the first column
+    :param layout: 'wide', a close column per asset named by the asset, or 'long', asset and close columns
+        with a row per (date, asset)
+    :return: dict<asset: DataFrame with the DATA_COLUMNS>, each sorted by date without missing closes, in the
+        order the assets first appear
+    """
+    frame = pd.read_table(data_file, sep='\t')
+    date_column = frame.columns[0]
+    frame[date_column] = pd.to_datetime(frame[date_column])
+    if layout == 'wide':
+        closes = [(asset, frame[[date_column, asset]]) for asset in frame.columns[1:]]
+    elif layout == 'long':
+        asset_column, close_column = frame.columns[1], frame.columns[2]
+        closes = [(asset, group[[date_column, close_column]])
+                  for asset, group in frame.groupby(asset_column, sort=False)]
+    else:
+        raise ValueError('Unknown panel layout {!s}'.format(layout))
+    panel = {}
+    for asset, asset_frame in closes:
+        asset_frame = asset_frame.dropna().sort_values(date_column)
+        asset_frame.columns = DATA_COLUMNS
+        panel[str(asset)] = asset_frame.reset_index(drop=True)
+    return panel
+
+
+def load_panel_stores(data_file=PANEL_FILE, layout=PANEL_LAYOUT):
+    """
+    Memory-mapped price history of every asset of a multi-asset file, converted under TMP_PATH in one read of
+    the file on first use and whenever the file changes
+    :return: dict<asset: PriceStore>
+    """
+    return PriceStore.for_panel_file(data_file, lambda panel_file: load_panel(panel_file, layout))
+
+
+def sweep_start_points(n_total, n_forecast=N_FORECAST):
+    """
+    Start points of the sweep: one every n_forecast rows, leaving n_forecast rows after the last one for its
+    realized target
+    :param n_total: rows of the price history from the sweep's start date
+    :return: array of int
+    """
+    return np.arange(0, n_total - n_forecast - 1, n_forecast)
+
+
+def sweep_window_plan(price_store, look_backs=LOOK_BACKS, start_date=START_DATE, n_forecast=N_FORECAST):
+    """
+    Dates of the sweep over one price history, at the sweep_start_points from start_date
+    :return: DateWindowPlan
+    """
+    start_points = sweep_start_points(len(price_store) - price_store.position(start_date), n_forecast)
+    return DateWindowPlan.from_price_store(start_points, look_backs, price_store, start_date)
+
+
+def sweep_plan(result_store, data_file=DATA_FILE, panel_file=None, layout=PANEL_LAYOUT):
+    """
+    Plan of the configured sweep over a data file, or over every asset of a multi-asset file
+    :param panel_file: multi-asset price file, see load_panel, planned in place of data_file when given
+    :return: WorkPlan, list of RVolModelMultiDateResult, dict<asset: PriceStore>
+    """
+    if panel_file is not None:
+        price_stores = load_panel_stores(panel_file, layout)
+    else:
+        price_stores = {'': load_price_store(data_file)}
+    model_results = populate_result_holders(LOOK_BACKS, TEST_DISTS, MODEL_TYPES, N_FORECAST, N_SIM, REFIT_EVERY,
+                                            FORECAST_MODES, list(price_stores))
+    window_plans = dict((asset, sweep_window_plan(price_store, LOOK_BACKS, START_DATE, N_FORECAST))
+                        for asset, price_store in price_stores.items())
+    if panel_file is not None:
+        plan = WorkPlan.build_panel(result_store, window_plans, model_results)
+    else:
+        plan = WorkPlan.build(result_store, window_plans[''], model_results)
+    return plan, model_results, price_stores
+
+
+def run_compute(data_file=DATA_FILE, n_workers=N_WORKERS, warm_start=WARM_START, dry_run=False, panel_file=None,
+                layout=PANEL_LAYOUT):
+    """
+    Plan the sweep against the result store and run the missing fits, without any plotting import
+    Given a multi-asset file, the (asset, date, config) tasks of every asset are planned against the one result
+    store and run through one backend session or worker pool
+    :param data_file: price history file
+    :param n_workers: backend sessions, 1 runs serially
+    :param warm_start: fit each date from the previous date's coefficients
+    :param dry_run: only print the plan
+    :param panel_file: multi-asset price file, see load_panel, swept in place of data_file when given
+    :param layout: 'wide' or 'long', see load_panel
+    :return: WorkPlan, list of RVolModelMultiDateResult holding the sweep's stored and new results
+    """
+    with RVMResultStore() as result_store:
+        plan, model_results, price_stores = sweep_plan(result_store, data_file, panel_file, layout)
+        print(plan.report())
+        if panel_file is not None:
+            print('{!s} assets, {!s} fits to run, {!s} results stored'.format(
+                len(price_stores), plan.n_to_fit, len(plan.stored)))
+        else:
+            print('{!s} fits to run, {!s} results stored'.format(plan.n_to_fit, len(plan.stored)))
+        if dry_run:
+            return plan, model_results
+        plan.add_stored_results()
+        with RunMonitor(plan.n_to_fit) as monitor, open_sample_store() as sample_store:
+            monitor.cache_hits(plan.stored)
+            if plan.n_to_fit > 0:
+                if n_workers > 1:
+                    run_plan_parallel(plan, result_store, price_stores, n_workers, warm_start, monitor, sample_store)
+                else:
+                    run_plan(plan, result_store, price_stores, warm_start, monitor, sample_store)
+            monitor.report()
+    return plan, model_results
+
+
+def run_all_params(dry_run=False):
+    plan, model_results = run_compute(dry_run=dry_run)
+    if dry_run:
+        return plan
+    # plotting modules are only imported once the fits are done
+    from .report import run_report
+    run_report(model_results)
 
 
 if __name__ == '__main__':
-    run_all_params()
\ No newline at end of file
+    run_all_params(dry_run='--dry-run' in sys.argv[1:])
@@ -0,0 +1,76 @@
+import os
+import pandas as pd
+from py_garch import settings
+from py_garch.result_store import RVMResultStore, LAST_DATE_KEY
+from py_garch.realized import RealizedTargets
+from py_garch.result_viz import SummaryResults
+from py_garch.instrumentation import RunMonitor
+
+from .comparison import load_price_store, populate_result_holders, run_plan, run_plan_parallel, open_sample_store, \
+    sweep_start_points, sweep_window_plan
+from .default_inputs import TEST_DISTS, MODEL_TYPES, LOOK_BACKS, START_DATE, N_FORECAST, N_SIM, N_WORKERS, \
+    WARM_START, REFIT_EVERY, FORECAST_MODES
+from .planner import WorkPlan
+
+
+SUMMARY_NAME = 'summary_frames.pkl'
+
+
+def run_daily_update(summary_path=None):
+    """
+    Bring the sweep up to date with prices appended since the last update: plan only the start_points the
+    appended prices added to the sweep grid, refresh realized targets that were short of n_forecast returns,
+    and update the saved summary frames in place
+    The grid is the one of comparison.sweep_window_plan, a start point joins it once n_forecast prices follow
+    it, so new forecasts are stored with their full realized target
+    :param summary_path: pickle of the SummaryResults frames kept between updates, SUMMARY_NAME under TMP_PATH
+        when None
+    :return: SummaryResults, or None when no prices were appended
+    """
+    if summary_path is None:
+        summary_path = os.path.join(settings.get('TMP_PATH'), SUMMARY_NAME)
+    price_store = load_price_store()
+    last_date = pd.Timestamp(price_store.dates[-1])
+    model_results = populate_result_holders(LOOK_BACKS, TEST_DISTS, MODEL_TYPES, N_FORECAST, N_SIM, REFIT_EVERY,
+                                            FORECAST_MODES)
+
+    with RVMResultStore() as result_store:
+        previous = result_store.get_meta(LAST_DATE_KEY)
+        if previous is not None and pd.Timestamp(previous) >= last_date:
+            print('no prices appended since {!s}'.format(previous))
+            return None
+        window_plan = sweep_window_plan(price_store, LOOK_BACKS, START_DATE, N_FORECAST)
+        first_index = 0
+        if previous is not None:
+            # the grid over the prices up to the previous update was planned then
+            n_previous = price_store.position(pd.Timestamp(previous), side='right') - price_store.position(START_DATE)
+            first_index = len(sweep_start_points(n_previous, N_FORECAST))
+        plan = WorkPlan.build(result_store, window_plan, model_results, first_index)
+        revised = result_store.incomplete()
+        print('{!s} new start points, {!s} fits to run, {!s} realized targets to revise'.format(
+            len(window_plan.start_points) - first_index, plan.n_to_fit, len(revised)))
+        if plan.n_to_fit > 0:
+            with RunMonitor(plan.n_to_fit) as monitor, open_sample_store() as sample_store:
+                if N_WORKERS > 1:
+                    run_plan_parallel(plan, result_store, price_store, N_WORKERS, WARM_START, monitor, sample_store)
+                else:
+                    run_plan(plan, result_store, price_store, WARM_START, monitor, sample_store)
+                monitor.report()
+        # new results were scored as they were stored, only the revised targets are recomputed here
+        RealizedTargets(price_store).set_realized(revised)
+        result_store.append(revised)
+        changed = revised + [result for _, result in plan.pending_results if not result.is_failed]
+
+        if previous is not None and os.path.exists(summary_path):
+            summary = SummaryResults.load(model_results, summary_path)
+            summary.update_results(changed)
+        else:
+            result_store.fill_holders(model_results)
+            summary = SummaryResults(model_results)
+        summary.save(summary_path)
+        result_store.set_meta(LAST_DATE_KEY, last_date.strftime('%Y-%m-%d'))
+    return summary
+
+
+if __name__ == '__main__':
+    run_daily_update()
@@ -1,6 +1,6 @@
 import os
 import pandas as pd
-from r_garch.r_utilities import SOURCE_FILE
+from r_garch import SOURCE_FILE
 
 
 cur_path = os.path.dirname(os.path.realpath(__file__))
@@ -8,6 +8,10 @@ data_path = os.path.join(cur_path, "../data")
 DATA_FILE = os.path.join(data_path, 'sample_data.txt')
 
 DATA_COLUMNS = ['Date', 'Close']
+# multi-asset price file run by the panel compute, see exercise.comparison.load_panel: 'wide' has a close
+# column per asset, 'long' has date, asset and close columns
+PANEL_FILE = None
+PANEL_LAYOUT = 'wide'
 TEST_DISTS = ['std', 'norm']
 MODEL_TYPES = ['eGARCH', 'csGARCH', 'gjrGARCH']
 LOOK_BACKS = [252*2, 252*5, 252*10, -1]
@@ -15,5 +19,29 @@ START_DATE = pd.Timestamp(2018,1,1)
 #START_DATE = pd.Timestamp(1998,1,1)
 N_SIM = 5000
 N_FORECAST = 21
+# re-estimate every k-th date and filter the last fit forward in between, 1 refits at every date
+REFIT_EVERY = [1]
+# how forecast distributions are summarized, see py_garch.simulation.FORECAST_MODES: 'simulate' draws N_SIM
+# paths, 'adaptive' draws batches until the mean is precise enough with N_SIM as the cap, 'analytic' uses the
+# closed-form expected variance where the model has one
+FORECAST_MODES = ['simulate']
+# number of parallel backend sessions (R processes) used by run_all_params, 1 runs serially
+N_WORKERS = 1
+# supervision of backend sessions, see exercise.worker_pool.BackendWorkerPool: wall-clock seconds allowed per
+# fit before its session is killed and restarted, fits a session runs before it is restarted to release the
+# memory R accumulates, and retries of a failed fit before it is stored as failed
+FIT_TIMEOUT = 600
+RECYCLE_AFTER = 2000
+MAX_RETRIES = 2
+# seconds a work queue lease lasts without renewal, see exercise.work_queue: a live worker renews its lease
+# well within this, so a task held by a dead worker or host is claimed again soon after
+QUEUE_LEASE_SECONDS = 60
+# keep every simulated fit's annualized path vols in the sample store under TMP_PATH, see
+# py_garch.sample_store, so new distribution statistics need no refit; numpy backend only, about 20KB a fit
+KEEP_SAMPLES = False
+# processes rendering the report figures, 1 renders in the main process
+N_RENDER_WORKERS = 4
+# refit each window from the previous window's coefficients, falling back to a cold fit when that fails
+WARM_START = False
 
 R_CONN_INITIALIZATION_STRING = "source(\"" + SOURCE_FILE + "\")"
\ No newline at end of file
@@ -0,0 +1,18 @@
+import sys
+from py_garch.result_store import RVMResultStore
+
+
+def migrate_file_cache(cache_path=None, store_path=None):
+    """
+    Import the one-file-per-fit RVMSingleResultCache files into the consolidated result store
+    :param cache_path: directory holding the cached result files, TMP_PATH when None
+    :param store_path: SQLite result store file, the default store when None
+    :return: number of results imported
+    """
+    with RVMResultStore(store_path) as result_store:
+        return result_store.migrate_file_cache(cache_path)
+
+
+if __name__ == '__main__':
+    n_imported = migrate_file_cache(*sys.argv[1:])
+    print('imported {!s} cached results'.format(n_imported))
@@ -0,0 +1,217 @@
+import json
+import os
+import sys
+import numpy as np
+import pandas as pd
+from py_garch.result_store import RVMResultStore
+from py_garch.garch_backend import NumpyGarchBackend, RESULT_FIELDS, result_parity, backend_connection
+from py_garch.garch_engine import simulation_seed, parse_coefficients, result_prefix, split_returns, log_likelihood
+
+from .comparison import load_full_data_set
+from .default_inputs import R_CONN_INITIALIZATION_STRING, N_FORECAST
+
+
+PARITY_RTOL = .1
+PARITY_SAMPLE = 50
+
+# rugarch fits and forecasts on the sample data, checked in so the NumPy engine is tested against R without an
+# R install; written by write_reference on a host with R
+REFERENCE_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'tests', 'data',
+                              'r_reference.json')
+# (model_type, test_dist, window) of the reference fits, ending at REFERENCE_END_DATE
+REFERENCE_CASES = [('gjrGARCH', 'norm', 504), ('gjrGARCH', 'std', 1260), ('eGARCH', 'norm', 1260),
+                   ('eGARCH', 'std', 504), ('csGARCH', 'norm', 2520), ('csGARCH', 'std', 1260)]
+REFERENCE_END_DATE = pd.Timestamp(2018, 1, 2)
+REFERENCE_N_SIMS = 5000
+# both engines maximize the same likelihood: their fits may differ by at most this many nats, well inside the
+# 1.92 of a 95% likelihood-ratio interval, so the two coefficient sets are statistically the same fit
+LOGLIK_ATOL = .5
+# R and NumPy draw different paths, so forecast statistics differ by Monte Carlo error: allow this many standard
+# errors of the difference, scaled per field from the standard error of the trimmed mean (a quartile of a near
+# normal sample has 1.36 times its standard error, the 2.5% and 97.5% order statistics 2.7 times)
+MC_Z = 4.
+SE_FACTORS = {'quantile0': 3., 'quantile25': 1.5, 'quantile50': 1.5, 'quantile75': 1.5, 'quantile100': 3.,
+              'mean.sim.ann': 1.}
+# forecast shift allowed for fits within LOGLIK_ATOL of each other
+FIT_RTOL = .02
+
+
+def result_to_dict(result):
+    """
+    Rebuild the rGARCH result dict from a cached RVolModelSingleResult
+    :param result: RVolModelSingleResult
+    :return: dict
+    """
+    values = [result.quantile0_pct, result.quantile25_pct, result.quantile50_pct, result.quantile75_pct,
+              result.quantile100_pct, result.mean_sim_ann]
+    return {'{!s}_{!s}'.format(result.prefix, n): v for n, v in zip(RESULT_FIELDS, values)}
+
+
+def run_parity_check(store_path=None, n_sample=PARITY_SAMPLE, rtol=PARITY_RTOL, seed=0):
+    """
+    Refit a sample of stored rGARCH results with the NumPy backend and compare within rtol
+    :param store_path: RVMResultStore file holding results written by the R backend, the default store when None
+    :param n_sample: number of cached results checked
+    :param rtol: relative tolerance per result field
+    :return: list of (prefix, dict<field: relative difference>, passed)
+    """
+    full_data_set = load_full_data_set()
+    backend = NumpyGarchBackend(seed)
+    with RVMResultStore(store_path) as result_store:
+        preloaded = result_store.preload()
+    # results between refits are filtered rather than fitted, so only compare refit-every-date runs
+    stored = [preloaded[key] for key in sorted(preloaded.keys()) if preloaded[key].params.refit_every == 1][:n_sample]
+    report = []
+    for cached in stored:
+        params = cached.params
+        result_dict = backend.single_run(full_data_set, cached.data_start_date, cached.data_end_date,
+                                         params.n_forecast, params.model_type, params.test_dist, params.n_sims,
+                                         forecast_mode=params.forecast_mode)
+        diffs, passed = result_parity(result_to_dict(cached), result_dict, cached.prefix, rtol)
+        report.append((cached.prefix, diffs, passed))
+        print('{!s} {!s} max rel diff {:.4f}'.format(
+            'ok  ' if passed else 'FAIL', cached.prefix, max(diffs.values())))
+    return report
+
+
+def run_warm_start_check(store_path=None, n_sample=PARITY_SAMPLE, rtol=PARITY_RTOL, seed=0):
+    """
+    Refit stored results cold and warm-started from the previous date's stored coefficients, with the same
+    simulation seed, and compare within rtol
+    :param store_path: RVMResultStore file holding results with recorded coefficients, the default store when None
+    :param n_sample: number of results checked
+    :param rtol: relative tolerance per result field
+    :return: list of (prefix, dict<field: relative difference>, passed)
+    """
+    full_data_set = load_full_data_set()
+    backend = NumpyGarchBackend(seed)
+    with RVMResultStore(store_path) as result_store:
+        preloaded = result_store.preload()
+    stored = [preloaded[key] for key in sorted(preloaded.keys()) if preloaded[key].params.refit_every == 1]
+    pairs = [(previous, cached) for previous, cached in zip(stored[:-1], stored[1:])
+             if previous.params == cached.params and previous.coefficients is not None][:n_sample]
+    report = []
+    for previous, cached in pairs:
+        params = cached.params
+        run_args = (full_data_set, cached.data_start_date, cached.data_end_date, params.n_forecast,
+                    params.model_type, params.test_dist, params.n_sims, simulation_seed(cached.prefix))
+        cold_dict = backend.single_run(*run_args, forecast_mode=params.forecast_mode)
+        warm_dict = backend.single_run(*run_args, start_coef=parse_coefficients(previous.coefficients),
+                                       forecast_mode=params.forecast_mode)
+        diffs, passed = result_parity(cold_dict, warm_dict, cached.prefix, rtol)
+        report.append((cached.prefix, diffs, passed))
+        print('{!s} {!s} max rel diff {:.4f}, iterations cold {!s} warm {!s}'.format(
+            'ok  ' if passed else 'FAIL', cached.prefix, max(diffs.values()),
+            cold_dict['{!s}_solver.iterations'.format(cached.prefix)],
+            warm_dict['{!s}_solver.iterations'.format(cached.prefix)]))
+    return report
+
+
+def reference_jobs(full_data_set):
+    """
+    Start and end dates of the REFERENCE_CASES windows in the sample data
+    :return: list of (start_date, end_date, model_type, test_dist, window)
+    """
+    dates = pd.DatetimeIndex(full_data_set.Date)
+    end_position = dates.searchsorted(REFERENCE_END_DATE)
+    return [(dates[end_position - window], dates[end_position], model_type, test_dist, window)
+            for model_type, test_dist, window in REFERENCE_CASES]
+
+
+def write_reference(path=REFERENCE_FILE):
+    """
+    Fit and simulate REFERENCE_CASES with rugarch and write coefficients and forecast statistics to path
+    Needs R with rugarch, whatever GARCH_BACKEND is set to
+    :return: list of reference dicts written
+    """
+    full_data_set = load_full_data_set()
+    reference = []
+    with backend_connection('r', R_CONN_INITIALIZATION_STRING) as r_conn:
+        for start_date, end_date, model_type, test_dist, window in reference_jobs(full_data_set):
+            prefix = result_prefix(model_type, test_dist, REFERENCE_N_SIMS, N_FORECAST, start_date, end_date)
+            result_dict = r_conn.single_run(full_data_set, start_date, end_date, N_FORECAST, model_type, test_dist,
+                                            REFERENCE_N_SIMS, simulation_seed(prefix))
+            case = {'model_type': model_type, 'test_dist': test_dist, 'window': window,
+                    'start_date': start_date.strftime('%Y-%m-%d'), 'end_date': end_date.strftime('%Y-%m-%d'),
+                    'n_forecast': N_FORECAST, 'n_sims': REFERENCE_N_SIMS}
+            for field in RESULT_FIELDS + ['coefficients', 'sim.std.error']:
+                case[field] = result_dict['{!s}_{!s}'.format(prefix, field)]
+            reference.append(case)
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as reference_file:
+        json.dump(reference, reference_file, indent=1)
+    return reference
+
+
+def load_reference(path=REFERENCE_FILE):
+    """
+    :return: list of reference dicts from write_reference, None when the file is missing
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path) as reference_file:
+        return json.load(reference_file)
+
+
+def reference_parity(case, full_data_set, seed=0):
+    """
+    Fit and simulate a reference case with the NumPy engine and compare: the log-likelihood of our fit against
+    that of the R coefficients, within LOGLIK_ATOL, and each forecast statistic within its Monte Carlo tolerance
+    :param case: dict from load_reference
+    :return: list of (field, absolute difference, tolerance)
+    """
+    start_date = pd.Timestamp(case['start_date'])
+    end_date = pd.Timestamp(case['end_date'])
+    model_type = case['model_type']
+    test_dist = case['test_dist']
+    candidate = NumpyGarchBackend(seed).single_run(full_data_set, start_date, end_date, case['n_forecast'],
+                                                   model_type, test_dist, case['n_sims'])
+    prefix = result_prefix(model_type, test_dist, case['n_sims'], case['n_forecast'], start_date, end_date)
+    returns = split_returns(full_data_set, start_date, end_date)[0]
+    checks = [('log_likelihood',
+               abs(log_likelihood(returns, model_type, test_dist,
+                                  parse_coefficients(candidate['{!s}_coefficients'.format(prefix)])) -
+                   log_likelihood(returns, model_type, test_dist, parse_coefficients(case['coefficients']))),
+               LOGLIK_ATOL)]
+    std_error = np.sqrt(case['sim.std.error'] ** 2 + candidate['{!s}_sim.std.error'.format(prefix)] ** 2)
+    for field in RESULT_FIELDS:
+        reference = case[field]
+        tolerance = MC_Z * SE_FACTORS[field] * std_error + FIT_RTOL * abs(reference)
+        checks.append((field, abs(candidate['{!s}_{!s}'.format(prefix, field)] - reference), tolerance))
+    return checks
+
+
+def run_reference_check(path=REFERENCE_FILE):
+    """
+    reference_parity over every checked-in reference case
+    :return: list of (case label, checks, passed)
+    """
+    reference = load_reference(path)
+    if reference is None:
+        raise IOError('No R reference at {!s}, write one with --write-reference on a host with R'.format(path))
+    full_data_set = load_full_data_set()
+    report = []
+    for case in reference:
+        checks = reference_parity(case, full_data_set)
+        passed = all(diff <= tolerance for _, diff, tolerance in checks)
+        label = '{!s}_{!s}_{!s}'.format(case['model_type'], case['test_dist'], case['window'])
+        report.append((label, checks, passed))
+        print('{!s} {!s} {!s}'.format('ok  ' if passed else 'FAIL', label, ', '.join(
+            '{!s} {:.4g}/{:.4g}'.format(field, diff, tolerance) for field, diff, tolerance in checks)))
+    return report
+
+
+if __name__ == '__main__':
+    if '--write-reference' in sys.argv[1:]:
+        print('{!s} reference cases written to {!s}'.format(len(write_reference()), REFERENCE_FILE))
+        sys.exit(0)
+    if '--reference' in sys.argv[1:]:
+        parity_report = run_reference_check()
+    elif '--warm-start' in sys.argv[1:]:
+        parity_report = run_warm_start_check()
+    else:
+        parity_report = run_parity_check()
+    n_failed = len([r for r in parity_report if not r[2]])
+    print('{!s} of {!s} cached results outside tolerance'.format(n_failed, len(parity_report)))
+    sys.exit(1 if n_failed > 0 else 0)
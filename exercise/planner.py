@@ -0,0 +1,232 @@
+import pandas as pd
+from py_garch.vol_estimator import RVolModelSingleResult
+from py_garch.garch_engine import simulation_seed, parse_coefficients
+
+
+FIT_STAGE = 0
+FILTER_STAGE = 1
+# failure recorded on a filter task whose refit failed or is neither stored nor planned, see refit_coefficients
+REFIT_UNAVAILABLE = 'refit unavailable'
+
+
+def result_job(result, start_coef=None, fixed_coef=None):
+    """
+    Backend job tuple for an unfilled RVolModelSingleResult
+    :param start_coef: optional dict of starting coefficients for a warm-started fit
+    :param fixed_coef: optional dict of coefficients to filter with instead of fitting
+    :return: (start_date, end_date, n_forecast, model_type, test_dist, n_simulations, seed, start_coef,
+        fixed_coef, refit_every, forecast_mode)
+    """
+    return (result.data_start_date,
+            result.data_end_date,
+            result.params.n_forecast,
+            result.params.model_type,
+            result.params.test_dist,
+            result.params.n_sims,
+            simulation_seed(result.prefix if not result.params.asset else
+                            '{!s}_{!s}'.format(result.params.asset, result.prefix)),
+            start_coef,
+            fixed_coef,
+            result.params.refit_every,
+            result.params.forecast_mode)
+
+
+def refit_coefficients(refit):
+    """
+    Coefficients a filter task filters with, read once the fit stage has run
+    :param refit: RVolModelSingleResult of the task's refit, or None
+    :return: dict, or None when the refit is missing, failed or holds no coefficients
+    """
+    if refit is None or refit.is_failed:
+        return None
+    return parse_coefficients(refit.coefficients)
+
+
+class WorkPlan(object):
+    """
+    Every (start_point, AllDatesVolModelRunParams) task of a sweep, diffed against the result store before
+    any backend session starts
+    start_points: array of positions in data_set_test
+    model_results: list of RVolModelMultiDateResult
+
+    A holder with refit_every k refits at every k-th start_point, counted from the first, and filters that
+    fit forward at the start_points in between. Filter tasks need their refit's coefficients, so they run
+    in a second stage once every fit is stored.
+
+    Attributes:
+        stored: list of (result_holder, RVolModelSingleResult) already in the store
+        batches: list of lists of (result_holder, unfilled RVolModelSingleResult) to fit, one list per start_point
+        chains: list of lists of (result_holder, unfilled RVolModelSingleResult) to fit, one list per run of
+            consecutive refit dates missing from the store for a holder, in date order
+        chain_starts: list of coefficient dicts (or None) of the stored fit just before each chain
+        filter_batches: list of lists of (result_holder, unfilled RVolModelSingleResult, refit
+            RVolModelSingleResult) to filter, one list per start_point; the refit is None when it is neither
+            stored nor planned, and a task whose refit is unavailable is failed rather than fitted, see
+            unavailable_filters
+    """
+    n_stages = 2
+
+    def __init__(self, start_points, model_results):
+        self.start_points = start_points
+        self.model_results = model_results
+        self.stored = []
+        self.batches = []
+        self.chains = []
+        self.chain_starts = []
+        self.filter_batches = []
+
+    @classmethod
+    def build(cls, result_store, window_plan, model_results, first_index=0):
+        """
+        Enumerate all tasks and resolve stored results in bulk
+        :param result_store: RVMResultStore
+        :param window_plan: DateWindowPlan covering every holder's window
+        :param first_index: position in window_plan.start_points to plan from, earlier ones are left out;
+            refit dates still count from the first start_point
+        :return: WorkPlan
+        """
+        plan = cls(window_plan.start_points, model_results)
+        # per holder: the open chain of missing refits, the coefficients of the last stored fit and the
+        # latest refit result, stored or pending
+        open_chains = dict((id(result_holder), []) for result_holder in model_results)
+        last_coef = dict((id(result_holder), None) for result_holder in model_results)
+        last_refit = {}
+        for index in range(first_index, len(window_plan.start_points)):
+            pending = []
+            pending_filter = []
+            for result_holder in model_results:
+                input_start_date, input_end_date = window_plan.get_start_end_dates(index, result_holder.params.window)
+                result = result_store.lookup(input_start_date, input_end_date, result_holder.params)
+                is_refit = index % result_holder.params.refit_every == 0
+                # a fit stored as failed is planned again
+                if result is not None and not result.is_failed:
+                    plan.stored.append((result_holder, result))
+                    if is_refit:
+                        plan._close_chain(open_chains[id(result_holder)], last_coef[id(result_holder)])
+                        open_chains[id(result_holder)] = []
+                        last_coef[id(result_holder)] = parse_coefficients(result.coefficients)
+                        last_refit[id(result_holder)] = result
+                    continue
+                result = RVolModelSingleResult(input_start_date, input_end_date, result_holder.params)
+                if is_refit:
+                    pending.append((result_holder, result))
+                    open_chains[id(result_holder)].append((result_holder, result))
+                    last_refit[id(result_holder)] = result
+                else:
+                    refit = last_refit.get(id(result_holder))
+                    if refit is None:
+                        refit_index = index - index % result_holder.params.refit_every
+                        refit = result_store.lookup(*window_plan.get_start_end_dates(
+                            refit_index, result_holder.params.window), params=result_holder.params)
+                        last_refit[id(result_holder)] = refit
+                    pending_filter.append((result_holder, result, refit))
+            if len(pending) > 0:
+                plan.batches.append(pending)
+            if len(pending_filter) > 0:
+                plan.filter_batches.append(pending_filter)
+        for result_holder in model_results:
+            plan._close_chain(open_chains[id(result_holder)], last_coef[id(result_holder)])
+        return plan
+
+    @classmethod
+    def build_panel(cls, result_store, window_plans, model_results):
+        """
+        Plan of a multi-asset panel, each asset's holders planned over that asset's dates; a batch or chain
+        never mixes assets, so each goes to the backend with one price history
+        :param window_plans: dict<asset: DateWindowPlan>
+        :param model_results: list of RVolModelMultiDateResult, params.asset naming their window plan
+        :return: WorkPlan, start_points is a dict<asset: start_points>
+        """
+        plan = cls({}, model_results)
+        for asset, window_plan in window_plans.items():
+            asset_plan = cls.build(result_store, window_plan, [result_holder for result_holder in model_results
+                                                               if result_holder.params.asset == asset])
+            plan.start_points[asset] = asset_plan.start_points
+            for name in ['stored', 'batches', 'chains', 'chain_starts', 'filter_batches']:
+                getattr(plan, name).extend(getattr(asset_plan, name))
+        return plan
+
+    def _close_chain(self, chain, start_coef):
+        if len(chain) > 0:
+            self.chains.append(chain)
+            self.chain_starts.append(start_coef)
+
+    @property
+    def n_to_fit(self):
+        return len(self.pending_results)
+
+    @property
+    def pending_results(self):
+        """
+        :return: list of (result_holder, RVolModelSingleResult) for every task to fit or filter
+        """
+        return [(result_holder, result) for pending in self.batches for result_holder, result in pending] + \
+            [(result_holder, result) for pending in self.filter_batches for result_holder, result, _ in pending]
+
+    def add_stored_results(self):
+        """
+        Add the stored results to their holders
+        :return: None
+        """
+        for result_holder, result in self.stored:
+            result_holder.add_result(result)
+
+    def _available_filter_batches(self):
+        batches = [[(result_holder, result, refit_coefficients(refit)) for result_holder, result, refit in pending]
+                   for pending in self.filter_batches]
+        batches = [[task for task in pending if task[2] is not None] for pending in batches]
+        return [pending for pending in batches if len(pending) > 0]
+
+    def unavailable_filters(self):
+        """
+        Filter tasks left out of the filter stage because their refit failed, is missing or holds no
+        coefficients; filtering needs the refit, and a full fit would be stored under the task's refit_every
+        :return: list of (result_holder, unfilled RVolModelSingleResult), to store failed with REFIT_UNAVAILABLE
+        """
+        return [(result_holder, result) for pending in self.filter_batches for result_holder, result, refit in pending
+                if refit_coefficients(refit) is None]
+
+    def work_batches(self, warm_start=False, stage=FIT_STAGE):
+        """
+        :param warm_start: batch fits by chain rather than by start_point
+        :param stage: FIT_STAGE or FILTER_STAGE, filter tasks without their refit's coefficients are left out
+        :return: list of lists of (result_holder, unfilled RVolModelSingleResult)
+        """
+        if stage == FILTER_STAGE:
+            return [[(result_holder, result) for result_holder, result, _ in pending]
+                    for pending in self._available_filter_batches()]
+        return self.chains if warm_start else self.batches
+
+    def job_batches(self, warm_start=False, stage=FIT_STAGE):
+        """
+        Filter stage jobs read their refit's coefficients, so build them only after the fit stage has run
+        :param warm_start: one batch per chain, its first job started from the stored fit before it
+        :param stage: FIT_STAGE or FILTER_STAGE
+        :return: list of lists of backend job tuples, aligned with work_batches(warm_start, stage)
+        """
+        if stage == FILTER_STAGE:
+            return [[result_job(result, fixed_coef=fixed_coef) for _, result, fixed_coef in pending]
+                    for pending in self._available_filter_batches()]
+        if warm_start:
+            return [[result_job(result, start_coef if i == 0 else None) for i, (_, result) in enumerate(chain)]
+                    for chain, start_coef in zip(self.chains, self.chain_starts)]
+        return [[result_job(result) for _, result in pending] for pending in self.batches]
+
+    def report(self):
+        """
+        Dry-run summary of the plan by config
+        :return: DataFrame indexed by (asset, model_type, test_dist, window, refit_every, forecast_mode) with
+            n_tasks, n_stored, n_to_fit, n_to_filter columns
+        """
+        def config(h):
+            return (h.params.asset, h.params.model_type, h.params.test_dist, h.params.window, h.params.refit_every,
+                    h.params.forecast_mode)
+
+        rows = [config(h) + (1, 0, 0) for h, _ in self.stored] + \
+            [config(h) + (0, 1, 0) for pending in self.batches for h, _ in pending] + \
+            [config(h) + (0, 0, 1) for pending in self.filter_batches for h, _, _ in pending]
+        config_columns = ['asset', 'model_type', 'test_dist', 'window', 'refit_every', 'forecast_mode']
+        frame = pd.DataFrame(rows, columns=config_columns + ['n_stored', 'n_to_fit', 'n_to_filter'])
+        report = frame.groupby(config_columns).sum()
+        report.insert(0, 'n_tasks', report.n_stored + report.n_to_fit + report.n_to_filter)
+        return report
@@ -0,0 +1,40 @@
+import os
+from py_garch import settings
+from py_garch.result_store import RVMResultStore
+from py_garch.result_viz import SummaryResults
+from py_garch.figure_render import FigureRenderer, summary_figure_specs
+
+from .comparison import populate_result_holders
+from .default_inputs import TEST_DISTS, MODEL_TYPES, LOOK_BACKS, N_FORECAST, N_SIM, REFIT_EVERY, \
+    FORECAST_MODES, N_RENDER_WORKERS
+
+
+# cross-asset metric summary of a multi-asset panel, written next to the figures
+CROSS_ASSET_NAME = 'cross_asset_metrics.csv'
+
+
+def run_report(model_results=None, n_render_workers=N_RENDER_WORKERS):
+    """
+    Summary frames and figures of the sweep, read from the result store alone: no data file or backend session
+    The results of a multi-asset panel are also summarized across assets, into CROSS_ASSET_NAME under PLOT_PATH
+    :param model_results: list of RVolModelMultiDateResult already holding the results, filled from the store
+        for every stored asset when None
+    :param n_render_workers: figure rendering processes
+    :return: SummaryResults, or None when no result is stored for the sweep
+    """
+    if model_results is None:
+        with RVMResultStore() as result_store:
+            model_results = populate_result_holders(LOOK_BACKS, TEST_DISTS, MODEL_TYPES, N_FORECAST, N_SIM,
+                                                    REFIT_EVERY, FORECAST_MODES, result_store.assets() or [''])
+            result_store.fill_holders(model_results)
+    if all(len(result_holder) == 0 for result_holder in model_results):
+        print('no results stored for the sweep, run the compute step first')
+        return None
+    summary = SummaryResults(model_results)
+    if summary.is_panel:
+        cross_asset_path = os.path.join(settings.get('PLOT_PATH'), CROSS_ASSET_NAME)
+        summary.cross_asset_frame().to_csv(cross_asset_path)
+        print('cross-asset metrics written to {!s}'.format(cross_asset_path))
+    n_rendered, n_current = FigureRenderer(n_workers=n_render_workers).render(summary_figure_specs(summary))
+    print('{!s} figures rendered, {!s} already current'.format(n_rendered, n_current))
+    return summary
@@ -0,0 +1,390 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+import pandas as pd
+from py_garch import settings
+from py_garch.vol_estimator import AllDatesVolModelRunParams, RVolModelSingleResult
+from py_garch.result_store import RVMResultStore, PARAM_COLUMNS
+from py_garch.realized import RealizedTargets
+from py_garch.instrumentation import RunMonitor
+
+from .default_inputs import DATA_FILE, PANEL_LAYOUT, R_CONN_INITIALIZATION_STRING, FIT_TIMEOUT, RECYCLE_AFTER, \
+    MAX_RETRIES, QUEUE_LEASE_SECONDS
+from .comparison import sweep_plan, load_price_store, load_panel_stores, store_results, store_failed, \
+    open_sample_store
+from .planner import result_job, refit_coefficients, FIT_STAGE, FILTER_STAGE, REFIT_UNAVAILABLE
+from .worker_pool import BackendWorkerPool
+
+
+QUEUE_NAME = 'work_queue.sqlite'
+# task states: a leased task whose lease ran out is claimable again, done and failed tasks are finished
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+# seconds a claim or update waits on another process's transaction
+BUSY_TIMEOUT = 60.
+# seconds an idle worker waits before claiming again while other workers finish the open stage
+POLL_SECONDS = 2.
+# completions counted for the throughput and ETA of progress
+RATE_SECONDS = 300.
+
+
+def _result_key(result):
+    return list(RVMResultStore.result_key(result))
+
+
+def _key_result(key):
+    names = [name for name, _, _ in PARAM_COLUMNS]
+    params = AllDatesVolModelRunParams.from_key_values(dict(zip(names, key[:len(names)])))
+    return RVolModelSingleResult(pd.Timestamp(key[len(names)]), pd.Timestamp(key[len(names) + 1]), params)
+
+
+def _stored(result_store, result):
+    return result_store.lookup(result.data_start_date, result.data_end_date, result.params)
+
+
+def default_worker_id():
+    return '{!s}:{!s}'.format(socket.gethostname(), os.getpid())
+
+
+class QueueTask(object):
+    """
+    One claimed batch of a work queue, the tasks of a WorkPlan batch, chain or filter batch
+    task_id: int
+    stage: FIT_STAGE or FILTER_STAGE
+    asset: key of the price history the batch is fitted on
+    payload: dict with results, the store keys of the batch's results; start_coef, the coefficients a
+        warm-started chain starts from; refits, the store key of each filter result's refit or None
+    attempts: claims of the task so far, this one included
+    """
+    def __init__(self, task_id, stage, asset, payload, attempts):
+        self.task_id = task_id
+        self.stage = stage
+        self.asset = asset
+        self.payload = payload
+        self.attempts = attempts
+
+    @property
+    def warm_start(self):
+        return 'start_coef' in self.payload
+
+    def results(self):
+        """
+        :return: list of unfilled RVolModelSingleResult
+        """
+        return [_key_result(key) for key in self.payload['results']]
+
+    def jobs(self, results, result_store):
+        """
+        Backend jobs of the batch, filter jobs reading their refit's coefficients from the store
+        :param results: list of RVolModelSingleResult from results()
+        :return: list of job tuples, None for a filter job whose refit is unavailable, see
+            planner.refit_coefficients
+        """
+        if self.stage == FILTER_STAGE:
+            refits = [None if key is None else _stored(result_store, _key_result(key))
+                      for key in self.payload['refits']]
+            fixed_coefs = [refit_coefficients(refit) for refit in refits]
+            return [None if fixed_coef is None else result_job(result, fixed_coef=fixed_coef)
+                    for result, fixed_coef in zip(results, fixed_coefs)]
+        if self.warm_start:
+            return [result_job(result, self.payload['start_coef'] if i == 0 else None)
+                    for i, result in enumerate(results)]
+        return [result_job(result) for result in results]
+
+
+class WorkQueue(object):
+    """
+    Durable queue of a sweep's batches in one SQLite file, drained by any number of worker processes on one
+    host, or on several hosts sharing the file on a filesystem with working locks
+    A worker claims a batch with a lease it renews while fitting. A batch whose lease runs out, because its
+    worker or host died, is claimed again, up to max_retries times after the first claim, then marked failed.
+    Filter batches read their refit's coefficients, so they are claimable only once every fit batch is finished
+    path: SQLite file, QUEUE_NAME under TMP_PATH when None
+    lease_seconds: lease length
+    max_retries: claims of a batch after the first before it is failed
+    """
+    def __init__(self, path=None, lease_seconds=QUEUE_LEASE_SECONDS, max_retries=MAX_RETRIES):
+        self.path = self.default_path() if path is None else path
+        self.lease_seconds = lease_seconds
+        self.max_retries = max_retries
+        self.conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS tasks (task_id INTEGER PRIMARY KEY, stage INTEGER, '
+                          'asset TEXT, payload TEXT, n_jobs INTEGER, status TEXT, worker TEXT, '
+                          'lease_expires REAL, attempts INTEGER, error TEXT, finished REAL)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS tasks_claim ON tasks (stage, status)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)')
+
+    @classmethod
+    def default_path(cls):
+        return os.path.join(settings.get('TMP_PATH'), QUEUE_NAME)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def _transaction(self, function):
+        # BEGIN IMMEDIATE takes the write lock up front, so two workers never claim the same task
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            value = function()
+        except Exception:
+            self.conn.execute('ROLLBACK')
+            raise
+        self.conn.execute('COMMIT')
+        return value
+
+    def seed(self, plan, warm_start=False, source=None):
+        """
+        Replace the queue's tasks with the batches of a plan
+        :param plan: WorkPlan
+        :param warm_start: queue fit chains rather than batches per start_point, see WorkPlan.work_batches
+        :param source: dict describing the price data, read by workers through source()
+        :return: int, batches queued
+        """
+        rows = []
+        if warm_start:
+            for chain, start_coef in zip(plan.chains, plan.chain_starts):
+                rows.append((FIT_STAGE, chain, {'start_coef': start_coef}))
+        else:
+            rows += [(FIT_STAGE, pending, {}) for pending in plan.batches]
+        for pending in plan.filter_batches:
+            rows.append((FILTER_STAGE, [(h, result) for h, result, _ in pending],
+                         {'refits': [None if refit is None else _result_key(refit) for _, _, refit in pending]}))
+
+        def insert():
+            self.conn.execute('DELETE FROM tasks')
+            self.conn.execute('INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)',
+                              ('source', json.dumps(source)))
+            for stage, pending, payload in rows:
+                payload['results'] = [_result_key(result) for _, result in pending]
+                self.conn.execute('INSERT INTO tasks (stage, asset, payload, n_jobs, status, attempts) '
+                                  'VALUES (?, ?, ?, ?, ?, 0)', (stage, pending[0][1].params.asset,
+                                                                json.dumps(payload), len(pending), PENDING))
+        self._transaction(insert)
+        return len(rows)
+
+    def source(self):
+        """
+        :return: dict given to seed, None before the queue is seeded
+        """
+        row = self.conn.execute("SELECT value FROM meta WHERE name = 'source'").fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def claim(self, worker_id):
+        """
+        Lease the next claimable batch of the open stage, the first stage with unfinished batches
+        :return: QueueTask, or None when nothing is claimable now
+        """
+        def lease():
+            now = time.time()
+            self.conn.execute("UPDATE tasks SET status = ?, error = 'lease expired', finished = ? "
+                              'WHERE status = ? AND lease_expires < ? AND attempts > ?',
+                              (FAILED, now, LEASED, now, self.max_retries))
+            row = self.conn.execute('SELECT MIN(stage) FROM tasks WHERE status IN (?, ?)', (PENDING, LEASED)).fetchone()
+            if row[0] is None:
+                return None
+            row = self.conn.execute('SELECT task_id, stage, asset, payload, attempts, n_jobs FROM tasks '
+                                    'WHERE stage = ? AND (status = ? OR (status = ? AND lease_expires < ?)) '
+                                    'ORDER BY task_id LIMIT 1', (row[0], PENDING, LEASED, now)).fetchone()
+            if row is None:
+                return None
+            task_id, stage, asset, payload, attempts, n_jobs = row
+            self.conn.execute('UPDATE tasks SET status = ?, worker = ?, lease_expires = ?, attempts = ? '
+                              'WHERE task_id = ?', (LEASED, worker_id, now + self.lease_seconds, attempts + 1,
+                                                    task_id))
+            return QueueTask(task_id, stage, asset, json.loads(payload), attempts + 1)
+        return self._transaction(lease)
+
+    def renew(self, task_id, worker_id):
+        """
+        Extend a lease still held by worker_id
+        :return: bool, False when the lease was lost to another worker
+        """
+        cursor = self.conn.execute('UPDATE tasks SET lease_expires = ? WHERE task_id = ? AND worker = ? AND '
+                                   'status = ?', (time.time() + self.lease_seconds, task_id, worker_id, LEASED))
+        return cursor.rowcount > 0
+
+    def complete(self, task_id):
+        """
+        Mark a batch done, whichever worker holds it: a batch run twice writes the same results
+        :return: None
+        """
+        self.conn.execute('UPDATE tasks SET status = ?, lease_expires = NULL, finished = ? WHERE task_id = ?',
+                          (DONE, time.time(), task_id))
+
+    def fail(self, task_id, error):
+        """
+        Release a batch whose run raised, to be claimed again, or mark it failed when out of retries
+        :return: None
+        """
+        self.conn.execute('UPDATE tasks SET status = CASE WHEN attempts > ? THEN ? ELSE ? END, error = ?, '
+                          'lease_expires = NULL, finished = ? WHERE task_id = ?',
+                          (self.max_retries, FAILED, PENDING, error, time.time(), task_id))
+
+    def is_drained(self):
+        """
+        :return: bool, whether every batch is done or failed
+        """
+        row = self.conn.execute('SELECT COUNT(*) FROM tasks WHERE status IN (?, ?)', (PENDING, LEASED)).fetchone()
+        return row[0] == 0
+
+    def progress(self):
+        """
+        Batches and fits per stage and state
+        :return: DataFrame indexed by (stage, status) with n_tasks and n_jobs columns
+        """
+        frame = pd.read_sql_query('SELECT stage, status, COUNT(*) AS n_tasks, SUM(n_jobs) AS n_jobs FROM tasks '
+                                  'GROUP BY stage, status', self.conn)
+        return frame.set_index(['stage', 'status'])
+
+    def progress_line(self):
+        """
+        One line of overall progress: fits finished of queued, failed fits, workers holding a lease, and the
+        throughput and ETA over the last RATE_SECONDS of completions
+        :return: str
+        """
+        now = time.time()
+        n_total, n_done, n_failed, n_workers = self.conn.execute(
+            'SELECT COALESCE(SUM(n_jobs), 0), COALESCE(SUM(CASE WHEN status = ? THEN n_jobs END), 0), '
+            'COALESCE(SUM(CASE WHEN status = ? THEN n_jobs END), 0), '
+            'COUNT(DISTINCT CASE WHEN status = ? AND lease_expires >= ? THEN worker END) FROM tasks',
+            (DONE, FAILED, LEASED, now)).fetchone()
+        n_recent, first_finished = self.conn.execute(
+            'SELECT COALESCE(SUM(n_jobs), 0), MIN(finished) FROM tasks WHERE status = ? AND finished >= ?',
+            (DONE, now - RATE_SECONDS)).fetchone()
+        rate = n_recent / max(now - first_finished, 1.) if n_recent > 0 else 0.
+        n_left = n_total - n_done - n_failed
+        eta = '--' if rate == 0 or n_left == 0 else '{:.0f}s'.format(n_left / rate)
+        return '{!s} of {!s} fits done, {!s} failed, {!s} workers, {:.2f} fits/s, ETA {!s}'.format(
+            n_done, n_total, n_failed, n_workers, rate, eta)
+
+
+class LeaseKeeper(object):
+    """
+    Background thread renewing a worker's lease on its current batch while the batch runs in the worker pool
+    path: queue file, the thread opens its own connection to it
+    worker_id: str
+    lease_seconds: lease length, renewed every third of it
+    """
+    def __init__(self, path, worker_id, lease_seconds):
+        self.path = path
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.task_id = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.stopped.set()
+        self.thread.join()
+
+    def _run(self):
+        with WorkQueue(self.path, self.lease_seconds) as work_queue:
+            while not self.stopped.wait(self.lease_seconds / 3.):
+                task_id = self.task_id
+                if task_id is not None:
+                    work_queue.renew(task_id, self.worker_id)
+
+
+def seed_queue(data_file=DATA_FILE, panel_file=None, layout=PANEL_LAYOUT, warm_start=False, queue_path=None):
+    """
+    Plan the sweep against the result store and queue its missing fits for drain_queue workers
+    :param panel_file: multi-asset price file planned in place of data_file, see comparison.load_panel
+    :return: WorkPlan
+    """
+    with RVMResultStore() as result_store:
+        plan, _, _ = sweep_plan(result_store, data_file, panel_file, layout)
+    source = {'data_file': None if data_file is None else os.path.abspath(data_file),
+              'panel_file': None if panel_file is None else os.path.abspath(panel_file),
+              'layout': layout, 'warm_start': warm_start}
+    with WorkQueue(queue_path) as work_queue:
+        n_tasks = work_queue.seed(plan, warm_start, source)
+        print('{!s} batches of {!s} fits queued in {!s}'.format(n_tasks, plan.n_to_fit, work_queue.path))
+    return plan
+
+
+def _data_sets(source):
+    if source['panel_file'] is not None:
+        return load_panel_stores(source['panel_file'], source['layout'])
+    return {'': load_price_store(source['data_file'])}
+
+
+def drain_queue(queue_path=None, worker_id=None, lease_seconds=QUEUE_LEASE_SECONDS, poll_seconds=POLL_SECONDS):
+    """
+    Claim and run queued batches in one supervised backend session until the queue is drained, writing
+    results to the shared result store; run as many of these, on as many hosts, as wanted
+    :param worker_id: name of the worker in leases, host:pid when None
+    :return: int, batches run by this worker
+    """
+    worker_id = default_worker_id() if worker_id is None else worker_id
+    n_run = 0
+    with WorkQueue(queue_path, lease_seconds) as work_queue:
+        source = work_queue.source()
+        if source is None:
+            raise ValueError('Work queue {!s} is not seeded'.format(work_queue.path))
+        data_sets = _data_sets(source)
+        realized = {}
+        progress = work_queue.progress()
+        n_left = int(progress[progress.index.get_level_values('status').isin([PENDING, LEASED])].n_jobs.sum())
+        with open_sample_store() as sample_store, \
+                BackendWorkerPool(settings.get('GARCH_BACKEND'), R_CONN_INITIALIZATION_STRING, data_sets, 1,
+                                  FIT_TIMEOUT, RECYCLE_AFTER, MAX_RETRIES, sample_store is not None) as pool, \
+                RVMResultStore() as result_store, RunMonitor(n_left) as monitor, \
+                LeaseKeeper(work_queue.path, worker_id, lease_seconds) as lease_keeper:
+            stage_seen = FIT_STAGE
+            while True:
+                task = work_queue.claim(worker_id)
+                if task is None:
+                    if work_queue.is_drained():
+                        break
+                    time.sleep(poll_seconds)
+                    continue
+                if task.stage != stage_seen:
+                    # refits stored by other workers since the store was preloaded
+                    result_store.cached = None
+                    stage_seen = task.stage
+                lease_keeper.task_id = task.task_id
+                try:
+                    results = task.results()
+                    jobs = task.jobs(results, result_store)
+                    unavailable = [(None, result) for result, job in zip(results, jobs) if job is None]
+                    if len(unavailable) > 0:
+                        store_failed(result_store, unavailable, REFIT_UNAVAILABLE)
+                        monitor.tasks_failed(unavailable, REFIT_UNAVAILABLE)
+                    pending = [(None, result) for result, job in zip(results, jobs) if job is not None]
+                    if task.asset not in realized:
+                        realized[task.asset] = RealizedTargets(data_sets[task.asset])
+                    for _, positions, result_dict, backend_metrics, failure in pool.run(
+                            [[job for job in jobs if job is not None]], task.warm_start, [task.asset]):
+                        done = [pending[position] for position in positions]
+                        if failure is not None:
+                            store_failed(result_store, done, failure)
+                            monitor.tasks_failed(done, failure)
+                            continue
+                        timings, fit_bytes, peak_bytes = backend_metrics
+                        store_seconds = store_results(result_store, done, result_dict, realized[task.asset],
+                                                      sample_store)
+                        monitor.batch_done(done, timings, fit_bytes, store_seconds, peak_bytes)
+                    work_queue.complete(task.task_id)
+                    n_run += 1
+                except Exception:
+                    work_queue.fail(task.task_id, traceback.format_exc().strip().splitlines()[-1])
+                finally:
+                    lease_keeper.task_id = None
+        print(work_queue.progress_line())
+    return n_run
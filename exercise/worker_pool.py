@@ -0,0 +1,276 @@
+import collections
+import multiprocessing
+import os
+import queue
+import signal
+import time
+import traceback
+from py_garch.garch_backend import backend_connection
+
+
+# seconds the supervisor waits on results before checking its workers for timeouts and deaths
+POLL_SECONDS = 1.
+# seconds from sending a task to its worker reporting it started: the worker's spawn, R start-up, sourcing
+# rGarch.r and loading the asset's prices, which do not count against fit_timeout
+START_TIMEOUT = 600.
+# seconds a worker is given to exit on the sentinel, when recycled or at shutdown, before it is killed
+EXIT_TIMEOUT = 30.
+# payload of the message a worker sends when it starts a task, fit_timeout runs from it
+STARTED = 'started'
+# failure reasons recorded on results, see RVolModelSingleResult.failure
+TIMEOUT = 'timeout'
+START_TIMEOUT_FAILURE = 'session start timeout'
+SESSION_DIED = 'session died'
+
+
+def _worker_loop(slot, backend_name, initialization_string, data_sets, task_queue, result_queue, keep_samples):
+    """
+    Worker process body: opens one backend session (sourcing rGarch.r once for R), reports the pid of its
+    R process so the supervisor can kill a hung fit, then serves batches of fit jobs, each on the price
+    history of its asset, until it reads the None sentinel or its supervisor is gone. Each batch is reported
+    started once its prices are loaded, so the supervisor times the fits alone
+    """
+    supervisor_pid = os.getppid()
+    with backend_connection(backend_name, initialization_string) as r_conn:
+        r_conn.keep_samples = keep_samples
+        result_queue.put((slot, None, r_conn.session_pid, None, None))
+        while True:
+            try:
+                task = task_queue.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                # a killed supervisor cannot send the sentinel, do not outlive it as an orphan
+                if os.getppid() != supervisor_pid:
+                    break
+                continue
+            if task is None:
+                break
+            task_seq, asset, jobs, warm_start = task
+            try:
+                r_conn.load_data(data_sets[asset])
+                result_queue.put((slot, task_seq, STARTED, None, None))
+                result_dict = r_conn.multi_run(data_sets[asset], jobs, warm_start)
+                backend_metrics = (r_conn.last_timings, r_conn.last_fit_bytes, r_conn.last_peak_bytes)
+                result_queue.put((slot, task_seq, result_dict, backend_metrics, None))
+            except Exception:
+                result_queue.put((slot, task_seq, None, None, traceback.format_exc()))
+
+
+def _kill(pid):
+    try:
+        os.kill(pid, getattr(signal, 'SIGKILL', signal.SIGTERM))
+    except OSError:
+        pass
+
+
+class Task(object):
+    """
+    Jobs of one batch sent to a worker together
+    batch_index: index of the batch in the job_batches given to BackendWorkerPool.run
+    positions: positions of the jobs within the batch
+    jobs: list of job tuples
+    asset: key of the price history the jobs are fitted on, see BackendWorkerPool data_sets
+    attempt: failed runs of these jobs so far
+    """
+    def __init__(self, batch_index, positions, jobs, asset='', attempt=0):
+        self.batch_index = batch_index
+        self.positions = positions
+        self.jobs = jobs
+        self.asset = asset
+        self.attempt = attempt
+
+
+class WorkerSlot(object):
+    """
+    Supervisor side of one worker process and its backend session
+
+    Attributes:
+        process: multiprocessing.Process
+        task_queue: queue the worker reads its tasks from
+        session_pid: pid of the worker's R process, None until reported or for in-process backends
+        task: Task being run, None when idle
+        task_seq: sequence number of the task being run, results of earlier tasks are ignored
+        sent: perf_counter time the task was sent
+        started: perf_counter time the worker reported starting the task, None until then
+        n_fits: jobs run by this session, for recycling
+    """
+    def __init__(self, process, task_queue):
+        self.process = process
+        self.task_queue = task_queue
+        self.session_pid = None
+        self.task = None
+        self.task_seq = None
+        self.sent = None
+        self.started = None
+        self.n_fits = 0
+
+
+class BackendWorkerPool(object):
+    """
+    Pool of supervised worker processes, each holding a persistent backend session
+    A task running longer than fit_timeout seconds per job, counted from its worker reporting it started,
+    or not started within START_TIMEOUT, or whose worker dies, has its worker and R process killed and
+    restarted; a session is also restarted after recycle_after jobs, to bound the memory
+    a long-lived R grows. Failed tasks are run again up to max_retries times, split into single jobs so one
+    bad fit cannot take its batch down with it, then reported as failed
+    backend_name: 'r' or 'numpy', see py_garch.garch_backend.backend_connection
+    initialization_string: R source command for each session
+    data_sets: dict<asset: price history> shipped to each worker once at start, '' keying the single data
+        file; a PriceStore is reopened memory-mapped by each worker rather than copied
+    n_workers: number of worker processes
+    fit_timeout: wall-clock seconds allowed per job of a task once started, None for no limit on fits or
+        on start-up
+    recycle_after: jobs a session runs before it is restarted, None to keep sessions for the whole run
+    max_retries: runs of a failed job after the first
+    keep_samples: sessions return simulated samples, see py_garch.garch_backend.GarchBackend.keep_samples
+    """
+    def __init__(self, backend_name, initialization_string, data_sets, n_workers, fit_timeout=None,
+                 recycle_after=None, max_retries=0, keep_samples=False):
+        self.backend_name = backend_name
+        self.initialization_string = initialization_string
+        self.data_sets = data_sets
+        self.n_workers = n_workers
+        self.fit_timeout = fit_timeout
+        self.recycle_after = recycle_after
+        self.max_retries = max_retries
+        self.keep_samples = keep_samples
+        self.result_queue = None
+        self.slots = []
+        self.n_restarts = 0
+        self._task_seq = 0
+
+    def __enter__(self):
+        self.result_queue = multiprocessing.Queue()
+        self.slots = [self._start(slot) for slot in range(self.n_workers)]
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        for worker_slot in self.slots:
+            worker_slot.task_queue.put(None)
+        for worker_slot in self.slots:
+            worker_slot.process.join(timeout=EXIT_TIMEOUT)
+            if worker_slot.process.is_alive():
+                self._kill(worker_slot)
+        self.slots = []
+
+    def _start(self, slot):
+        task_queue = multiprocessing.Queue()
+        process = multiprocessing.Process(
+            target=_worker_loop,
+            args=(slot, self.backend_name, self.initialization_string, self.data_sets, task_queue,
+                  self.result_queue, self.keep_samples),
+            daemon=True)
+        process.start()
+        return WorkerSlot(process, task_queue)
+
+    def _kill(self, worker_slot):
+        worker_slot.process.terminate()
+        worker_slot.process.join(timeout=5)
+        if worker_slot.process.is_alive():
+            _kill(worker_slot.process.pid)
+        # the R process is a child of the worker and outlives it when left alone
+        if worker_slot.session_pid is not None:
+            _kill(worker_slot.session_pid)
+
+    def _restart(self, slot):
+        self._kill(self.slots[slot])
+        self.slots[slot] = self._start(slot)
+        self.n_restarts += 1
+
+    def _recycle(self, slot):
+        # an idle session ends on the sentinel, its R process exits with it; one that does not is killed
+        old_slot = self.slots[slot]
+        old_slot.task_queue.put(None)
+        old_slot.process.join(timeout=EXIT_TIMEOUT)
+        if old_slot.process.is_alive():
+            self._kill(old_slot)
+        self.slots[slot] = self._start(slot)
+        self.n_restarts += 1
+
+    def _send(self, slot, task, warm_start):
+        worker_slot = self.slots[slot]
+        self._task_seq += 1
+        worker_slot.task = task
+        worker_slot.task_seq = self._task_seq
+        worker_slot.sent = time.perf_counter()
+        worker_slot.started = None
+        worker_slot.task_queue.put((self._task_seq, task.asset, task.jobs, warm_start))
+
+    def _end_task(self, slot):
+        worker_slot = self.slots[slot]
+        task = worker_slot.task
+        worker_slot.n_fits += len(task.jobs)
+        worker_slot.task = None
+        worker_slot.task_seq = None
+        return task
+
+    def _retry(self, task, failure, tasks):
+        """
+        Queue the jobs of a failed task again, one task per job, or report them failed when out of retries
+        :return: list of (batch index, positions, None, None, failure) for the jobs given up on
+        """
+        if task.attempt >= self.max_retries:
+            return [(task.batch_index, task.positions, None, None, failure)]
+        for position, job in zip(task.positions, task.jobs):
+            tasks.append(Task(task.batch_index, [position], [job], task.asset, task.attempt + 1))
+        return []
+
+    def _overdue(self, worker_slot):
+        """
+        :return: failure reason when the worker's task ran out of time, else None
+        """
+        if worker_slot.task is None or self.fit_timeout is None:
+            return None
+        now = time.perf_counter()
+        if worker_slot.started is None:
+            return START_TIMEOUT_FAILURE if now - worker_slot.sent > START_TIMEOUT else None
+        return TIMEOUT if now - worker_slot.started > self.fit_timeout * len(worker_slot.task.jobs) else None
+
+    def run(self, job_batches, warm_start=False, assets=None):
+        """
+        Spread batches of fit jobs across the workers, yielding results in completion order
+        :param job_batches: list of job lists, see GarchBackend.multi_run
+        :param assets: data_sets key of each batch, aligned with job_batches, all '' when None
+        :param warm_start: each batch is a warm-started chain, a retried job runs on its own from its own
+            start_coef
+        :return: generator of (batch index, positions of the jobs in the batch, result_dict, (backend timings,
+            bytes per fit, simulation peak bytes), failure); result_dict and the metrics are None and failure a
+            str when the jobs failed
+        """
+        if assets is None:
+            assets = [''] * len(job_batches)
+        tasks = collections.deque(Task(batch_index, list(range(len(jobs))), jobs, asset)
+                                  for batch_index, (jobs, asset) in enumerate(zip(job_batches, assets))
+                                  if len(jobs) > 0)
+        n_outstanding = sum([len(jobs) for jobs in job_batches])
+        while n_outstanding > 0:
+            for slot, worker_slot in enumerate(self.slots):
+                if worker_slot.task is None and len(tasks) > 0:
+                    if self.recycle_after is not None and worker_slot.n_fits >= self.recycle_after:
+                        self._recycle(slot)
+                    self._send(slot, tasks.popleft(), warm_start)
+            finished = []
+            try:
+                slot, task_seq, result_dict, backend_metrics, error = self.result_queue.get(timeout=POLL_SECONDS)
+                if task_seq is None:
+                    self.slots[slot].session_pid = result_dict
+                elif task_seq == self.slots[slot].task_seq and result_dict == STARTED:
+                    self.slots[slot].started = time.perf_counter()
+                elif task_seq == self.slots[slot].task_seq:
+                    task = self._end_task(slot)
+                    if error is None:
+                        finished.append((task.batch_index, task.positions, result_dict, backend_metrics, None))
+                    else:
+                        finished += self._retry(task, error.strip().splitlines()[-1], tasks)
+            except queue.Empty:
+                pass
+            for slot, worker_slot in enumerate(self.slots):
+                if worker_slot.task is None:
+                    continue
+                failure = SESSION_DIED if not worker_slot.process.is_alive() else self._overdue(worker_slot)
+                if failure is not None:
+                    task = self._end_task(slot)
+                    self._restart(slot)
+                    finished += self._retry(task, failure, tasks)
+            for batch_index, positions, result_dict, backend_metrics, failure in finished:
+                n_outstanding -= len(positions)
+                yield batch_index, positions, result_dict, backend_metrics, failure
@@ -0,0 +1,192 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import numpy as np
+import pandas as pd
+from . import result_viz
+
+
+MANIFEST_NAME = 'figure_hashes.json'
+# bump when a plot function changes its output, so every cached figure is redrawn
+RENDER_VERSION = 2
+
+
+class FigureSpec(object):
+    """
+    One result_viz plot call and the PNG files it writes under the plot path
+    plot_function: name of a result_viz plot function
+    data: dict<argument name: DataFrame or Series>, hashed by content
+    options: dict<argument name: value> of the remaining JSON-serializable arguments
+    file_names: PNG names written by the call
+    """
+    def __init__(self, plot_function, data, options, file_names):
+        self.plot_function = plot_function
+        self.data = data
+        self.options = options
+        self.file_names = file_names
+
+    @property
+    def content_hash(self):
+        """
+        Hash of the plot function, its options and the values, index and labels of its data
+        :return: str
+        """
+        digest = hashlib.sha1(json.dumps([RENDER_VERSION, self.plot_function, self.options],
+                                         sort_keys=True, default=str).encode())
+        for name in sorted(self.data):
+            value = self.data[name]
+            labels = list(value.columns) if isinstance(value, pd.DataFrame) else [value.name]
+            digest.update(json.dumps([name, labels], default=str).encode())
+            digest.update(pd.util.hash_pandas_object(value, index=True).values.tobytes())
+        return digest.hexdigest()
+
+
+def summary_figure_specs(summary, model_types=('gjrGARCH', 'eGARCH'), dist_type='std', window=504,
+                         n_splits=3):
+    """
+    Figures of the comparison report, each given only the columns it draws
+    Every asset, refit_every and forecast_mode variant of the configs is drawn in its own figures, their file
+    names suffixed by result_viz.variant_suffix, so no figure averages over variants
+    :param summary: SummaryResults
+    :param model_types: model types drawn by window
+    :param dist_type: distribution of the time series figures
+    :param window: window drawn by model type
+    :param n_splits: split metric figures, evenly dividing the dates
+    :return: list of FigureSpec
+    """
+    configs = summary.config_index()
+    variant_levels = ['asset', 'refit_every', 'forecast_mode']
+    variants = configs.droplevel([level for level in configs.names if level not in variant_levels]).unique()
+    realized_series = summary.realized_series
+
+    def variant_rows(summary_frame, variant):
+        mask = np.ones(len(summary_frame), dtype=bool)
+        for level, value in zip(variants.names, variant):
+            mask &= summary_frame[level].values == value
+        return summary_frame[mask]
+
+    def metric_specs(metric, summary_frame, split, suffix):
+        post_fix = '_all' if split == -1 else '_split_{!s}'.format(split)
+        return FigureSpec('summary_frame_metric_plots', {'summary_frame': summary_frame},
+                          {'metric': metric, 'split': split, 'suffix': suffix},
+                          ['{!s}_{!s}{!s}{!s}.png'.format(metric, order, post_fix, suffix)
+                           for order in ['win_model_dist', 'model_win_dist', 'model_dist_win']])
+
+    summary_frame = summary.summary_error_frame()
+    n_dates = summary.sim_frame.shape[0]
+    split_length = n_dates // n_splits
+    splits = [(split * split_length, (split + 1) * split_length if split < n_splits - 1 else -1)
+              for split in range(n_splits)]
+    split_frames = summary.split_summary_frames(splits)
+    sim_frame = summary.by_config(summary.sim_frame)
+    error_frame = summary.by_config(summary.forecast_error_frame)
+    specs = []
+    for variant in variants:
+        levels = dict(zip(variants.names, variant))
+        suffix = result_viz.variant_suffix(**levels)
+        specs += [metric_specs(metric, variant_rows(summary_frame, variant), -1, suffix)
+                  for metric in ['mse', 'mae', 'q3_abs']]
+        for split, split_frame in enumerate(split_frames):
+            specs.append(metric_specs('mse', variant_rows(split_frame, variant), split, suffix))
+        # the time series figures draw one realized series, a multi-asset panel has one per asset
+        if realized_series is None:
+            continue
+        variant_sim_frame = result_viz.config_columns(sim_frame, **levels)
+        variant_error_frame = result_viz.config_columns(error_frame, **levels)
+        for model_type in model_types:
+            model_sim_frame = result_viz.config_columns(variant_sim_frame, model_type=model_type, test_dist=dist_type)
+            model_error_frame = result_viz.config_columns(variant_error_frame, model_type=model_type,
+                                                          test_dist=dist_type)
+            # a variant need not hold every model, analytic has no eGARCH configs
+            if model_sim_frame.shape[1] == 0:
+                continue
+            options = {'model_type': model_type, 'dist_type': dist_type, 'suffix': suffix}
+            specs += [
+                FigureSpec('plot_sim_realized_timeseries_group',
+                           {'sim_frame': model_sim_frame, 'realized_series': realized_series}, options,
+                           ['sim_forecast_comp_{!s}_{!s}{!s}.png'.format(model_type, dist_type, suffix)]),
+                FigureSpec('plot_resid_realized_timeseries_group',
+                           {'resid_frame': model_error_frame, 'realized_series': realized_series}, options,
+                           ['sim_residual_comp_{!s}_{!s}{!s}.png'.format(model_type, dist_type, suffix)]),
+                FigureSpec('plot_resid_rolling_realized_timeseries_group',
+                           {'resid_frame': model_error_frame, 'realized_series': realized_series}, options,
+                           ['sim_rolling_comp_{!s}_{!s}{!s}.png'.format(model_type, dist_type, suffix)])]
+        window_sim_frame = result_viz.config_columns(variant_sim_frame, window=window, test_dist=dist_type)
+        window_error_frame = result_viz.config_columns(variant_error_frame, window=window, test_dist=dist_type)
+        options = {'window': str(window), 'dist_type': dist_type, 'suffix': suffix}
+        window_name = result_viz.window_name(window)
+        specs += [
+            FigureSpec('plot_sim_realized_timeseries_window_group',
+                       {'sim_frame': window_sim_frame, 'realized_series': realized_series}, options,
+                       ['sim_forecast_comp_{!s}_{!s}{!s}.png'.format(window_name, dist_type, suffix)]),
+            FigureSpec('plot_resid_realized_timeseries_window_group',
+                       {'resid_frame': window_error_frame, 'realized_series': realized_series}, options,
+                       ['sim_residual_comp_{!s}_{!s}{!s}.png'.format(window_name, dist_type, suffix)]),
+            FigureSpec('plot_resid_rolling_realized_timeseries_window_group',
+                       {'resid_frame': window_error_frame, 'realized_series': realized_series}, options,
+                       ['sim_rolling_comp_{!s}_{!s}{!s}.png'.format(window_name, dist_type, suffix)])]
+    return specs
+
+
+def _init_worker():
+    import matplotlib
+    matplotlib.use('Agg', force=True)
+
+
+def _render(spec, plot_path):
+    kwargs = dict(spec.data)
+    kwargs.update(spec.options)
+    getattr(result_viz, spec.plot_function)(save_fig=True, save_path=plot_path, **kwargs)
+    result_viz.plt.close('all')
+    return spec.file_names
+
+
+class FigureRenderer(object):
+    """
+    Renders FigureSpecs with a headless backend, skipping figures whose PNGs were already written from the
+    same content hash, as recorded in the plot path's manifest
+    plot_path: directory the PNGs and manifest are written to, and given to each plot call, settings PLOT_PATH
+        when None
+    n_workers: render processes, 1 renders in this process
+    """
+    def __init__(self, plot_path=None, n_workers=1):
+        self.plot_path = result_viz.plot_path(plot_path)
+        self.n_workers = n_workers
+        self.manifest_path = os.path.join(self.plot_path, MANIFEST_NAME)
+
+    def load_manifest(self):
+        """
+        :return: dict<file name: content hash>
+        """
+        if not os.path.exists(self.manifest_path):
+            return {}
+        with open(self.manifest_path) as manifest_file:
+            return json.load(manifest_file)
+
+    def is_current(self, spec, spec_hash, manifest):
+        return all(manifest.get(file_name) == spec_hash and
+                   os.path.exists(os.path.join(self.plot_path, file_name)) for file_name in spec.file_names)
+
+    def render(self, specs):
+        """
+        :param specs: list of FigureSpec
+        :return: (number of figures rendered, number skipped as current)
+        """
+        manifest = self.load_manifest()
+        hashes = [spec.content_hash for spec in specs]
+        stale = [(spec, spec_hash) for spec, spec_hash in zip(specs, hashes)
+                 if not self.is_current(spec, spec_hash, manifest)]
+        if self.n_workers > 1 and len(stale) > 1:
+            with multiprocessing.Pool(min(self.n_workers, len(stale)), _init_worker) as pool:
+                pool.starmap(_render, [(spec, self.plot_path) for spec, _ in stale], chunksize=1)
+        else:
+            _init_worker()
+            for spec, _ in stale:
+                _render(spec, self.plot_path)
+        for spec, spec_hash in stale:
+            for file_name in spec.file_names:
+                manifest[file_name] = spec_hash
+        with open(self.manifest_path, 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=1, sort_keys=True)
+        return len(stale), len(specs) - len(stale)
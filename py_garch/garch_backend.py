@@ -0,0 +1,160 @@
+import time
+from contextlib import contextmanager
+import numpy as np
+from . import garch_engine, settings
+from .simulation import SIMULATE
+
+
+# forecast statistics returned per fit, the realized target is not the engine's concern
+RESULT_FIELDS = ['quantile0', 'quantile25', 'quantile50', 'quantile75', 'quantile100', 'mean.sim.ann']
+
+
+class GarchBackend(object):
+    """
+    Engine used by r_garch.r_model_run.initialized_single_run to fit and simulate one date window
+    Implementations return the rGARCH result dict consumed by RVolModelSingleResult.set_from
+
+    Attributes:
+        last_timings: dict<stage: seconds> of the latest single_run or multi_run call
+        last_fit_bytes: (float) bytes sent to the engine per fit in the latest call, 0 in-process
+        last_peak_bytes: (int) largest footprint of the simulation arrays held at once in the latest call, 0 where
+            the engine does not measure it, as R
+        session_pid: pid of the engine process, which a supervisor kills to end a hung fit, None in-process
+        keep_samples: (bool) return each simulated fit's path vols under '<prefix>_samples', for
+            sample_store.SampleStore; backends that reduce the paths out of process, as R, ignore it
+    """
+    name = None
+    last_timings = {}
+    last_fit_bytes = 0
+    last_peak_bytes = 0
+    session_pid = None
+    keep_samples = False
+
+    def load_data(self, x_frame):
+        """
+        Make a price history resident in the engine ahead of the fits on it; in-process engines read it in place
+        :param x_frame: DataFrame of prices or PriceStore
+        :return: None
+        """
+        return
+
+    def single_run(self, x_frame, start_date, end_date, n_forecast, model_type, test_dist, n_simulations,
+                   seed=None, start_coef=None, fixed_coef=None, refit_every=1, forecast_mode=SIMULATE):
+        raise NotImplementedError
+
+    def multi_run(self, x_frame, jobs, warm_start=False):
+        """
+        Run several fit jobs, one at a time unless the backend batches them
+        :param jobs: list of (start_date, end_date, n_forecast, model_type, test_dist, n_simulations, seed,
+            start_coef, fixed_coef, refit_every, forecast_mode), see garch_engine.JOB_LENGTH
+        :param warm_start: jobs are one (model_type, test_dist, window) chain in date order; a job without
+            start_coef starts from the coefficients fitted for the job before it
+        :return: dict keyed as the rGARCH result list, holding every job's results
+        """
+        result_dict = {}
+        start_coef = None
+        timings = {}
+        n_bytes = 0
+        peak_bytes = 0
+        for job in jobs:
+            job = tuple(job) + (None,) * (garch_engine.JOB_LENGTH - len(job))
+            if warm_start and job[7] is None:
+                job = job[:7] + (start_coef,) + job[8:]
+            job_result = self.single_run(x_frame, *job)
+            result_dict.update(job_result)
+            prefix = garch_engine.result_prefix(job[3], job[4], job[5], job[2], job[0], job[1], job[9] or 1,
+                                                job[10] or SIMULATE)
+            start_coef = garch_engine.parse_coefficients(job_result.get('{!s}_coefficients'.format(prefix)))
+            for stage, seconds in self.last_timings.items():
+                timings[stage] = timings.get(stage, 0.) + seconds
+            n_bytes += self.last_fit_bytes
+            peak_bytes = max(peak_bytes, self.last_peak_bytes)
+        self.last_timings = timings
+        self.last_fit_bytes = n_bytes / float(max(len(jobs), 1))
+        self.last_peak_bytes = peak_bytes
+        return result_dict
+
+    def close(self):
+        return
+
+
+class NumpyGarchBackend(GarchBackend):
+    """
+    In-process NumPy engine, for eGARCH, gjrGARCH and csGARCH with norm and std innovations
+    seed: optional seed for the simulation random generator
+    """
+    name = 'numpy'
+
+    def __init__(self, seed=None):
+        self.rng = np.random.default_rng(seed)
+
+    def single_run(self, x_frame, start_date, end_date, n_forecast, model_type, test_dist, n_simulations,
+                   seed=None, start_coef=None, fixed_coef=None, refit_every=1, forecast_mode=SIMULATE):
+        time_start = time.perf_counter()
+        metrics = {}
+        result_dict = garch_engine.single_run(x_frame, start_date, end_date, n_forecast, model_type, test_dist,
+                                              n_simulations, self.rng, seed, start_coef, fixed_coef,
+                                              refit_every or 1, forecast_mode or SIMULATE, self.keep_samples,
+                                              metrics)
+        self.last_timings = {'compute': time.perf_counter() - time_start}
+        self.last_peak_bytes = metrics['sim_peak_bytes']
+        return result_dict
+
+    def multi_run(self, x_frame, jobs, warm_start=False):
+        """
+        Fit several configs or dates, in order along a warm-started chain, and simulate them in batched passes
+        :param jobs: list of job tuples, see garch_engine.JOB_LENGTH
+        :return: dict keyed as the rGARCH result list, holding every job's results
+        """
+        time_start = time.perf_counter()
+        metrics = {}
+        result_dict = garch_engine.multi_run(x_frame, jobs, self.rng, self.keep_samples, metrics, warm_start)
+        self.last_timings = {'compute': time.perf_counter() - time_start}
+        self.last_peak_bytes = metrics['sim_peak_bytes']
+        return result_dict
+
+
+@contextmanager
+def backend_connection(backend_name, initialization_string=None):
+    """
+    Open a connection for the named backend, usable wherever an r_connection_initialized connection is
+    :param backend_name: 'r' (rugarch over pyper, bulk data moved as set by R_TRANSPORT) or 'numpy'
+    :param initialization_string: R source command, used by the 'r' backend
+    :return: GarchBackend
+    """
+    if backend_name == 'numpy':
+        backend = NumpyGarchBackend()
+        yield backend
+        backend.close()
+    elif backend_name == 'r':
+        from r_garch.r_utilities import r_connection_initialized, binary_r_connection_initialized
+        from r_garch.r_model_run import RGarchBackend
+        transport = settings.get('R_TRANSPORT')
+        if transport not in ['pyper', 'binary']:
+            raise ValueError('Unknown R transport {!s}'.format(transport))
+        connection = binary_r_connection_initialized if transport == 'binary' else r_connection_initialized
+        with connection(initialization_string) as r_conn:
+            yield RGarchBackend(r_conn)
+    else:
+        raise ValueError('Unknown GARCH backend {!s}'.format(backend_name))
+
+
+def result_parity(reference_dict, candidate_dict, prefix, rtol):
+    """
+    Compare two result dicts field by field on relative difference
+    :param reference_dict: result dict, e.g. from stored R output
+    :param candidate_dict: result dict from another backend
+    :param prefix: result prefix, see garch_engine.result_prefix
+    :param rtol: relative tolerance
+    :return: dict<field: relative difference>, bool all fields within rtol; fields missing from both, as
+        analytic quantiles, count as equal
+    """
+    diffs = {}
+    for field in RESULT_FIELDS:
+        key = '{!s}_{!s}'.format(prefix, field)
+        reference = reference_dict[key]
+        if np.isnan(reference) and np.isnan(candidate_dict[key]):
+            diffs[field] = 0.
+            continue
+        diffs[field] = abs(candidate_dict[key] - reference) / max(abs(reference), 1e-12)
+    return diffs, all(d <= rtol for d in diffs.values())
@@ -0,0 +1,577 @@
+import math
+import time
+import zlib
+import numpy as np
+from scipy.optimize import minimize
+from scipy.signal import lfilter
+from scipy.special import gammaln
+from .simulation import forecast_summary, SIMULATE, ANALYTIC
+from .price_store import PriceStore
+
+
+def result_prefix(model_type, test_dist, n_simulations, n_forecast, start_date, end_date, refit_every=1,
+                  forecast_mode=SIMULATE):
+    """
+    Key prefix used by the rGARCH result list, mirrored by RVolModelSingleResult.prefix
+    :param refit_every: refit frequency, suffixed as _refitK when not 1
+    :param forecast_mode: one of simulation.FORECAST_MODES, suffixed when not simulate
+    :return: str
+    """
+    prefix = '{!s}_{!s}_{!s}_{!s}_{!s}_{!s}'.format(
+        model_type,
+        test_dist,
+        n_simulations,
+        n_forecast,
+        start_date.strftime('%Y%m%d'),
+        end_date.strftime('%Y%m%d')
+    )
+    if refit_every != 1:
+        prefix = '{!s}_refit{!s}'.format(prefix, refit_every)
+    if forecast_mode != SIMULATE:
+        prefix = '{!s}_{!s}'.format(prefix, forecast_mode)
+    return prefix
+
+
+# elements of a backend job tuple:
+# (start_date, end_date, n_forecast, model_type, test_dist, n_simulations, seed, start_coef, fixed_coef, refit_every,
+#  forecast_mode)
+JOB_LENGTH = 11
+
+
+def simulation_seed(prefix):
+    """
+    Deterministic per-fit seed, so a fit simulates the same paths whichever process or batch runs it
+    :param prefix: result prefix, see result_prefix
+    :return: int
+    """
+    return zlib.crc32(prefix.encode('utf-8')) % (2 ** 31)
+
+
+def format_coefficients(coef):
+    """
+    Text form of fitted coefficients shared with rGARCH, e.g. 'mu=0.0003;omega=1.2e-06;...'
+    :param coef: dict<str: float>
+    :return: str
+    """
+    return ';'.join(['{!s}={!r}'.format(name, float(value)) for name, value in coef.items()])
+
+
+def parse_coefficients(text):
+    """
+    Inverse of format_coefficients
+    :return: dict<str: float>, or None for empty text
+    """
+    if text is None or not isinstance(text, str) or text == '':
+        return None
+    return dict((name, float(value)) for name, value in [pair.split('=') for pair in text.split(';')])
+
+
+class InnovationDist(object):
+    """
+    Standardized (zero mean, unit variance) innovation distribution
+    shape_names: names of extra parameters, following rugarch
+    """
+    name = None
+    shape_names = ()
+
+    def start_values(self):
+        return []
+
+    def bounds(self):
+        return []
+
+    def log_density(self, z, shape):
+        raise NotImplementedError
+
+    def abs_moment(self, shape):
+        """
+        E|z| under the distribution, used by the eGARCH news impact term
+        """
+        raise NotImplementedError
+
+    def draw(self, rng, size, shape):
+        raise NotImplementedError
+
+
+class NormDist(InnovationDist):
+    name = 'norm'
+
+    def log_density(self, z, shape):
+        return -0.5 * (np.log(2. * np.pi) + z ** 2)
+
+    def abs_moment(self, shape):
+        return np.sqrt(2. / np.pi)
+
+    def draw(self, rng, size, shape):
+        return rng.standard_normal(size)
+
+
+class StdDist(InnovationDist):
+    name = 'std'
+    shape_names = ('shape',)
+
+    def start_values(self):
+        return [5.]
+
+    def bounds(self):
+        return [(2.1, 100.)]
+
+    def log_density(self, z, shape):
+        nu = shape[0]
+        return gammaln((nu + 1.) / 2.) - gammaln(nu / 2.) - 0.5 * np.log(np.pi * (nu - 2.)) - \
+            (nu + 1.) / 2. * np.log1p(z ** 2 / (nu - 2.))
+
+    def abs_moment(self, shape):
+        nu = shape[0]
+        return np.sqrt(nu - 2.) * np.exp(gammaln((nu - 1.) / 2.) - gammaln(nu / 2.)) / np.sqrt(np.pi)
+
+    def draw(self, rng, size, shape):
+        nu = shape[0]
+        return rng.standard_t(nu, size) * np.sqrt((nu - 2.) / nu)
+
+
+class VarianceModel(object):
+    """
+    GARCH(1,1) family conditional variance recursion, with rugarch parameter naming
+    The recursion state is a tuple of arrays; the first element is always sigma^2
+    """
+    model_type = None
+    variance_names = ()
+    # whether expected_variance has a closed form, see simulation.analytic_forecasts
+    has_expected_variance = False
+
+    def start_values(self, sample_var):
+        raise NotImplementedError
+
+    def bounds(self, sample_var):
+        raise NotImplementedError
+
+    def is_admissible(self, var_params):
+        return True
+
+    def filter(self, var_params, resid, abs_moment):
+        """
+        In-sample conditional variance
+        :param var_params: array of variance parameters
+        :param resid: array of mean-model residuals
+        :param abs_moment: E|z| of the innovation distribution
+        :return: sigma2 (array aligned with resid), state for the first out-of-sample step
+        """
+        raise NotImplementedError
+
+    def step(self, var_params, state, resid, abs_moment):
+        """
+        Advance the recursion one period, vectorized across simulated paths
+        :param state: tuple of arrays, state at t
+        :param resid: array of residuals at t
+        :return: state at t+1
+        """
+        raise NotImplementedError
+
+    def expected_variance(self, var_params, state, n_forecast):
+        """
+        Multi-step conditional variance forecast E[sigma^2] for symmetric standardized innovations
+        :param state: recursion state for the first forecast day, see filter
+        :return: array (n_forecast,)
+        """
+        raise NotImplementedError
+
+
+class GjrGarchModel(VarianceModel):
+    model_type = 'gjrGARCH'
+    variance_names = ('omega', 'alpha1', 'beta1', 'gamma1')
+    has_expected_variance = True
+
+    def start_values(self, sample_var):
+        return [sample_var * .05, .05, .85, .1]
+
+    def bounds(self, sample_var):
+        return [(sample_var * 1e-6, sample_var * 10.), (0., 1.), (0., 1.), (-1., 1.)]
+
+    def is_admissible(self, var_params):
+        _, alpha, beta, gamma = var_params
+        return alpha + gamma >= 0. and alpha + beta + gamma / 2. < 1.
+
+    def _news(self, var_params, resid):
+        omega, alpha, _, gamma = var_params
+        e2 = resid ** 2
+        return omega + (alpha + gamma * (resid < 0)) * e2
+
+    def filter(self, var_params, resid, abs_moment):
+        beta = var_params[2]
+        sample_var = np.mean(resid ** 2)
+        news = self._news(var_params, resid)
+        # sigma2[t] = news[t-1] + beta * sigma2[t-1], sigma2[0] = sample variance
+        sigma2 = np.empty_like(resid)
+        sigma2[0] = sample_var
+        sigma2[1:] = lfilter([1.], [1., -beta], news[:-1], zi=[beta * sample_var])[0]
+        state = self.step(var_params, (sigma2[-1:],), resid[-1:], abs_moment)
+        return sigma2, state
+
+    def step(self, var_params, state, resid, abs_moment):
+        return self._news(var_params, resid) + var_params[2] * state[0],
+
+    def expected_variance(self, var_params, state, n_forecast):
+        omega, alpha, beta, gamma = var_params
+        # negative shocks carry gamma half of the time
+        persistence = alpha + beta + gamma / 2.
+        sigma2 = np.empty(n_forecast)
+        sigma2[0] = float(state[0][0])
+        for h in range(1, n_forecast):
+            sigma2[h] = omega + persistence * sigma2[h - 1]
+        return sigma2
+
+
+class EGarchModel(VarianceModel):
+    model_type = 'eGARCH'
+    variance_names = ('omega', 'alpha1', 'beta1', 'gamma1')
+
+    def start_values(self, sample_var):
+        return [np.log(sample_var) * .05, -.05, .95, .1]
+
+    def bounds(self, sample_var):
+        return [(-50., 50.), (-1., 1.), (-.9999, .9999), (-2., 2.)]
+
+    def _log_step(self, var_params, log_sigma2, z, abs_moment):
+        omega, alpha, beta, gamma = var_params
+        return omega + alpha * z + gamma * (np.abs(z) - abs_moment) + beta * log_sigma2
+
+    def filter(self, var_params, resid, abs_moment):
+        omega, alpha, beta, gamma = var_params.tolist()
+        abs_moment = float(abs_moment)
+        log_sigma2 = np.empty_like(resid)
+        log_sigma2[0] = np.log(np.mean(resid ** 2))
+        resid_list = resid.tolist()
+        ls2 = log_sigma2[0]
+        for t in range(1, len(resid_list)):
+            z = resid_list[t - 1] * math.exp(-.5 * ls2)
+            ls2 = omega + alpha * z + gamma * (abs(z) - abs_moment) + beta * ls2
+            if ls2 > 700.:
+                ls2 = 700.
+            elif ls2 < -700.:
+                ls2 = -700.
+            log_sigma2[t] = ls2
+        sigma2 = np.exp(log_sigma2)
+        state = self.step(var_params, (sigma2[-1:],), resid[-1:], abs_moment)
+        return sigma2, state
+
+    def step(self, var_params, state, resid, abs_moment):
+        sigma2 = state[0]
+        z = resid / np.sqrt(sigma2)
+        return np.exp(self._log_step(var_params, np.log(sigma2), z, abs_moment)),
+
+
+class CsGarchModel(VarianceModel):
+    """
+    Component GARCH: permanent component q with persistence eta11 (rho) and loading eta21 (phi)
+    """
+    model_type = 'csGARCH'
+    variance_names = ('omega', 'alpha1', 'beta1', 'eta11', 'eta21')
+    has_expected_variance = True
+
+    def start_values(self, sample_var):
+        return [sample_var * .01, .05, .85, .99, .05]
+
+    def bounds(self, sample_var):
+        return [(sample_var * 1e-8, sample_var * 10.), (0., 1.), (0., 1.), (0., .99999), (0., 1.)]
+
+    def is_admissible(self, var_params):
+        _, alpha, beta, rho, phi = var_params
+        return alpha + beta < 1. and rho > alpha + beta and phi < beta
+
+    def filter(self, var_params, resid, abs_moment):
+        omega, alpha, beta, rho, phi = var_params.tolist()
+        sample_var = float(np.mean(resid ** 2))
+        sigma2 = np.empty_like(resid)
+        s2 = q = sample_var
+        sigma2[0] = s2
+        e2_list = (resid ** 2).tolist()
+        for t in range(1, len(e2_list)):
+            e2 = e2_list[t - 1]
+            q_next = omega + rho * q + phi * (e2 - s2)
+            s2 = q_next + alpha * (e2 - q) + beta * (s2 - q)
+            q = q_next
+            sigma2[t] = s2
+        state = self.step(var_params, (sigma2[-1:], np.array([q])), resid[-1:], abs_moment)
+        return sigma2, state
+
+    def step(self, var_params, state, resid, abs_moment):
+        omega, alpha, beta, rho, phi = var_params
+        sigma2, q = state
+        e2 = resid ** 2
+        q_next = omega + rho * q + phi * (e2 - sigma2)
+        return q_next + alpha * (e2 - q) + beta * (sigma2 - q), q_next
+
+    def expected_variance(self, var_params, state, n_forecast):
+        omega, alpha, beta, rho, _ = var_params
+        # E[e2] = sigma2, so the permanent component drops its shock term and the transitory part decays
+        sigma2 = np.empty(n_forecast)
+        s2 = float(state[0][0])
+        q = float(state[1][0])
+        sigma2[0] = s2
+        for h in range(1, n_forecast):
+            q_next = omega + rho * q
+            s2 = q_next + (alpha + beta) * (s2 - q)
+            q = q_next
+            sigma2[h] = s2
+        return sigma2
+
+
+# L-BFGS-B can stop far from the optimum on the ridge between omega and beta1, eGARCH with std innovations
+# most often; the fit is restarted from where it stopped, with a fresh curvature estimate, until a restart
+# gains less than RESTART_TOLERANCE in log-likelihood or MAX_RESTARTS are spent
+MAX_RESTARTS = 5
+RESTART_TOLERANCE = 1e-6
+
+VARIANCE_MODELS = {m.model_type: m for m in [EGarchModel(), GjrGarchModel(), CsGarchModel()]}
+INNOVATION_DISTS = {d.name: d for d in [NormDist(), StdDist()]}
+
+
+def supports_forecast_mode(model_type, forecast_mode):
+    """
+    Analytic forecasts need the model's expected variance in closed form, every model is simulated
+    :return: bool
+    """
+    return forecast_mode != ANALYTIC or VARIANCE_MODELS[model_type].has_expected_variance
+
+
+class GarchFit(object):
+    """
+    Fitted constant-mean GARCH(1,1) family model
+    model: VarianceModel
+    dist: InnovationDist
+    coef: dict<str: float>, rugarch style coefficient names (mu, omega, alpha1, ...)
+
+    Attributes:
+        log_likelihood: (float)
+        converged: (bool) optimizer success flag
+        n_iterations: (int) optimizer iterations
+        sigma2: (array) in-sample conditional variance
+        next_state: tuple of arrays, recursion state for the first forecast day
+    """
+    def __init__(self, model, dist, coef, log_likelihood, converged, n_iterations, sigma2, next_state):
+        self.model = model
+        self.dist = dist
+        self.coef = coef
+        self.log_likelihood = log_likelihood
+        self.converged = converged
+        self.n_iterations = n_iterations
+        self.sigma2 = sigma2
+        self.next_state = next_state
+
+    @property
+    def mu(self):
+        return self.coef['mu']
+
+    @property
+    def var_params(self):
+        return np.array([self.coef[n] for n in self.model.variance_names])
+
+    @property
+    def shape(self):
+        return np.array([self.coef[n] for n in self.dist.shape_names])
+
+
+def _negative_log_likelihood(x, scale, returns, model, dist):
+    params = x * scale
+    mu = params[0]
+    n_var = len(model.variance_names)
+    var_params = params[1:1 + n_var]
+    shape = params[1 + n_var:]
+    if not model.is_admissible(var_params):
+        return 1e10
+    resid = returns - mu
+    sigma2, _ = model.filter(var_params, resid, dist.abs_moment(shape))
+    if not np.all(np.isfinite(sigma2)) or np.any(sigma2 <= 0.):
+        return 1e10
+    z = resid / np.sqrt(sigma2)
+    llh = np.sum(dist.log_density(z, shape) - .5 * np.log(sigma2))
+    if not np.isfinite(llh):
+        return 1e10
+    return -llh
+
+
+def log_likelihood(returns, model_type, test_dist, coef):
+    """
+    Log-likelihood of returns under given coefficients, the objective fit_garch maximizes, so a fit from
+    another engine can be scored against ours
+    :param returns: array of log returns
+    :param coef: dict of coefficients, rugarch names
+    :return: float, -1e10 for coefficients outside the admissible region
+    """
+    model = VARIANCE_MODELS[model_type]
+    dist = INNOVATION_DISTS[test_dist]
+    names = ('mu',) + model.variance_names + dist.shape_names
+    x = np.array([coef[n] for n in names], dtype=float)
+    return -_negative_log_likelihood(x, np.ones(len(x)), np.asarray(returns, dtype=float), model, dist)
+
+
+def fit_garch(returns, model_type, test_dist, start_coef=None):
+    """
+    Maximum likelihood fit of a constant-mean GARCH(1,1) family model
+    :param returns: array of log returns
+    :param model_type: eGARCH, gjrGARCH, csGARCH
+    :param test_dist: std, norm
+    :param start_coef: optional dict of starting coefficients
+    :return: GarchFit
+    """
+    model = VARIANCE_MODELS[model_type]
+    dist = INNOVATION_DISTS[test_dist]
+    returns = np.asarray(returns, dtype=float)
+    sample_var = np.var(returns)
+    names = ('mu',) + model.variance_names + dist.shape_names
+    x0 = np.array([np.mean(returns)] + model.start_values(sample_var) + dist.start_values())
+    if start_coef is not None:
+        x0 = np.array([start_coef.get(n, v) for n, v in zip(names, x0)])
+    bounds = [(-np.inf, np.inf)] + model.bounds(sample_var) + dist.bounds()
+    # optimize over O(1) variables, tiny daily-return omegas otherwise stall the solver
+    scale = np.ones(len(x0))
+    scale[0] = np.sqrt(sample_var) * .1
+    if model_type != 'eGARCH':
+        scale[1] = sample_var
+    scaled_bounds = [(lo / s, hi / s) for (lo, hi), s in zip(bounds, scale)]
+    opt = minimize(_negative_log_likelihood, x0 / scale, args=(scale, returns, model, dist),
+                   method='L-BFGS-B', bounds=scaled_bounds)
+    n_iterations = opt.nit
+    for _ in range(MAX_RESTARTS):
+        restart = minimize(_negative_log_likelihood, opt.x, args=(scale, returns, model, dist),
+                           method='L-BFGS-B', bounds=scaled_bounds)
+        n_iterations += restart.nit
+        gain = opt.fun - restart.fun
+        if gain >= 0.:
+            opt = restart
+        if gain < RESTART_TOLERANCE:
+            break
+    params = opt.x * scale
+    coef = dict(zip(names, params.tolist()))
+    fit = GarchFit(model, dist, coef, -opt.fun, bool(opt.success), int(n_iterations), None, None)
+    fit.sigma2, fit.next_state = model.filter(fit.var_params, returns - fit.mu, dist.abs_moment(fit.shape))
+    return fit
+
+
+def filter_garch(returns, model_type, test_dist, coef):
+    """
+    Run a fitted model's variance recursion over new returns without re-estimating its coefficients
+    :param returns: array of log returns
+    :param coef: dict of coefficients from an earlier fit
+    :return: GarchFit
+    """
+    model = VARIANCE_MODELS[model_type]
+    dist = INNOVATION_DISTS[test_dist]
+    returns = np.asarray(returns, dtype=float)
+    fit = GarchFit(model, dist, dict(coef), None, True, 0, None, None)
+    fit.sigma2, fit.next_state = model.filter(fit.var_params, returns - fit.mu, dist.abs_moment(fit.shape))
+    return fit
+
+
+def split_returns(x_frame, start_date, end_date, date_var='Date', price_var='Close'):
+    """
+    Log returns within [start_date, end_date] and from end_date onward, as rGARCH slices them
+    :param x_frame: DataFrame of prices, or PriceStore handing out views of its precomputed returns
+    :return: returns_past (array), returns_future (array)
+    """
+    if isinstance(x_frame, PriceStore):
+        return x_frame.split_returns(start_date, end_date)
+    dates = x_frame[date_var].values
+    prices = x_frame[price_var].values.astype(float)
+    past = prices[(dates >= np.datetime64(start_date)) & (dates <= np.datetime64(end_date))]
+    future = prices[dates >= np.datetime64(end_date)]
+    returns_past = np.diff(np.log(past))
+    returns_future = np.diff(np.log(future))
+    return returns_past[np.isfinite(returns_past)], returns_future[np.isfinite(returns_future)]
+
+
+def timed_fit(returns, model_type, test_dist, start_coef=None, fixed_coef=None):
+    """
+    fit_garch from start_coef when given, falling back to a cold start if that fit does not converge
+    With fixed_coef, filter_garch instead of fitting
+    :return: GarchFit, solver iterations across attempts, wall seconds, whether the warm fit was kept
+    """
+    time_start = time.perf_counter()
+    if fixed_coef is not None:
+        fit = filter_garch(returns, model_type, test_dist, fixed_coef)
+        return fit, 0, time.perf_counter() - time_start, False
+    fit = fit_garch(returns, model_type, test_dist, start_coef)
+    n_iterations = fit.n_iterations
+    warm_start = start_coef is not None
+    if warm_start and not fit.converged:
+        fit = fit_garch(returns, model_type, test_dist)
+        n_iterations += fit.n_iterations
+        warm_start = False
+    return fit, n_iterations, time.perf_counter() - time_start, warm_start
+
+
+def multi_run(x_frame, jobs, rng, keep_samples=False, metrics=None, warm_start=False):
+    """
+    Fit every job, then summarize the forecasts of all fits sharing n_forecast, n_simulations and forecast_mode
+    in one batched pass
+    :param x_frame: DataFrame of prices or PriceStore
+    :param jobs: list of (start_date, end_date, n_forecast, model_type, test_dist, n_simulations, seed,
+        start_coef, fixed_coef, refit_every, forecast_mode), seed may be None to draw from rng, start_coef None
+        for a cold start and fixed_coef None to fit rather than filter; trailing elements may be left off
+    :param rng: numpy Generator
+    :param keep_samples: also return each simulated fit's annualized path vols, sorted float32, under
+        '<prefix>_samples', for sample_store.SampleStore
+    :param metrics: optional dict, receives sim_peak_bytes, the largest footprint of the simulation arrays held
+        at once over the batches
+    :param warm_start: jobs are one (model_type, test_dist, window) chain in date order, fitted in turn; a job
+        without start_coef starts from the coefficients fitted for the job before it
+    :return: dict keyed as the rGARCH result list, holding every job's forecast statistics and fit diagnostics;
+        realized targets are computed once per end date by realized.RealizedTargets
+    """
+    jobs = [tuple(job) + (None,) * (JOB_LENGTH - len(job)) for job in jobs]
+    returns = [split_returns(x_frame, job[0], job[1])[0] for job in jobs]
+    fit_info = []
+    for i, job in enumerate(jobs):
+        start_coef = job[7]
+        if warm_start and start_coef is None and len(fit_info) > 0:
+            start_coef = fit_info[-1][0].coef
+        fit_info.append(timed_fit(returns[i], job[3], job[4], start_coef, job[8]))
+    fits = [info[0] for info in fit_info]
+    batches = {}
+    for i, job in enumerate(jobs):
+        batches.setdefault((job[2], job[5], job[10] or SIMULATE), []).append(i)
+
+    seeds = [job[6] for job in jobs]
+    result = {}
+    peak_bytes = 0
+    for (n_forecast, n_simulations, forecast_mode), indices in batches.items():
+        batch_rng = rng
+        if any(seeds[i] is not None for i in indices):
+            batch_rng = [np.random.default_rng(seeds[i]) if seeds[i] is not None else rng for i in indices]
+        summary = forecast_summary([fits[i] for i in indices], n_forecast, n_simulations, batch_rng, forecast_mode,
+                                   keep_samples)
+        peak_bytes = max(peak_bytes, summary.peak_bytes)
+        for row, i in enumerate(indices):
+            start_date, end_date, _, model_type, test_dist, _ = jobs[i][:6]
+            mean_sim_ann = summary.mean_sim_ann[row]
+            prefix = result_prefix(model_type, test_dist, n_simulations, n_forecast, start_date, end_date,
+                                   jobs[i][9] or 1, forecast_mode)
+            for name, value in zip(['quantile0', 'quantile25', 'quantile50', 'quantile75', 'quantile100'],
+                                   summary.quantiles[row]):
+                result['{!s}_{!s}'.format(prefix, name)] = float(value)
+            result['{!s}_mean.sim.ann'.format(prefix)] = float(mean_sim_ann)
+            result['{!s}_n.sims.used'.format(prefix)] = int(summary.n_simulations[row])
+            result['{!s}_sim.std.error'.format(prefix)] = float(summary.std_error[row])
+            if keep_samples and summary.samples[row] is not None:
+                result['{!s}_samples'.format(prefix)] = summary.samples[row]
+            fit, n_iterations, fit_seconds, warm_start = fit_info[i]
+            result['{!s}_coefficients'.format(prefix)] = format_coefficients(fit.coef)
+            result['{!s}_solver.iterations'.format(prefix)] = n_iterations
+            result['{!s}_fit.seconds'.format(prefix)] = fit_seconds
+            result['{!s}_warm.start'.format(prefix)] = int(warm_start)
+            result['{!s}_converged'.format(prefix)] = int(fit.converged)
+    if metrics is not None:
+        metrics['sim_peak_bytes'] = peak_bytes
+    return result
+
+
+def single_run(x_frame, start_date, end_date, n_forecast, model_type, test_dist, n_simulations, rng, seed=None,
+               start_coef=None, fixed_coef=None, refit_every=1, forecast_mode=SIMULATE, keep_samples=False,
+               metrics=None):
+    """
+    NumPy counterpart of the rGARCH R function
+    :return: dict keyed as the rGARCH result list, see RVolModelSingleResult.set_from
+    """
+    return multi_run(x_frame, [(start_date, end_date, n_forecast, model_type, test_dist, n_simulations, seed,
+                                start_coef, fixed_coef, refit_every, forecast_mode)], rng, keep_samples, metrics)
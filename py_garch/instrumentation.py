@@ -0,0 +1,208 @@
+import json
+import os
+import sys
+import time
+import pandas as pd
+from . import settings
+
+
+METRICS_NAME = 'run_metrics.jsonl'
+CONFIG_COLUMNS = ['asset', 'model_type', 'test_dist', 'window', 'refit_every', 'forecast_mode']
+
+
+class ProgressReporter(object):
+    """
+    Live progress line with throughput and ETA
+    n_total: tasks expected
+    label: task noun used in the line
+    min_interval: seconds between lines, the final line always prints
+    stream: file the line is written to
+    """
+    def __init__(self, n_total, label='fits', min_interval=1., stream=sys.stdout):
+        self.n_total = n_total
+        self.label = label
+        self.min_interval = min_interval
+        self.stream = stream
+        self.n_done = 0
+        self.time_start = time.perf_counter()
+        self.time_printed = None
+
+    @property
+    def rate(self):
+        elapsed = time.perf_counter() - self.time_start
+        return self.n_done / elapsed if elapsed > 0 else 0.
+
+    @property
+    def eta_seconds(self):
+        rate = self.rate
+        return (self.n_total - self.n_done) / rate if rate > 0 else float('nan')
+
+    def update(self, n_done):
+        """
+        :param n_done: tasks completed since the last update
+        :return: None
+        """
+        self.n_done += n_done
+        now = time.perf_counter()
+        if self.n_done < self.n_total and self.time_printed is not None and \
+                now - self.time_printed < self.min_interval:
+            return
+        self.time_printed = now
+        eta = self.eta_seconds
+        self.stream.write('{!s} of {!s} {!s}, {:.2f} {!s}/s, ETA {!s}\n'.format(
+            self.n_done, self.n_total, self.label, self.rate, self.label,
+            '--' if eta != eta else '{:.0f}s'.format(eta)))
+        self.stream.flush()
+
+
+class RunMonitor(object):
+    """
+    Per-task metrics of a sweep, appended as JSON lines, with a progress reporter over the tasks to run
+    n_total: tasks to fit or filter
+    path: JSONL file appended to, METRICS_NAME under TMP_PATH when None
+    write: False keeps the records in memory only
+
+    Each record holds the task's config and dates, cache hit, miss or failed and, for misses, the stage seconds
+    (the task's share of its batch's backend transfer, compute and fetch, and of the store write, plus its
+    own fit seconds), the seconds charged to the task, bytes sent to R per fit, the peak bytes of its batch's
+    simulation arrays and the solver outcome
+
+    Attributes:
+        run_id: str, shared by the records of one run
+        records: list of dict
+    """
+    def __init__(self, n_total, path=None, write=True):
+        self.path = os.path.join(settings.get('TMP_PATH'), METRICS_NAME) if path is None and write else path
+        self.run_id = pd.Timestamp.now().strftime('%Y%m%dT%H%M%S')
+        self.records = []
+        self.progress = ProgressReporter(n_total)
+        self.metrics_file = open(self.path, 'a') if write else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def close(self):
+        if self.metrics_file is not None:
+            self.metrics_file.close()
+            self.metrics_file = None
+
+    def _task_record(self, result, cache):
+        params = result.params
+        return {'run_id': self.run_id,
+                'asset': params.asset,
+                'prefix': result.prefix,
+                'model_type': params.model_type,
+                'test_dist': params.test_dist,
+                'window': params.window,
+                'refit_every': params.refit_every,
+                'forecast_mode': params.forecast_mode,
+                'n_sims': params.n_sims,
+                'data_start_date': result.data_start_date.strftime('%Y-%m-%d'),
+                'data_end_date': result.data_end_date.strftime('%Y-%m-%d'),
+                'cache': cache}
+
+    def _write(self, records):
+        self.records.extend(records)
+        if self.metrics_file is not None:
+            self.metrics_file.write(''.join([json.dumps(record) + '\n' for record in records]))
+            self.metrics_file.flush()
+
+    def cache_hits(self, stored):
+        """
+        :param stored: list of (result_holder, RVolModelSingleResult) found in the store
+        :return: None
+        """
+        self._write([self._task_record(result, 'hit') for _, result in stored])
+
+    def batch_done(self, pending, backend_timings, fit_bytes, store_seconds, peak_bytes=0):
+        """
+        Record a finished batch and advance the progress line
+        :param pending: list of (result_holder, filled RVolModelSingleResult)
+        :param backend_timings: dict<stage: seconds> for the whole batch, see GarchBackend.last_timings
+        :param fit_bytes: bytes sent to R per fit
+        :param store_seconds: seconds spent writing the batch to the result store
+        :param peak_bytes: largest footprint of the batch's simulation arrays, see GarchBackend.last_peak_bytes
+        :return: None
+        """
+        n_tasks = float(len(pending))
+        fit_seconds = [result.fit_seconds for _, result in pending]
+        # each task is charged its own fit time and an even share of the rest of the batch
+        if any(seconds is None for seconds in fit_seconds):
+            fit_seconds = [0.] * len(pending)
+        shared_seconds = (sum(backend_timings.values()) - sum(fit_seconds) + store_seconds) / n_tasks
+        records = []
+        for (_, result), own_seconds in zip(pending, fit_seconds):
+            record = self._task_record(result, 'miss')
+            stage_seconds = dict((stage, seconds / n_tasks) for stage, seconds in backend_timings.items())
+            stage_seconds['store'] = store_seconds / n_tasks
+            stage_seconds['fit'] = result.fit_seconds
+            record['stage_seconds'] = stage_seconds
+            record['seconds'] = own_seconds + max(shared_seconds, 0.)
+            record['bytes_sent'] = fit_bytes
+            record['sim_peak_bytes'] = peak_bytes
+            record['solver_iterations'] = result.solver_iterations
+            record['converged'] = result.converged
+            record['warm_start'] = result.warm_start
+            record['n_sims_used'] = result.n_sims_used
+            record['sim_std_error'] = result.sim_std_error
+            records.append(record)
+        self._write(records)
+        self.progress.update(len(pending))
+
+    def tasks_failed(self, pending, failure):
+        """
+        Record tasks given up on after their retries and advance the progress line
+        :param pending: list of (result_holder, failed RVolModelSingleResult)
+        :param failure: reason, see RVolModelSingleResult.failure
+        :return: None
+        """
+        records = []
+        for _, result in pending:
+            record = self._task_record(result, 'failed')
+            record['failure'] = failure
+            records.append(record)
+        self._write(records)
+        self.progress.update(len(pending))
+
+    def slowest(self, n=10):
+        """
+        Configs and end dates ranked by the seconds their fitted tasks took this run
+        :return: (DataFrame by config, DataFrame by data_end_date), each with n_tasks, seconds,
+            mean_seconds and n_failed columns, slowest first
+        """
+        misses = [record for record in self.records if record['cache'] == 'miss']
+        if len(misses) == 0:
+            return None, None
+        frame = pd.DataFrame(misses)
+        frame['failed'] = (frame.converged == 0).astype(int)
+        rankings = []
+        for keys in [CONFIG_COLUMNS, ['data_end_date']]:
+            ranked = frame.groupby(keys).agg(n_tasks=('seconds', 'size'), seconds=('seconds', 'sum'),
+                                             mean_seconds=('seconds', 'mean'), n_failed=('failed', 'sum'))
+            rankings.append(ranked.sort_values('seconds', ascending=False).head(n))
+        return rankings[0], rankings[1]
+
+    def report(self, n=10):
+        """
+        Print the end-of-run summary: cache hit rate, the largest simulation footprint and the slowest configs
+        and dates
+        :return: None
+        """
+        n_hits = len([record for record in self.records if record['cache'] == 'hit'])
+        n_failed = len([record for record in self.records if record['cache'] == 'failed'])
+        n_records = len(self.records)
+        print('{!s} tasks, {!s} cache hits ({:.1%}), {!s} run, {!s} failed in {:.1f}s'.format(
+            n_records, n_hits, n_hits / float(n_records) if n_records > 0 else 0., n_records - n_hits - n_failed,
+            n_failed, time.perf_counter() - self.progress.time_start))
+        peak_bytes = max([record.get('sim_peak_bytes', 0) for record in self.records] + [0])
+        if peak_bytes > 0:
+            print('peak simulation memory {:.1f}MB'.format(peak_bytes / 2. ** 20))
+        by_config, by_date = self.slowest(n)
+        if by_config is not None:
+            print('slowest configs:')
+            print(by_config)
+            print('slowest dates:')
+            print(by_date)
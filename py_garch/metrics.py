@@ -0,0 +1,237 @@
+import numpy as np
+import pandas as pd
+
+
+CONFIG_LEVELS = ['asset', 'model_type', 'test_dist', 'window', 'refit_every', 'forecast_mode']
+QUANTILE_FIELDS = ['quantile0_pct', 'quantile25_pct', 'quantile50_pct', 'quantile75_pct', 'quantile100_pct']
+
+
+class Metric(object):
+    """
+    Forecast metric, a per-date loss reduced over each evaluation window
+    name: str, the metric column of the output
+    loss: function(MetricPanel) -> array (n_dates, n_configs), NaN where a config has no result
+    quantile: None to average the loss over a window, or the quantile of the loss to take, e.g. .75
+    """
+    def __init__(self, name, loss, quantile=None):
+        self.name = name
+        self.loss = loss
+        self.quantile = quantile
+
+
+def _qlike(panel):
+    # QLIKE on variances, realized over forecast: zero for a perfect forecast and robust to noisy targets
+    ratio = panel.realized ** 2 / panel.field('mean_sim_ann') ** 2
+    return ratio - np.log(ratio) - 1.
+
+
+def _coverage(lower_field, upper_field):
+    def coverage(panel):
+        lower = panel.field(lower_field)
+        inside = ((lower <= panel.realized) & (panel.realized <= panel.field(upper_field))).astype(float)
+        inside[np.isnan(lower)] = np.nan
+        return inside
+    return coverage
+
+
+METRICS = {}
+
+
+def register_metric(metric):
+    """
+    Make a metric available to MetricEngine by name
+    :param metric: Metric
+    :return: None
+    """
+    METRICS[metric.name] = metric
+
+
+register_metric(Metric('mse', lambda panel: panel.field('forecast_error') ** 2))
+register_metric(Metric('mae', lambda panel: np.abs(panel.field('forecast_error'))))
+register_metric(Metric('q3_abs', lambda panel: np.abs(panel.field('forecast_error')), quantile=.75))
+register_metric(Metric('qlike', _qlike))
+# share of realized vols inside the simulated interquartile range (nominal .5) and the simulated range
+register_metric(Metric('coverage_iqr', _coverage('quantile25_pct', 'quantile75_pct')))
+register_metric(Metric('coverage_range', _coverage('quantile0_pct', 'quantile100_pct')))
+
+DEFAULT_METRICS = ['mse', 'mae', 'q3_abs']
+
+
+def _nanquantile(values, quantile, axis):
+    # np.nanquantile falls back to a python loop over slices once any NaN is present; sorting moves NaNs
+    # last, so linear interpolation between the two order statistics of each slice's valid count is exact
+    values = np.sort(np.moveaxis(values, axis, 0), axis=0)
+    if values.shape[0] == 0:
+        return np.full(values.shape[1:], np.nan)
+    n_valid = (~np.isnan(values)).sum(axis=0)
+    position = quantile * np.maximum(n_valid - 1, 0)
+    lower = np.floor(position).astype(int)
+    upper = np.minimum(lower + 1, np.maximum(n_valid - 1, 0))
+    lower_values = np.take_along_axis(values, lower[None], axis=0)[0]
+    upper_values = np.take_along_axis(values, upper[None], axis=0)[0]
+    result = lower_values + (upper_values - lower_values) * (position - lower)
+    return np.where(n_valid > 0, result, np.nan)
+
+
+class MetricPanel(object):
+    """
+    Per-date result fields of every config as aligned 2-d arrays, rows are end dates and columns configs
+    dates: DatetimeIndex of end dates
+    columns: MultiIndex of configs, levels CONFIG_LEVELS
+    fields: dict<field name: array (n_dates, n_configs)>, forecast_error and mean_sim_ann, quantile fields
+        when available
+    realized: array (n_dates,) of realized vols, or (n_dates, n_configs) when configs span several assets
+    """
+    def __init__(self, dates, columns, fields, realized):
+        self.dates = dates
+        self.columns = columns
+        self.fields = fields
+        realized = np.asarray(realized, dtype=float)
+        self.realized = realized[:, None] if realized.ndim == 1 else realized
+
+    @classmethod
+    def from_summary(cls, summary):
+        """
+        :param summary: SummaryResults
+        :return: MetricPanel
+        """
+        error_frame = summary.forecast_error_frame
+        # a target short of n_forecast returns is not scored, see SummaryResults.incomplete_frame
+        incomplete = summary.incomplete_frame.reindex(index=error_frame.index, columns=error_frame.columns,
+                                                      fill_value=False).values.astype(bool)
+        fields = {'forecast_error': np.where(incomplete, np.nan, error_frame.values.astype(float)),
+                  'mean_sim_ann': summary.sim_frame.values.astype(float)}
+        for field_name, frame in summary.quantile_frames.items():
+            fields[field_name] = frame.reindex(index=error_frame.index, columns=error_frame.columns).values
+        if summary.realized_frame is not None:
+            realized = summary.realized_frame.reindex(index=error_frame.index, columns=error_frame.columns).values
+        else:
+            realized = summary.realized_series.reindex(error_frame.index).values[:, None]
+        if incomplete.any():
+            realized = np.where(incomplete, np.nan, realized)
+        return cls(error_frame.index, summary.config_index(), fields, realized)
+
+    @property
+    def n_dates(self):
+        return len(self.dates)
+
+    def field(self, field_name):
+        """
+        :return: array (n_dates, n_configs)
+        """
+        if field_name not in self.fields:
+            raise KeyError('Result field {!s} is not in the panel'.format(field_name))
+        return self.fields[field_name]
+
+
+def split_windows(n_dates, n_splits):
+    """
+    Consecutive splits of near-equal length covering every date
+    :return: starts (array of int), ends (array of int, exclusive)
+    """
+    bounds = np.linspace(0, n_dates, n_splits + 1).round().astype(int)
+    return bounds[:-1], bounds[1:]
+
+
+def expanding_windows(n_dates, step, min_periods=1):
+    """
+    Windows from the first date to every step-th date, the first one holding min_periods dates
+    :return: starts (array of int), ends (array of int, exclusive)
+    """
+    ends = np.arange(min_periods, n_dates + 1, step)
+    return np.zeros_like(ends), ends
+
+
+def rolling_windows(n_dates, length, step=1):
+    """
+    Windows of length dates, one every step dates
+    :return: starts (array of int), ends (array of int, exclusive)
+    """
+    starts = np.arange(0, n_dates - length + 1, step)
+    return starts, starts + length
+
+
+class MetricEngine(object):
+    """
+    Evaluates metrics for every config over any set of date windows in one vectorized pass per metric
+    Mean metrics use cumulative sums, so a window costs two lookups whatever its length; quantile metrics
+    gather equal-length windows into one array
+    panel: MetricPanel
+    metrics: list of metric names, see METRICS, DEFAULT_METRICS when None
+    """
+    def __init__(self, panel, metrics=None):
+        self.panel = panel
+        self.metrics = [METRICS[name] for name in (DEFAULT_METRICS if metrics is None else metrics)]
+
+    def _reduce(self, metric, starts, ends):
+        loss = metric.loss(self.panel)
+        if metric.quantile is None:
+            valid = ~np.isnan(loss)
+            totals = np.vstack([np.zeros((1, loss.shape[1])), np.cumsum(np.where(valid, loss, 0.), axis=0)])
+            counts = np.vstack([np.zeros((1, loss.shape[1])), np.cumsum(valid, axis=0)])
+            with np.errstate(invalid='ignore', divide='ignore'):
+                return (totals[ends] - totals[starts]) / (counts[ends] - counts[starts])
+        lengths = ends - starts
+        if len(lengths) > 0 and (lengths == lengths[0]).all():
+            gathered = loss[starts[:, None] + np.arange(lengths[0])]
+            return _nanquantile(gathered, metric.quantile, axis=1)
+        return np.array([_nanquantile(loss[start:end], metric.quantile, axis=0)
+                         for start, end in zip(starts, ends)]).reshape(len(starts), loss.shape[1])
+
+    def evaluate(self, starts, ends, kind='window'):
+        """
+        :param starts: array of window start positions in panel.dates
+        :param ends: array of exclusive window end positions, aligned with starts
+        :param kind: label of the window family, written to the window_kind column
+        :return: long DataFrame, one row per (window, config, metric) with the CONFIG_LEVELS columns and
+            window_kind, window_id, start_date, end_date, n_dates, metric and value; an empty window, as the
+            extra splits of more splits than dates, has NaT dates and NaN values
+        """
+        starts = np.asarray(starts, dtype=int)
+        ends = np.asarray(ends, dtype=int)
+        n_windows = len(starts)
+        n_configs = len(self.panel.columns)
+        empty = ends <= starts
+        ends = np.maximum(starts, ends)
+        start_dates = np.full(n_windows, np.datetime64('NaT'), dtype='datetime64[ns]')
+        end_dates = start_dates.copy()
+        start_dates[~empty] = self.panel.dates[starts[~empty]].values
+        end_dates[~empty] = self.panel.dates[ends[~empty] - 1].values
+        values = np.stack([self._reduce(metric, np.minimum(starts, self.panel.n_dates),
+                                        np.minimum(ends, self.panel.n_dates)) for metric in self.metrics])
+        values[:, empty] = np.nan
+        n_rows = values.size
+        frame = pd.DataFrame(dict(
+            (level, np.tile(self.panel.columns.get_level_values(level).values, n_windows * len(self.metrics)))
+            for level in CONFIG_LEVELS))
+        window_ids = np.tile(np.repeat(np.arange(n_windows), n_configs), len(self.metrics))
+        frame['window_kind'] = kind
+        frame['window_id'] = window_ids
+        frame['start_date'] = start_dates[window_ids]
+        frame['end_date'] = end_dates[window_ids]
+        frame['n_dates'] = (ends - starts)[window_ids]
+        frame['metric'] = np.repeat([metric.name for metric in self.metrics], n_windows * n_configs)
+        frame['value'] = values.reshape(n_rows)
+        return frame
+
+    def splits(self, n_splits):
+        return self.evaluate(*split_windows(self.panel.n_dates, n_splits), kind='split')
+
+    def expanding(self, step, min_periods=1):
+        return self.evaluate(*expanding_windows(self.panel.n_dates, step, min_periods), kind='expanding')
+
+    def rolling(self, length, step=1):
+        return self.evaluate(*rolling_windows(self.panel.n_dates, length, step), kind='rolling')
+
+
+def cross_asset_summary(metric_frame):
+    """
+    Metrics of a multi-asset panel summarized across assets, per window, config and metric
+    :param metric_frame: long DataFrame from MetricEngine.evaluate, configs spanning several assets
+    :return: DataFrame indexed by window_id, the CONFIG_LEVELS other than asset and metric, with n_assets,
+        mean, median, std, min and max columns over the assets holding a value
+    """
+    keys = ['window_id'] + [level for level in CONFIG_LEVELS if level != 'asset'] + ['metric']
+    valid = metric_frame[metric_frame.value.notnull()]
+    return valid.groupby(keys).value.agg(n_assets='size', mean='mean', median='median', std='std', min='min',
+                                         max='max')
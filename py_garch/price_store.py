@@ -0,0 +1,231 @@
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from . import settings
+
+
+# one .npy file per column, opened memory-mapped, plus the source file's identity to tell when it is stale
+PRICE_STORE_SUFFIX = '.prices'
+# a multi-asset file converts to a directory of per-asset stores, with one meta file listing the assets
+PANEL_SUFFIX = '.panel'
+META_NAME = 'meta.json'
+COLUMN_FILES = {'dates': 'dates.npy', 'close': 'close.npy', 'log_returns': 'log_returns.npy'}
+STORE_VERSION = 1
+
+
+def _source_identity(data_file):
+    stat = os.stat(data_file)
+    return {'source': os.path.abspath(data_file), 'source_size': stat.st_size, 'source_mtime_ns': stat.st_mtime_ns}
+
+
+def _staging_path(path):
+    # next to the store, so the finished directory is renamed into place on the same filesystem
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    return tempfile.mkdtemp(prefix=os.path.basename(path) + '.', suffix='.tmp', dir=parent)
+
+
+def _replace_directory(staging_path, path):
+    """
+    Move a fully written store directory to path. A store already there is renamed aside and removed, never
+    written over, so processes holding its files memory-mapped keep reading the old pages
+    :return: None
+    """
+    old_path = staging_path + '.old'
+    try:
+        os.replace(path, old_path)
+    except FileNotFoundError:
+        old_path = None
+    try:
+        os.replace(staging_path, path)
+    except OSError:
+        # another process converted the same file into place in between, keep its store
+        if not os.path.exists(os.path.join(path, META_NAME)):
+            raise
+        shutil.rmtree(staging_path, ignore_errors=True)
+    if old_path is not None:
+        shutil.rmtree(old_path, ignore_errors=True)
+
+
+class PriceStore(object):
+    """
+    Price history converted once to binary columns and opened read-only memory-mapped, so processes sharing
+    it read the same pages instead of each parsing and holding its own DataFrame
+    Log returns are computed at conversion, log_returns[i] being the return into dates[i] (NaN at 0), and
+    return slices are handed out as views
+    path: directory holding the column files
+
+    Attributes:
+        dates: datetime64[ns] memmap, sorted
+        close: float64 memmap
+        log_returns: float64 memmap
+        meta: dict, source file identity, row count and whether every return is finite
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, META_NAME)) as meta_file:
+            self.meta = json.load(meta_file)
+        for name, file_name in COLUMN_FILES.items():
+            setattr(self, name, np.load(os.path.join(path, file_name), mmap_mode='r'))
+        self._frame = None
+        self._fingerprint = None
+
+    def __reduce__(self):
+        # workers reopen the files rather than receive a pickled copy of the arrays
+        return self.__class__, (self.path,)
+
+    def __len__(self):
+        return len(self.dates)
+
+    @classmethod
+    def default_path(cls, data_file, suffix=PRICE_STORE_SUFFIX):
+        """
+        :return: str, store directory for data_file under TMP_PATH
+        """
+        name = os.path.splitext(os.path.basename(data_file))[0]
+        return os.path.join(settings.get('TMP_PATH'), name + suffix)
+
+    @classmethod
+    def is_current(cls, path, data_file):
+        """
+        :return: bool, whether path holds a store converted from data_file as it is now
+        """
+        meta_path = os.path.join(path, META_NAME)
+        if not os.path.exists(meta_path):
+            return False
+        with open(meta_path) as meta_file:
+            meta = json.load(meta_file)
+        identity = _source_identity(data_file)
+        return meta.get('version') == STORE_VERSION and \
+            all(meta.get(key) == value for key, value in identity.items())
+
+    @classmethod
+    def write(cls, x_frame, path, data_file=None, date_var='Date', price_var='Close'):
+        """
+        Convert a price frame to a store, replacing any store at path; the store is written to a directory
+        next to path and renamed into place, so readers see the old store or the new one, never a mix
+        :param x_frame: DataFrame of prices sorted by date
+        :param data_file: file x_frame was read from, recorded to detect a stale store
+        :return: PriceStore
+        """
+        staging_path = _staging_path(path)
+        try:
+            cls._write_columns(x_frame, staging_path, data_file, date_var, price_var)
+        except Exception:
+            shutil.rmtree(staging_path, ignore_errors=True)
+            raise
+        _replace_directory(staging_path, path)
+        return cls(path)
+
+    @classmethod
+    def _write_columns(cls, x_frame, path, data_file=None, date_var='Date', price_var='Close'):
+        dates = np.asarray(x_frame[date_var].values, dtype='datetime64[ns]')
+        close = np.asarray(x_frame[price_var].values, dtype=float)
+        log_returns = np.empty_like(close)
+        log_returns[0] = np.nan
+        with np.errstate(divide='ignore', invalid='ignore'):
+            log_returns[1:] = np.diff(np.log(close))
+        os.makedirs(path, exist_ok=True)
+        for name, values in [('dates', dates), ('close', close), ('log_returns', log_returns)]:
+            np.save(os.path.join(path, COLUMN_FILES[name]), values)
+        meta = {'version': STORE_VERSION, 'n_rows': len(close),
+                'all_finite': bool(np.isfinite(log_returns[1:]).all())}
+        if data_file is not None:
+            meta.update(_source_identity(data_file))
+        with open(os.path.join(path, META_NAME), 'w') as meta_file:
+            json.dump(meta, meta_file)
+
+    @classmethod
+    def for_data_file(cls, data_file, read_frame, path=None):
+        """
+        Open the store of data_file, converting it first when missing or older than the file
+        :param read_frame: function parsing data_file to a DataFrame with Date and Close columns
+        :param path: store directory, default_path when None
+        :return: PriceStore
+        """
+        if path is None:
+            path = cls.default_path(data_file)
+        if not cls.is_current(path, data_file):
+            return cls.write(read_frame(data_file), path, data_file)
+        return cls(path)
+
+    @classmethod
+    def for_panel_file(cls, data_file, read_panel, path=None):
+        """
+        Open the store of every asset of a multi-asset data file, converting them all from one read of the file
+        when missing or older than the file
+        :param read_panel: function parsing data_file to a dict<asset: DataFrame with Date and Close columns>
+        :param path: directory holding a store per asset, default_path with PANEL_SUFFIX when None
+        :return: dict<asset: PriceStore>, in the order read_panel returned them
+        """
+        if path is None:
+            path = cls.default_path(data_file, PANEL_SUFFIX)
+        if cls.is_current(path, data_file):
+            with open(os.path.join(path, META_NAME)) as meta_file:
+                assets = json.load(meta_file)['assets']
+            return dict((asset, cls(os.path.join(path, asset))) for asset in assets)
+        staging_path = _staging_path(path)
+        try:
+            assets = []
+            for asset, x_frame in read_panel(data_file).items():
+                cls._write_columns(x_frame, os.path.join(staging_path, asset))
+                assets.append(asset)
+            meta = {'version': STORE_VERSION, 'assets': assets}
+            meta.update(_source_identity(data_file))
+            with open(os.path.join(staging_path, META_NAME), 'w') as meta_file:
+                json.dump(meta, meta_file)
+        except Exception:
+            shutil.rmtree(staging_path, ignore_errors=True)
+            raise
+        _replace_directory(staging_path, path)
+        return dict((asset, cls(os.path.join(path, asset))) for asset in assets)
+
+    @property
+    def fingerprint(self):
+        """
+        Cheap identity of the price history, as RUtilities.frame_fingerprint for frames
+        :return: tuple
+        """
+        if self._fingerprint is None:
+            self._fingerprint = (len(self), self.dates[0], self.dates[-1], float(self.close.sum()))
+        return self._fingerprint
+
+    def frame(self):
+        """
+        DataFrame of the Date and Close columns, for consumers that need one, built once per process
+        :return: DataFrame
+        """
+        if self._frame is None:
+            self._frame = pd.DataFrame({'Date': self.dates, 'Close': self.close}, copy=False)
+        return self._frame
+
+    def position(self, date, side='left'):
+        """
+        :return: int, searchsorted position of date in dates
+        """
+        return int(np.searchsorted(self.dates, np.datetime64(pd.Timestamp(date), 'ns'), side=side))
+
+    def returns(self):
+        """
+        :return: log returns between consecutive prices, a view one shorter than dates
+        """
+        return self.log_returns[1:]
+
+    def split_returns(self, start_date, end_date):
+        """
+        Log returns within [start_date, end_date] and from end_date onward, as garch_engine.split_returns
+        slices a frame; views unless non-finite returns have to be dropped
+        :return: returns_past (array), returns_future (array)
+        """
+        first = self.position(start_date)
+        last = self.position(end_date, side='right')
+        future_first = self.position(end_date)
+        returns_past = self.log_returns[first + 1:last]
+        returns_future = self.log_returns[future_first + 1:]
+        if not self.meta['all_finite']:
+            returns_past = returns_past[np.isfinite(returns_past)]
+            returns_future = returns_future[np.isfinite(returns_future)]
+        return returns_past, returns_future
@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+from .price_store import PriceStore
+from .simulation import ANNUALIZATION_DAYS
+
+
+def price_returns(x_frame, date_var='Date', price_var='Close'):
+    """
+    :param x_frame: DataFrame of prices, or PriceStore whose precomputed returns are used
+    :return: dates (array), log returns between consecutive prices (array, one shorter than dates)
+    """
+    if isinstance(x_frame, PriceStore):
+        return x_frame.dates, x_frame.returns()
+    return x_frame[date_var].values, np.diff(np.log(x_frame[price_var].values.astype(float)))
+
+
+class RealizedTargets(object):
+    """
+    Forward realized vol of every date of a price history, the target every config ending on that date is
+    scored against; computed in one cumulative pass per n_forecast instead of once per fit
+    x_frame: DataFrame of prices or PriceStore
+
+    Attributes:
+        dates: array of the price history dates
+        by_forecast: dict<n_forecast: (vol_realized_ann array, n_realized array)>, one value per date
+    """
+    def __init__(self, x_frame):
+        self.dates, returns = price_returns(x_frame)
+        self.cumulative = np.concatenate([[0.], np.cumsum(returns ** 2)])
+        self.by_forecast = {}
+
+    def targets(self, n_forecast):
+        """
+        Annualized vol of the first n_forecast returns after each date, over the returns available when the
+        history ends sooner
+        :return: vol_realized_ann (array), n_realized (array), one value per date
+        """
+        if n_forecast not in self.by_forecast:
+            positions = np.arange(len(self.dates))
+            n_realized = np.clip(len(self.cumulative) - 1 - positions, 0, n_forecast)
+            sum_squares = self.cumulative[positions + n_realized] - self.cumulative[positions]
+            vol_realized_ann = np.sqrt(ANNUALIZATION_DAYS) * np.sqrt(sum_squares / (n_forecast - 1.))
+            self.by_forecast[n_forecast] = vol_realized_ann, n_realized
+        return self.by_forecast[n_forecast]
+
+    def at(self, end_dates, n_forecast):
+        """
+        :param end_dates: sequence of end dates present in the price history
+        :return: vol_realized_ann (array), n_realized (array)
+        """
+        positions = np.searchsorted(self.dates, np.asarray(end_dates, dtype=self.dates.dtype), side='left')
+        vol_realized_ann, n_realized = self.targets(n_forecast)
+        return vol_realized_ann[positions], n_realized[positions]
+
+    def series(self, end_dates, n_forecast):
+        """
+        :return: Series of vol_realized_ann named Realized, as SummaryResults.realized_series
+        """
+        vol_realized_ann, _ = self.at(end_dates, n_forecast)
+        return pd.Series(vol_realized_ann, index=pd.DatetimeIndex(end_dates, name='data_end_date'), name='Realized')
+
+    def set_realized(self, results):
+        """
+        Set the realized vol target and forecast error of results, grouped by n_forecast
+        :param results: list of RVolModelSingleResult
+        :return: None
+        """
+        by_forecast = {}
+        for result in results:
+            by_forecast.setdefault(result.params.n_forecast, []).append(result)
+        for n_forecast, group in by_forecast.items():
+            vols, n_realized = self.at([result.data_end_date for result in group], n_forecast)
+            for result, vol, n in zip(group, vols, n_realized):
+                result.set_realized(vol, n)
+
+
+def realized_targets(x_frame, end_dates, n_forecast):
+    """
+    RealizedTargets of a price history, for end dates present in it
+    :return: vol_realized_ann (array), n_realized (array)
+    """
+    return RealizedTargets(x_frame).at(end_dates, n_forecast)
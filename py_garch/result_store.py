@@ -0,0 +1,244 @@
+import glob
+import os
+import sqlite3
+import pandas as pd
+from . import settings
+from .vol_estimator import AllDatesVolModelRunParams, RVolModelSingleResult, RVMSingleResultCache
+
+
+RESULT_STORE_NAME = 'rvm_results.sqlite'
+# seconds a write waits on another process's transaction, as when several work queue workers share the store
+BUSY_TIMEOUT = 60.
+# meta entry holding the last price date the daily update ran to
+LAST_DATE_KEY = 'last_data_date'
+
+# (column, SQL type, default for rows written before the column existed)
+PARAM_COLUMNS = [('model_type', 'TEXT', None),
+                 ('test_dist', 'TEXT', None),
+                 ('n_sims', 'INTEGER', None),
+                 ('n_forecast', 'INTEGER', None),
+                 ('window', 'INTEGER', None),
+                 ('refit_every', 'INTEGER', 1),
+                 ('forecast_mode', 'TEXT', 'simulate'),
+                 ('asset', 'TEXT', '')]
+DATE_COLUMNS = ['data_start_date', 'data_end_date']
+VALUE_COLUMNS = ['quantile0_pct', 'quantile25_pct', 'quantile50_pct', 'quantile75_pct', 'quantile100_pct',
+                 'mean_sim_ann', 'vol_realized_ann', 'forecast_error']
+# fit diagnostics and realized target coverage, NULL for rows written before they were recorded
+FIT_COLUMNS = [('coefficients', 'TEXT'),
+               ('solver_iterations', 'INTEGER'),
+               ('fit_seconds', 'REAL'),
+               ('warm_start', 'INTEGER'),
+               ('converged', 'INTEGER'),
+               ('n_realized', 'INTEGER'),
+               ('n_sims_used', 'INTEGER'),
+               ('sim_std_error', 'REAL'),
+               ('failure', 'TEXT')]
+
+
+class RVMResultStore(object):
+    """
+    Single SQLite file holding every RVolModelSingleResult, one row per (params, start date, end date)
+    Replaces the one-file-per-fit RVMSingleResultCache
+    path: SQLite file, created on first use, RESULT_STORE_NAME under TMP_PATH when None
+
+    Attributes:
+        cached: dict<store key: RVolModelSingleResult>, bulk loaded on the first lookup and kept in step
+            with appends
+    """
+    def __init__(self, path=None):
+        self.path = self.default_path() if path is None else path
+        self.conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT)
+        self.cached = None
+        self._ensure_schema()
+
+    @classmethod
+    def default_path(cls):
+        return os.path.join(settings.get('TMP_PATH'), RESULT_STORE_NAME)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    @property
+    def key_columns(self):
+        return [c[0] for c in PARAM_COLUMNS] + DATE_COLUMNS
+
+    def _ensure_schema(self):
+        columns = ['"{!s}" {!s}'.format(name, sql_type) for name, sql_type, _ in PARAM_COLUMNS] + \
+            ['{!s} TEXT'.format(name) for name in DATE_COLUMNS] + \
+            ['{!s} REAL'.format(name) for name in VALUE_COLUMNS] + \
+            ['{!s} {!s}'.format(name, sql_type) for name, sql_type in FIT_COLUMNS]
+        self.conn.execute('CREATE TABLE IF NOT EXISTS results ({!s})'.format(', '.join(columns)))
+        self.conn.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)')
+        existing = [row[1] for row in self.conn.execute('PRAGMA table_info(results)')]
+        for name, sql_type in FIT_COLUMNS:
+            if name not in existing:
+                self.conn.execute('ALTER TABLE results ADD COLUMN {!s} {!s}'.format(name, sql_type))
+        added = False
+        for name, sql_type, default in PARAM_COLUMNS:
+            if name not in existing:
+                self.conn.execute('ALTER TABLE results ADD COLUMN "{!s}" {!s} DEFAULT {!s}'.format(
+                    name, sql_type, 'NULL' if default is None else repr(default)))
+                added = True
+        if added:
+            self.conn.execute('DROP INDEX IF EXISTS results_key')
+        self.conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS results_key ON results ({!s})'.format(
+            ', '.join(['"{!s}"'.format(c) for c in self.key_columns])))
+        self.conn.commit()
+
+    def assets(self):
+        """
+        Assets holding stored results, '' for the single data file
+        :return: list of str, sorted
+        """
+        return [row[0] for row in self.conn.execute('SELECT DISTINCT asset FROM results ORDER BY asset')]
+
+    def get_meta(self, name):
+        """
+        :return: str value stored under name, or None
+        """
+        row = self.conn.execute('SELECT value FROM meta WHERE name = ?', (name,)).fetchone()
+        return None if row is None else row[0]
+
+    def set_meta(self, name, value):
+        self.conn.execute('INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)', (name, str(value)))
+        self.conn.commit()
+
+    @classmethod
+    def key(cls, data_start_date, data_end_date, params):
+        """
+        Store key of a result
+        :return: tuple
+        """
+        return tuple(getattr(params, name) for name, _, _ in PARAM_COLUMNS) + \
+            (data_start_date.strftime('%Y-%m-%d'), data_end_date.strftime('%Y-%m-%d'))
+
+    @classmethod
+    def result_key(cls, result):
+        return cls.key(result.data_start_date, result.data_end_date, result.params)
+
+    @property
+    def stored_columns(self):
+        return VALUE_COLUMNS + [name for name, _ in FIT_COLUMNS]
+
+    def _row(self, result):
+        return self.result_key(result) + tuple(getattr(result, name) for name in self.stored_columns)
+
+    def append(self, results):
+        """
+        Write a batch of results in one transaction, replacing rows with the same key
+        :param results: list of RVolModelSingleResult
+        :return: None
+        """
+        columns = self.key_columns + self.stored_columns
+        self.conn.executemany('INSERT OR REPLACE INTO results ({!s}) VALUES ({!s})'.format(
+            ', '.join(['"{!s}"'.format(c) for c in columns]), ', '.join(['?'] * len(columns))),
+            [self._row(result) for result in results])
+        self.conn.commit()
+        if self.cached is not None:
+            for result in results:
+                self.cached[self.result_key(result)] = result
+
+    def lookup(self, data_start_date, data_end_date, params):
+        """
+        Stored result for the key, or None, answered from memory after one bulk preload
+        :return: RVolModelSingleResult or None
+        """
+        if self.cached is None:
+            self.cached = self.preload()
+        return self.cached.get(self.key(data_start_date, data_end_date, params))
+
+    def incomplete(self):
+        """
+        Stored results whose realized vol target did not yet cover n_forecast returns
+        :return: list of RVolModelSingleResult
+        """
+        if self.cached is None:
+            self.cached = self.preload()
+        return [result for result in self.cached.values() if not result.is_complete and not result.is_failed]
+
+    def fill_holders(self, model_results):
+        """
+        Add every stored result to the holder of its params, results of other params and failed tasks are
+        left out
+        :param model_results: list of RVolModelMultiDateResult
+        :return: None
+        """
+        holders = dict((result_holder.params, result_holder) for result_holder in model_results)
+        if self.cached is None:
+            self.cached = self.preload()
+        for result in self.cached.values():
+            result_holder = holders.get(result.params)
+            if result_holder is not None and not result.is_failed:
+                result_holder.add_result(result)
+
+    def status(self):
+        """
+        Stored results per config, counted in SQL without loading them
+        :return: DataFrame indexed by the parameter columns with n_results, first_end_date, last_end_date,
+            n_incomplete and n_failed columns
+        """
+        param_names = ['"{!s}"'.format(name) for name, _, _ in PARAM_COLUMNS]
+        frame = pd.read_sql_query(
+            'SELECT {columns}, COUNT(*) AS n_results, MIN(data_end_date) AS first_end_date, '
+            'MAX(data_end_date) AS last_end_date, SUM(n_realized < n_forecast) AS n_incomplete, '
+            'SUM(failure IS NOT NULL) AS n_failed '
+            'FROM results GROUP BY {columns}'.format(columns=', '.join(param_names)), self.conn)
+        frame['n_incomplete'] = frame.n_incomplete.fillna(0).astype(int)
+        frame['n_failed'] = frame.n_failed.fillna(0).astype(int)
+        return frame.set_index([name for name, _, _ in PARAM_COLUMNS])
+
+    def preload(self):
+        """
+        Read every stored result in one query
+        :return: dict<store key: RVolModelSingleResult>
+        """
+        frame = pd.read_sql_query('SELECT * FROM results', self.conn)
+        starts = pd.to_datetime(frame.data_start_date)
+        ends = pd.to_datetime(frame.data_end_date)
+        param_names = [name for name, _, _ in PARAM_COLUMNS]
+        stored_columns = self.stored_columns
+        # older rows have no fit diagnostics, keep those as None rather than NaN
+        fit_names = [name for name, _ in FIT_COLUMNS]
+        frame[fit_names] = frame[fit_names].astype(object).where(frame[fit_names].notnull(), None)
+        params_cache = {}
+        results = {}
+        for row, data_start_date, data_end_date in zip(
+                frame[param_names + DATE_COLUMNS + stored_columns].itertuples(index=False), starts, ends):
+            param_values = tuple(row[:len(param_names)])
+            params = params_cache.get(param_values)
+            if params is None:
+                params = AllDatesVolModelRunParams.from_key_values(dict(zip(param_names, param_values)))
+                params_cache[param_values] = params
+            result = RVolModelSingleResult(data_start_date, data_end_date, params)
+            for name, value in zip(stored_columns, row[len(param_names) + len(DATE_COLUMNS):]):
+                setattr(result, name, value)
+            results[param_values + tuple(row[len(param_names):len(param_names) + len(DATE_COLUMNS)])] = result
+        return results
+
+    def migrate_file_cache(self, cache_path=None, batch_size=5000):
+        """
+        One-shot import of the RVMSingleResultCache text files found in cache_path
+        :param cache_path: directory of cached result files, TMP_PATH when None
+        :param batch_size: results written per transaction
+        :return: number of results imported
+        """
+        cache_path = settings.get('TMP_PATH') if cache_path is None else cache_path
+        batch = []
+        n_imported = 0
+        for file_name in sorted(glob.glob(os.path.join(cache_path, '*GARCH_*.txt'))):
+            batch.append(RVMSingleResultCache.read(file_name))
+            if len(batch) >= batch_size:
+                self.append(batch)
+                n_imported += len(batch)
+                batch = []
+        if len(batch) > 0:
+            self.append(batch)
+            n_imported += len(batch)
+        return n_imported
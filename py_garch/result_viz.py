@@ -1,96 +1,324 @@
 import seaborn as sns
-from config import PLOT_PATH
+from . import settings
 import os
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
+from .metrics import MetricEngine, MetricPanel, CONFIG_LEVELS, QUANTILE_FIELDS, DEFAULT_METRICS, cross_asset_summary
+from .simulation import SIMULATE
+
+
+def plot_path(save_path=None):
+    """
+    :param save_path: directory a plot function was given to save its figures to
+    :return: save_path, settings PLOT_PATH when None
+    """
+    return settings.get('PLOT_PATH') if save_path is None else save_path
+
+
+def window_name(window):
+    """
+    :param window: window length, or -1 for full history
+    :return: str, the window's label in figures
+    """
+    return '{!s} Days'.format(window) if int(window) != -1 else 'Full History'
+
+
+def variant_suffix(asset='', refit_every=1, forecast_mode=SIMULATE):
+    """
+    Suffix of the column and figure names of a config variant: _refitK when refit_every is not 1, _mode when
+    forecast_mode is not simulate and _asset in a multi-asset panel, empty for the baseline
+    :return: str
+    """
+    suffix = ''
+    if refit_every != 1:
+        suffix = '{!s}_refit{!s}'.format(suffix, refit_every)
+    if forecast_mode != SIMULATE:
+        suffix = '{!s}_{!s}'.format(suffix, forecast_mode)
+    if asset:
+        suffix = '{!s}_{!s}'.format(suffix, asset)
+    return suffix
+
+
+def config_columns(frame, **levels):
+    """
+    Columns of a frame labelled by config, see SummaryResults.by_config, holding the given level values
+    :param levels: CONFIG_LEVELS level: value
+    :return: DataFrame
+    """
+    mask = np.ones(frame.shape[1], dtype=bool)
+    for level, value in levels.items():
+        mask &= frame.columns.get_level_values(level).values == value
+    return frame.iloc[:, mask]
 
 
 class SummaryResults(object):
-    def __init__(self, model_results):
+    def __init__(self, model_results, realized_series=None):
+        """
+        :param model_results: list of RVolModelMultiDateResult
+        :param realized_series: Series of the realized vol per end date, e.g. RealizedTargets.series; read from
+            the stored results when None. Holders of a multi-asset panel have a target per asset, read from
+            the stored results into realized_frame instead, and realized_series is left None
+        """
         self.model_results = model_results
         self.forecast_error_frame = None
-        self.realized_series = None
+        self.realized_series = realized_series
+        self.realized_frame = None
+        self.incomplete_frame = None
         self.sim_frame = None
+        self.quantile_frames = {}
         self.set_timeseries_frames()
 
+    @classmethod
+    def column_name(cls, params):
+        """
+        Frame column of a config, model_type_test_dist_window, suffixed _refitK when refit_every is not 1,
+        _mode when forecast_mode is not simulate and _asset in a multi-asset panel
+        :param params: AllDatesVolModelRunParams
+        :return: str
+        """
+        return '{!s}_{!s}_{!s}{!s}'.format(params.model_type, params.test_dist, params.window,
+                                           variant_suffix(params.asset, params.refit_every, params.forecast_mode))
+
+    @property
+    def is_panel(self):
+        """
+        Whether the holders span the assets of a multi-asset panel rather than the single data file
+        :return: bool
+        """
+        return any(result_holder.params.asset for result_holder in self.model_results)
+
+    def config_index(self):
+        """
+        Config of each forecast_error_frame column, read from the holders' params
+        :return: MultiIndex with CONFIG_LEVELS levels
+        """
+        configs = dict((self.column_name(result_holder.params), tuple(getattr(result_holder.params, level)
+                                                                      for level in CONFIG_LEVELS))
+                       for result_holder in self.model_results)
+        return pd.MultiIndex.from_tuples([configs[name] for name in self.forecast_error_frame.columns],
+                                         names=CONFIG_LEVELS)
+
+    def by_config(self, frame):
+        """
+        :param frame: DataFrame with a column per config, as forecast_error_frame
+        :return: DataFrame of the same values with the config_index column labels
+        """
+        frame = frame[self.forecast_error_frame.columns].copy()
+        frame.columns = self.config_index()
+        return frame
+
+    def metric_engine(self, metrics=None):
+        """
+        :param metrics: list of metric names, see metrics.METRICS
+        :return: MetricEngine over these frames
+        """
+        return MetricEngine(MetricPanel.from_summary(self), metrics)
+
+    @classmethod
+    def load(cls, model_results, path):
+        """
+        Summary saved by save, without rebuilding the frames from the holders
+        :return: SummaryResults
+        """
+        summary = cls.__new__(cls)
+        summary.model_results = model_results
+        frames = pd.read_pickle(path)
+        summary.forecast_error_frame = frames['forecast_error_frame']
+        summary.realized_series = frames['realized_series']
+        summary.realized_frame = frames.get('realized_frame')
+        # summaries saved before incomplete targets were tracked count every target as complete
+        summary.incomplete_frame = frames.get('incomplete_frame', pd.DataFrame(
+            False, index=summary.forecast_error_frame.index, columns=summary.forecast_error_frame.columns))
+        summary.sim_frame = frames['sim_frame']
+        summary.quantile_frames = frames.get('quantile_frames', {})
+        return summary
+
+    def save(self, path):
+        pd.to_pickle({'forecast_error_frame': self.forecast_error_frame,
+                      'realized_series': self.realized_series,
+                      'realized_frame': self.realized_frame,
+                      'incomplete_frame': self.incomplete_frame,
+                      'sim_frame': self.sim_frame,
+                      'quantile_frames': self.quantile_frames}, path)
+
+    def update_results(self, results):
+        """
+        Write new or revised results into the frames in place, adding rows for new end dates
+        :param results: list of RVolModelSingleResult
+        :return: None
+        """
+        for result in results:
+            name = self.column_name(result.params)
+            is_complete = result.is_complete
+            self.forecast_error_frame.loc[result.data_end_date, name] = \
+                result.forecast_error if is_complete else np.nan
+            self.incomplete_frame.loc[result.data_end_date, name] = not is_complete
+            self.sim_frame.loc[result.data_end_date, name] = result.mean_sim_ann
+            vol_realized_ann = result.vol_realized_ann if is_complete else np.nan
+            if self.realized_frame is not None:
+                self.realized_frame.loc[result.data_end_date, name] = vol_realized_ann
+            else:
+                self.realized_series.loc[result.data_end_date] = vol_realized_ann
+            for field_name, frame in self.quantile_frames.items():
+                frame.loc[result.data_end_date, name] = getattr(result, field_name)
+        self.incomplete_frame = self.incomplete_frame.fillna(False).astype(bool).sort_index()
+        self.forecast_error_frame.sort_index(inplace=True)
+        self.sim_frame.sort_index(inplace=True)
+        if self.realized_frame is not None:
+            self.realized_frame.sort_index(inplace=True)
+        else:
+            self.realized_series.sort_index(inplace=True)
+        for frame in self.quantile_frames.values():
+            frame.sort_index(inplace=True)
+
     def set_timeseries_frames(self):
-        forecast_error_list = []
-        for result_holder in self.model_results:
-            r_frame = result_holder.get_result_frame()
-            name = '{!s}_{!s}_{!s}'.format(
-                result_holder.params.model_type, result_holder.params.test_dist, result_holder.params.window)
-            forecast_error_series = r_frame.set_index('data_end_date').forecast_error.copy()
-            forecast_error_series.name = name
-            forecast_error_list.append(forecast_error_series)
-
-        self.forecast_error_frame = pd.DataFrame(forecast_error_list).T
-
-        result_holder = self.model_results[0]
-        r_frame = result_holder.get_result_frame()
-        self.realized_series = r_frame.set_index('data_end_date').vol_realized_ann.copy()
-        self.realized_series.name = 'Realized'
-
-        self.sim_frame = self.forecast_error_frame.apply(lambda error_col: self.realized_series - error_col)
-
-    def summary_error_frame(self, sub_start=0, sub_end=-1):
-        error_frame_sub = self.forecast_error_frame.iloc[sub_start:sub_end]
-        mses = (error_frame_sub**2).mean()
-        maes = (error_frame_sub.abs()).mean()
-        q3abs = error_frame_sub.abs().quantile(.75)
-
-        model_types = list(map(lambda x: x.split('_')[0], mses.index))
-        dist_types = list(map(lambda x: x.split('_')[1], mses.index))
-        windows = list(map(lambda x: x.split('_')[2], mses.index))
-        mse_values = mses.tolist()
-        mae_values = maes.tolist()
-        q3_values = q3abs.tolist()
-        summary_frame = pd.DataFrame([mse_values, mae_values, q3_values, model_types, dist_types, windows],
-            index=['mse','mae','q3_abs', 'model_type','dist_type','window']).T
+        """
+        Slice the frames from the holders' ResultArrays, one block per distinct arrays object
+        :return: None
+        """
+        names = [self.column_name(result_holder.params) for result_holder in self.model_results]
+        groups = {}
+        for result_holder, name in zip(self.model_results, names):
+            group = groups.setdefault(id(result_holder.arrays), (result_holder.arrays, [], []))
+            group[1].append(result_holder.row)
+            group[2].append(name)
+
+        def field_frame(field_name):
+            frames = [arrays.field_frame(field_name, rows, group_names)
+                      for arrays, rows, group_names in groups.values()]
+            return frames[0] if len(frames) == 1 else pd.concat(frames, axis=1).sort_index()[names]
+
+        self.sim_frame = field_frame('mean_sim_ann')
+        self.quantile_frames = dict((field_name, field_frame(field_name)) for field_name in QUANTILE_FIELDS)
+        # targets of the newest end dates cover fewer than n_forecast returns until the prices catch up, they
+        # are left out of the errors and metrics rather than scored low
+        n_forecasts = pd.Series([result_holder.params.n_forecast for result_holder in self.model_results],
+                                index=names)
+        self.incomplete_frame = field_frame('n_realized').lt(n_forecasts, axis=1)
+
+        # a panel's target depends on the asset too, each config is scored against its own stored targets
+        if self.is_panel:
+            self.realized_frame = field_frame('vol_realized_ann').reindex(self.sim_frame.index)
+            self.realized_frame = self.realized_frame.mask(self.incomplete_frame)
+            self.forecast_error_frame = self.sim_frame.rsub(self.realized_frame)
+            return
 
+        # the target depends on the end date only: any config holding a result for the date carries it
+        if self.realized_series is None:
+            realized_frame = field_frame('vol_realized_ann')
+            self.realized_series = realized_frame.bfill(axis=1).iloc[:, 0].rename('Realized')
+        self.realized_series = self.realized_series.reindex(self.sim_frame.index)
+        self.realized_series = self.realized_series.mask(self.incomplete_frame.any(axis=1))
+
+        self.forecast_error_frame = self.sim_frame.rsub(self.realized_series, axis=0)
+
+    @classmethod
+    def wide_summary_frame(cls, metric_frame):
+        """
+        One window of MetricEngine output in the layout of the metric plots, a row per config
+        :param metric_frame: long DataFrame from MetricEngine.evaluate, one window_id
+        :return: DataFrame with a column per metric and asset, model_type, dist_type, window, refit_every,
+            forecast_mode, window_name columns, full history windows ordered last as 10000
+        """
+        summary_frame = metric_frame.pivot_table(index=CONFIG_LEVELS, columns='metric', values='value',
+                                                 dropna=False).reset_index()
+        summary_frame.columns.name = None
+        summary_frame = summary_frame.rename(columns={'test_dist': 'dist_type'})
         summary_frame['window'] = summary_frame.window.astype('int')
-        summary_frame['mse'] = summary_frame.mse.astype('float')
-        summary_frame['mae'] = summary_frame.mae.astype('float')
-        summary_frame['q3_abs'] = summary_frame.q3_abs.astype('float')
-        summary_frame['window_name'] = summary_frame['window'].apply(
-            lambda w: '{!s} Days'.format(w) if int(w) != -1 else 'Full History')
+        summary_frame['window_name'] = summary_frame['window'].apply(window_name)
         summary_frame.loc[summary_frame[summary_frame.window==-1].index,'window'] = 10000
-        summary_frame.sort_values(by=['window','model_type','dist_type'],inplace=True)
+        summary_frame.sort_values(by=['asset','window','model_type','dist_type','refit_every','forecast_mode'],
+                                  inplace=True)
         return summary_frame
 
+    def summary_error_frame(self, sub_start=0, sub_end=-1, metrics=None):
+        """
+        Metrics of every config over the rows forecast_error_frame.iloc[sub_start:sub_end]
+        :param metrics: list of metric names, DEFAULT_METRICS when None
+        :return: DataFrame, see wide_summary_frame
+        """
+        return self.split_summary_frames([(sub_start, sub_end)], metrics)[0]
+
+    def split_summary_frames(self, splits, metrics=None):
+        """
+        Metrics of every config over several row ranges, evaluated in one pass
+        :param splits: list of (sub_start, sub_end) row slices of forecast_error_frame, as iloc bounds
+        :param metrics: list of metric names, DEFAULT_METRICS when None
+        :return: list of DataFrame aligned with splits, see wide_summary_frame
+        """
+        n_dates = self.forecast_error_frame.shape[0]
+        bounds = [range(n_dates)[sub_start:sub_end] for sub_start, sub_end in splits]
+        metric_frame = self.metric_engine(DEFAULT_METRICS if metrics is None else metrics).evaluate(
+            [b.start for b in bounds], [max(b.start, b.stop) for b in bounds], kind='split')
+        return [self.wide_summary_frame(metric_frame[metric_frame.window_id == window_id])
+                for window_id in range(len(splits))]
 
-def summary_frame_metric_plots(metric, summary_frame, split=-1, save_fig=True):
+    def cross_asset_frame(self, sub_start=0, sub_end=-1, metrics=None):
+        """
+        Metrics of every (asset, config) over the rows forecast_error_frame.iloc[sub_start:sub_end], evaluated in
+        one pass and summarized across assets per config
+        :param metrics: list of metric names, DEFAULT_METRICS when None
+        :return: DataFrame, see metrics.cross_asset_summary
+        """
+        bounds = range(self.forecast_error_frame.shape[0])[sub_start:sub_end]
+        metric_frame = self.metric_engine(DEFAULT_METRICS if metrics is None else metrics).evaluate(
+            [bounds.start], [max(bounds.start, bounds.stop)], kind='split')
+        return cross_asset_summary(metric_frame)
+
+
+def summary_frame_metric_plots(metric, summary_frame, split=-1, suffix='', save_fig=True, save_path=None):
+    """
+    Bars of one metric by window, model and distribution
+    :param summary_frame: one config variant of a wide_summary_frame, a row per model_type, dist_type and window
+    :param suffix: variant_suffix of the configs, appended to the file names
+    """
     if split == -1:
         split_post_fix = '_all'
         split_title = 'Full Period'
     else:
         split_post_fix = '_split_{!s}'.format(split)
         split_title = 'Split {!s}'.format(split)
+    split_post_fix = split_post_fix + suffix
     g = sns.catplot(kind='bar',x='window_name', y=metric, hue='model_type',col='dist_type',data=summary_frame)
     g.despine(left=True).set_ylabels(metric).\
         set(ylim=(summary_frame[metric].min()*.97, summary_frame[metric].max()*1.03)).fig.suptitle(split_title)
     if save_fig:
-        g.savefig(os.path.join(PLOT_PATH, '{!s}_win_model_dist{!s}.png'.format(metric, split_post_fix)))
+        g.savefig(os.path.join(plot_path(save_path), '{!s}_win_model_dist{!s}.png'.format(metric, split_post_fix)))
     g = sns.catplot(kind='bar',x='model_type', y=metric, hue='window_name',col='dist_type',data=summary_frame)
     g.despine(left=True).set_ylabels(metric).\
         set(ylim=(summary_frame[metric].min()*.97, summary_frame[metric].max()*1.03)).fig.suptitle(split_title)
     if save_fig:
-        g.savefig(os.path.join(PLOT_PATH, '{!s}_model_win_dist{!s}.png'.format(metric, split_post_fix)))
+        g.savefig(os.path.join(plot_path(save_path), '{!s}_model_win_dist{!s}.png'.format(metric, split_post_fix)))
     g = sns.catplot(kind='bar',x='model_type', y=metric, hue='dist_type',col='window_name',data=summary_frame)
     g.despine(left=True).set_ylabels(metric).\
         set(ylim=(summary_frame[metric].min()*.97, summary_frame[metric].max()*1.03)).fig.suptitle(split_title)
     if save_fig:
-        g.savefig(os.path.join(PLOT_PATH, '{!s}_model_dist_win{!s}.png'.format(metric, split_post_fix)))
+        g.savefig(os.path.join(plot_path(save_path), '{!s}_model_dist_win{!s}.png'.format(metric, split_post_fix)))
         plt.close('all')
 
 
-def plot_sim_realized_timeseries_group(sim_frame, realized_series, model_type, dist_type, save_fig=True):
-    subset = list(filter(lambda c: c.split('_')[0]==model_type, sim_frame.columns))
-    subset = list(filter(lambda c: c.split('_')[1]==dist_type, subset))
-    tmp = sim_frame[subset].copy()
-    windows = list(map(lambda c: c.split('_')[2], subset))
-    windows_names = list(map(lambda w: w + ' Days' if int(w)!=-1 else 'Full History', windows))
-    tmp.columns = windows_names
+def _model_group(frame, model_type, dist_type):
+    # the configs of one model and distribution, labelled by window
+    tmp = config_columns(frame, model_type=model_type, test_dist=dist_type).copy()
+    tmp.columns = [window_name(window) for window in tmp.columns.get_level_values('window')]
+    return tmp
+
+
+def _window_group(frame, window, dist_type):
+    # the configs of one window and distribution, labelled by model
+    tmp = config_columns(frame, window=int(window), test_dist=dist_type).copy()
+    tmp.columns = list(tmp.columns.get_level_values('model_type'))
+    return tmp
+
+
+def plot_sim_realized_timeseries_group(sim_frame, realized_series, model_type, dist_type, suffix='', save_fig=True,
+                                       save_path=None):
+    """
+    :param sim_frame: mean_sim_ann of one config variant, columns labelled by config, see SummaryResults.by_config
+    :param suffix: variant_suffix of the configs, appended to the file name
+    """
+    tmp = _model_group(sim_frame, model_type, dist_type)
     axs = tmp.plot(subplots=True,sharey=True)
     _ = list(map(lambda a: realized_series.plot(ax=a,style='k--',label=realized_series.name), axs))
     _ = list(map(lambda a: a.legend(), axs))
@@ -100,36 +328,31 @@ def plot_sim_realized_timeseries_group(sim_frame, realized_series, model_type, d
     axs[0].figure.set_size_inches(9,7.5)
     plt.tight_layout()
     if save_fig:
-        axs[0].figure.savefig(os.path.join(PLOT_PATH, 'sim_forecast_comp_{!s}_{!s}.png'.format(model_type, dist_type)))
+        axs[0].figure.savefig(os.path.join(plot_path(save_path),
+                                           'sim_forecast_comp_{!s}_{!s}{!s}.png'.format(model_type, dist_type, suffix)))
         plt.close('all')
 
 
-def plot_sim_realized_timeseries_window_group(sim_frame, realized_series, window, dist_type, save_fig=True):
-    subset = list(filter(lambda c: int(c.split('_')[2])==int(window), sim_frame.columns))
-    subset = list(filter(lambda c: c.split('_')[1]==dist_type, subset))
-    tmp = sim_frame[subset].copy()
-    models = list(map(lambda c: c.split('_')[0], subset))
-    window_name = window + ' Days' if int(window) != -1 else 'Full History'
-    tmp.columns = models
+def plot_sim_realized_timeseries_window_group(sim_frame, realized_series, window, dist_type, suffix='', save_fig=True,
+                                              save_path=None):
+    tmp = _window_group(sim_frame, window, dist_type)
+    name = window_name(window)
     axs = tmp.plot(subplots=True,sharey=True)
     _ = list(map(lambda a: realized_series.plot(ax=a,style='k--',label=realized_series.name), axs))
     _ = list(map(lambda a: a.legend(), axs))
     axs[-1].set_xlabel('')
-    title = 'Sim Forecast Comparison | Window: {!s} | Dist: {!s}'.format(window_name, dist_type)
+    title = 'Sim Forecast Comparison | Window: {!s} | Dist: {!s}'.format(name, dist_type)
     axs[0].set_title(title)
     axs[0].figure.set_size_inches(9,7.5)
     plt.tight_layout()
     if save_fig:
-        axs[0].figure.savefig(os.path.join(PLOT_PATH, 'sim_forecast_comp_{!s}_{!s}.png'.format(window_name, dist_type)))
+        axs[0].figure.savefig(os.path.join(plot_path(save_path),
+                                           'sim_forecast_comp_{!s}_{!s}{!s}.png'.format(name, dist_type, suffix)))
         plt.close('all')
 
-def plot_resid_realized_timeseries_group(resid_frame, realized_series, model_type, dist_type, save_fig=True):
-    subset = list(filter(lambda c: c.split('_')[0]==model_type, resid_frame.columns))
-    subset = list(filter(lambda c: c.split('_')[1]==dist_type, subset))
-    tmp = resid_frame[subset].copy()
-    windows = list(map(lambda c: c.split('_')[2], subset))
-    windows_names = list(map(lambda w: w + ' Days' if int(w)!=-1 else 'Full History', windows))
-    tmp.columns = windows_names
+def plot_resid_realized_timeseries_group(resid_frame, realized_series, model_type, dist_type, suffix='', save_fig=True,
+                                         save_path=None):
+    tmp = _model_group(resid_frame, model_type, dist_type)
     axs = tmp.plot(subplots=True,sharey=True)
     _ = list(map(lambda a: realized_series.plot(ax=a,style='k--',secondary_y=True,label=realized_series.name), axs))
     _ = list(map(lambda a: a.legend(), axs))
@@ -139,35 +362,30 @@ def plot_resid_realized_timeseries_group(resid_frame, realized_series, model_typ
     axs[0].figure.set_size_inches(9,7.5)
     plt.tight_layout()
     if save_fig:
-        axs[0].figure.savefig(os.path.join(PLOT_PATH, 'sim_residual_comp_{!s}_{!s}.png'.format(model_type, dist_type)))
+        axs[0].figure.savefig(os.path.join(plot_path(save_path),
+                                           'sim_residual_comp_{!s}_{!s}{!s}.png'.format(model_type, dist_type, suffix)))
         plt.close('all')
 
-def plot_resid_realized_timeseries_window_group(resid_frame, realized_series, window, dist_type, save_fig=True):
-    subset = list(filter(lambda c: int(c.split('_')[2])==int(window), resid_frame.columns))
-    subset = list(filter(lambda c: c.split('_')[1]==dist_type, subset))
-    tmp = resid_frame[subset].copy()
-    models = list(map(lambda c: c.split('_')[0], subset))
-    window_name = window + ' Days' if int(window) != -1 else 'Full History'
-    tmp.columns = models
+def plot_resid_realized_timeseries_window_group(resid_frame, realized_series, window, dist_type, suffix='',
+                                                save_fig=True, save_path=None):
+    tmp = _window_group(resid_frame, window, dist_type)
+    name = window_name(window)
     axs = tmp.plot(subplots=True,sharey=True)
     _ = list(map(lambda a: realized_series.plot(ax=a,style='k--',secondary_y=True,label=realized_series.name), axs))
     _ = list(map(lambda a: a.legend(), axs))
     axs[-1].set_xlabel('')
-    title = 'Sim Resididual Comparison | Window: {!s} | Dist: {!s}'.format(window_name, dist_type)
+    title = 'Sim Resididual Comparison | Window: {!s} | Dist: {!s}'.format(name, dist_type)
     axs[0].set_title(title)
     axs[0].figure.set_size_inches(9,7.5)
     plt.tight_layout()
     if save_fig:
-        axs[0].figure.savefig(os.path.join(PLOT_PATH, 'sim_residual_comp_{!s}_{!s}.png'.format(window_name, dist_type)))
+        axs[0].figure.savefig(os.path.join(plot_path(save_path),
+                                           'sim_residual_comp_{!s}_{!s}{!s}.png'.format(name, dist_type, suffix)))
         plt.close('all')
 
-def plot_resid_rolling_realized_timeseries_group(resid_frame, realized_series, model_type, dist_type, save_fig=True):
-    subset = list(filter(lambda c: c.split('_')[0]==model_type, resid_frame.columns))
-    subset = list(filter(lambda c: c.split('_')[1]==dist_type, subset))
-    tmp = resid_frame[subset].copy()
-    windows = list(map(lambda c: c.split('_')[2], subset))
-    windows_names = list(map(lambda w: w + ' Days' if int(w)!=-1 else 'Full History', windows))
-    tmp.columns = windows_names
+def plot_resid_rolling_realized_timeseries_group(resid_frame, realized_series, model_type, dist_type, suffix='',
+                                                 save_fig=True, save_path=None):
+    tmp = _model_group(resid_frame, model_type, dist_type)
     tmp_rolling = tmp.rolling(12,min_periods=1).apply(lambda rg: np.sum(np.abs(rg)),raw=True)
     f, axs= plt.subplots(2,1,sharex=True)
     tmp_rolling.plot(ax=axs[0])
@@ -179,26 +397,25 @@ def plot_resid_rolling_realized_timeseries_group(resid_frame, realized_series, m
     axs[0].figure.set_size_inches(9,5)
     plt.tight_layout()
     if save_fig:
-        axs[0].figure.savefig(os.path.join(PLOT_PATH, 'sim_rolling_comp_{!s}_{!s}.png'.format(model_type, dist_type)))
+        axs[0].figure.savefig(os.path.join(plot_path(save_path),
+                                           'sim_rolling_comp_{!s}_{!s}{!s}.png'.format(model_type, dist_type, suffix)))
         plt.close('all')
 
-def plot_resid_rolling_realized_timeseries_window_group(resid_frame, realized_series, window, dist_type, save_fig=True):
-    subset = list(filter(lambda c: int(c.split('_')[2])==int(window), resid_frame.columns))
-    subset = list(filter(lambda c: c.split('_')[1]==dist_type, subset))
-    tmp = resid_frame[subset].copy()
-    models = list(map(lambda c: c.split('_')[0], subset))
-    window_name = window + ' Days' if int(window) != -1 else 'Full History'
-    tmp.columns = models
+def plot_resid_rolling_realized_timeseries_window_group(resid_frame, realized_series, window, dist_type, suffix='',
+                                                        save_fig=True, save_path=None):
+    tmp = _window_group(resid_frame, window, dist_type)
+    name = window_name(window)
     tmp_rolling = tmp.rolling(12,min_periods=1).apply(lambda rg: np.sum(np.abs(rg)),raw=True)
     f, axs= plt.subplots(2,1,sharex=True)
     tmp_rolling.plot(ax=axs[0])
     realized_series.plot(ax=axs[1],style='k--',label=realized_series.name)
     axs[1].legend()
     axs[-1].set_xlabel('')
-    title = 'Sim Rolling Cumulative Abs Error Comparison | Window: {!s} | Dist: {!s}'.format(window_name, dist_type)
+    title = 'Sim Rolling Cumulative Abs Error Comparison | Window: {!s} | Dist: {!s}'.format(name, dist_type)
     axs[0].set_title(title)
     axs[0].figure.set_size_inches(9,5)
     plt.tight_layout()
     if save_fig:
-        axs[0].figure.savefig(os.path.join(PLOT_PATH, 'sim_rolling_comp_{!s}_{!s}.png'.format(window_name, dist_type)))
-        plt.close('all')
\ No newline at end of file
+        axs[0].figure.savefig(os.path.join(plot_path(save_path),
+                                           'sim_rolling_comp_{!s}_{!s}{!s}.png'.format(name, dist_type, suffix)))
+        plt.close('all')
@@ -0,0 +1,272 @@
+import os
+import sqlite3
+import numpy as np
+import pandas as pd
+from . import settings
+from .result_store import RVMResultStore, PARAM_COLUMNS, DATE_COLUMNS
+from .simulation import TRIM_LO, TRIM_HI
+
+
+SAMPLE_STORE_NAME = 'samples'
+INDEX_NAME = 'index.sqlite'
+# rows of one chunk file, 20MB for 5000-path samples
+CHUNK_ROWS = 1024
+# rows read into memory at once by evaluate
+BATCH_ROWS = 4096
+# seconds a write waits on another process's transaction
+BUSY_TIMEOUT = 60.
+SLOT_COLUMNS = ['width', 'chunk', 'row', 'n_samples']
+
+
+class SampleBatch(object):
+    """
+    Stored samples of a batch of fits, the rows a statistic is computed over in one vectorized pass
+    values: array (n_rows, width) of float32, each row sorted ascending and NaN past its n_samples
+    n_samples: array (n_rows) of int
+    realized: array (n_rows) of realized vols, NaN where not joined, see SampleStore.join_realized
+    """
+    def __init__(self, values, n_samples, realized):
+        self.values = values
+        self.n_samples = n_samples
+        self.realized = realized
+
+    def _at(self, positions):
+        return np.take_along_axis(self.values, positions[:, None], axis=1)[:, 0].astype(float)
+
+    def _quantile(self, prob, lo, hi):
+        # R quantile type 7 over the sorted positions lo to hi of each row
+        position = prob * (hi - lo)
+        below = np.floor(position).astype(int)
+        above = np.minimum(below + 1, hi - lo)
+        x_below = self._at(lo + below)
+        return x_below + (position - below) * (self._at(lo + above) - x_below)
+
+    def _trim(self, trim_lo, trim_hi):
+        # 0-based inclusive bounds of the positions rGARCH keeps, see simulation.trim_indices
+        lo = np.maximum((self.n_samples * trim_lo).astype(int) - 1, 0)
+        hi = (self.n_samples * trim_hi).astype(int) - 1
+        return lo, hi
+
+    def quantile(self, prob):
+        """
+        Quantile of each untrimmed sample, R quantile type 7
+        :return: array (n_rows)
+        """
+        return self._quantile(prob, np.zeros(len(self.n_samples), dtype=int), self.n_samples - 1)
+
+    def trimmed_quantile(self, prob, trim_lo=TRIM_LO, trim_hi=TRIM_HI):
+        """
+        Quantile of each sample between the sorted positions rGARCH cuts at, R quantile type 7; the default
+        trim reproduces the quantile*_pct fields to float32 precision
+        :return: array (n_rows)
+        """
+        return self._quantile(prob, *self._trim(trim_lo, trim_hi))
+
+    def trimmed_mean(self, trim_lo=TRIM_LO, trim_hi=TRIM_HI):
+        """
+        Mean of each sample between the sorted positions rGARCH cuts at, see simulation.trim_indices; the
+        default trim reproduces mean_sim_ann to float32 precision
+        :return: array (n_rows)
+        """
+        lo, hi = self._trim(trim_lo, trim_hi)
+        totals = np.hstack([np.zeros((len(self.values), 1)), np.cumsum(np.nan_to_num(self.values, nan=0.),
+                                                                      axis=1, dtype=float)])
+        return (self._totals(totals, hi + 1) - self._totals(totals, lo)) / (hi - lo + 1)
+
+    @classmethod
+    def _totals(cls, totals, positions):
+        return np.take_along_axis(totals, positions[:, None], axis=1)[:, 0]
+
+    def crps(self):
+        """
+        Continuous ranked probability score of each sample against its realized vol, from the sorted
+        sample in one pass: mean |x - y| less sum over i of (2i - n - 1) x_(i) / n^2
+        :return: array (n_rows), NaN without a realized vol
+        """
+        values = self.values.astype(float)
+        n_samples = self.n_samples[:, None].astype(float)
+        spread = np.nansum(np.abs(values - self.realized[:, None]), axis=1) / n_samples[:, 0]
+        weights = 2. * np.arange(1, values.shape[1] + 1) - n_samples - 1.
+        return spread - np.nansum(weights * values, axis=1) / n_samples[:, 0] ** 2
+
+
+def quantile_statistic(prob):
+    return lambda batch: batch.quantile(prob)
+
+
+def trimmed_quantile_statistic(prob, trim_lo=TRIM_LO, trim_hi=TRIM_HI):
+    return lambda batch: batch.trimmed_quantile(prob, trim_lo, trim_hi)
+
+
+def trimmed_mean_statistic(trim_lo=TRIM_LO, trim_hi=TRIM_HI):
+    return lambda batch: batch.trimmed_mean(trim_lo, trim_hi)
+
+
+def exceedance_statistic(prob):
+    """
+    1 where the realized vol is above the prob quantile of its sample, a VaR breach at level prob, else 0;
+    averaged over dates it is the breach rate to compare with 1 - prob
+    """
+    def exceedance(batch):
+        breached = (batch.realized > batch.quantile(prob)).astype(float)
+        breached[np.isnan(batch.realized)] = np.nan
+        return breached
+    return exceedance
+
+
+def crps_statistic():
+    return lambda batch: batch.crps()
+
+
+class SampleStore(object):
+    """
+    Simulated forecast distributions of fits, the annualized vol of every path, so statistics the result store
+    does not hold are computed from the samples rather than by fitting and simulating again
+    Each sample is one float32 row, sorted ascending, in memory-mapped chunk files of CHUNK_ROWS rows; rows are
+    n_sims wide and a shorter adaptive sample is padded with NaN. An SQLite index maps the result store key of
+    each fit to its row. Several processes may append at once
+    path: directory, created on first use, SAMPLE_STORE_NAME under TMP_PATH when None
+    """
+    def __init__(self, path=None):
+        self.path = self.default_path() if path is None else path
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        self.conn = sqlite3.connect(os.path.join(self.path, INDEX_NAME), timeout=BUSY_TIMEOUT,
+                                    isolation_level=None)
+        key_columns = ['"{!s}" {!s}'.format(name, sql_type) for name, sql_type, _ in PARAM_COLUMNS] + \
+            ['{!s} TEXT'.format(name) for name in DATE_COLUMNS]
+        self.conn.execute('CREATE TABLE IF NOT EXISTS samples ({!s}, {!s})'.format(
+            ', '.join(key_columns), ', '.join('{!s} INTEGER'.format(name) for name in SLOT_COLUMNS)))
+        self.conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS samples_key ON samples ({!s})'.format(
+            ', '.join(['"{!s}"'.format(c) for c in self.key_columns])))
+        self.conn.execute('CREATE TABLE IF NOT EXISTS chunks (width INTEGER, chunk INTEGER, n_rows INTEGER, '
+                          'PRIMARY KEY (width, chunk))')
+        self.chunks = {}
+
+    @classmethod
+    def default_path(cls):
+        return os.path.join(settings.get('TMP_PATH'), SAMPLE_STORE_NAME)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def close(self):
+        self.chunks = {}
+        self.conn.close()
+
+    @property
+    def key_columns(self):
+        return [c[0] for c in PARAM_COLUMNS] + DATE_COLUMNS
+
+    def _chunk(self, width, chunk):
+        array = self.chunks.get((width, chunk))
+        if array is None:
+            file_name = os.path.join(self.path, 'samples_{!s}_{!s}.f32'.format(width, chunk))
+            mode = 'r+' if os.path.exists(file_name) else 'w+'
+            array = np.memmap(file_name, dtype=np.float32, mode=mode, shape=(CHUNK_ROWS, width))
+            self.chunks[(width, chunk)] = array
+        return array
+
+    def _allocate(self, width):
+        row = self.conn.execute('SELECT chunk, n_rows FROM chunks WHERE width = ? ORDER BY chunk DESC LIMIT 1',
+                                (width,)).fetchone()
+        if row is None or row[1] >= CHUNK_ROWS:
+            chunk = 0 if row is None else row[0] + 1
+            self.conn.execute('INSERT INTO chunks (width, chunk, n_rows) VALUES (?, ?, 1)', (width, chunk))
+            return chunk, 0
+        self.conn.execute('UPDATE chunks SET n_rows = n_rows + 1 WHERE width = ? AND chunk = ?', (width, row[0]))
+        return row[0], row[1]
+
+    def append(self, samples):
+        """
+        Write the samples of a batch of fits in one transaction, a fit already held keeping its row
+        :param samples: list of (RVolModelSingleResult, array of its sample sorted ascending)
+        :return: None
+        """
+        if len(samples) == 0:
+            return
+        where = ' AND '.join('"{!s}" = ?'.format(name) for name in self.key_columns)
+        columns = self.key_columns + SLOT_COLUMNS
+        touched = set()
+        # BEGIN IMMEDIATE serializes row allocation between processes appending to the same store
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            for result, sample in samples:
+                key = RVMResultStore.result_key(result)
+                width = int(result.params.n_sims)
+                slot = self.conn.execute('SELECT width, chunk, row FROM samples WHERE {!s}'.format(where),
+                                         key).fetchone()
+                if slot is None:
+                    slot = (width,) + self._allocate(width)
+                array = self._chunk(slot[0], slot[1])
+                array[slot[2], :len(sample)] = sample
+                array[slot[2], len(sample):] = np.nan
+                touched.add(slot[:2])
+                self.conn.execute('INSERT OR REPLACE INTO samples ({!s}) VALUES ({!s})'.format(
+                    ', '.join(['"{!s}"'.format(c) for c in columns]), ', '.join(['?'] * len(columns))),
+                    key + slot + (len(sample),))
+            for width, chunk in touched:
+                self._chunk(width, chunk).flush()
+        except Exception:
+            self.conn.execute('ROLLBACK')
+            raise
+        self.conn.execute('COMMIT')
+
+    def index(self):
+        """
+        Every held sample
+        :return: DataFrame with the result store key columns and width, chunk, row and n_samples
+        """
+        return pd.read_sql_query('SELECT * FROM samples', self.conn)
+
+    @classmethod
+    def join_realized(cls, index, result_store):
+        """
+        Add the realized vol target of each sample's fit from the result store, for statistics scoring the
+        samples against it
+        :param index: DataFrame from index()
+        :return: DataFrame, index with a vol_realized_ann column, NaN for fits the result store does not hold
+        """
+        if result_store.cached is None:
+            result_store.cached = result_store.preload()
+        realized = []
+        for key in index[[name for name, _, _ in PARAM_COLUMNS] + DATE_COLUMNS].itertuples(index=False):
+            result = result_store.cached.get(tuple(key))
+            vol = None if result is None else result.vol_realized_ann
+            realized.append(np.nan if vol is None else vol)
+        index = index.copy()
+        index['vol_realized_ann'] = realized
+        return index
+
+    def evaluate(self, statistics, index=None, batch_rows=BATCH_ROWS):
+        """
+        Compute statistics over many stored samples, chunk by chunk in vectorized batches of rows
+        :param statistics: dict<name: function(SampleBatch) -> array (n_rows)>, see quantile_statistic,
+            trimmed_quantile_statistic, trimmed_mean_statistic, exceedance_statistic and crps_statistic
+        :param index: rows of index() to evaluate, every held sample when None; a vol_realized_ann column, see
+            join_realized, sets SampleBatch.realized
+        :param batch_rows: rows read into memory at once
+        :return: DataFrame, the index rows renumbered from 0, with one column per statistic
+        """
+        index = (self.index() if index is None else index).reset_index(drop=True)
+        values = dict((name, np.full(len(index), np.nan)) for name in statistics)
+        realized = index.vol_realized_ann.values.astype(float) if 'vol_realized_ann' in index \
+            else np.full(len(index), np.nan)
+        for (width, chunk), group in index.groupby(['width', 'chunk']):
+            group_positions = group.index.values
+            order = np.argsort(group.row.values, kind='stable')
+            array = self._chunk(int(width), int(chunk))
+            for batch_start in range(0, len(order), batch_rows):
+                batch = order[batch_start:batch_start + batch_rows]
+                rows = group.row.values[batch]
+                sample_batch = SampleBatch(np.asarray(array[rows]), group.n_samples.values[batch].astype(int),
+                                           realized[group_positions[batch]])
+                for name, statistic in statistics.items():
+                    values[name][group_positions[batch]] = statistic(sample_batch)
+        frame = index.copy()
+        for name in statistics:
+            frame[name] = values[name]
+        return frame
@@ -0,0 +1,56 @@
+import importlib
+import os
+
+
+# settings read from config.py, each overridable by an environment variable of the same name with this prefix
+SETTING_NAMES = ['R_PATH', 'TMP_PATH', 'PLOT_PATH', 'GARCH_BACKEND', 'R_TRANSPORT']
+ENV_PREFIX = 'VOL_TUNING_'
+
+_overrides = {}
+
+
+def configure(**overrides):
+    """
+    Set settings for this process, ahead of the environment and config.py, e.g. from command line options
+    :param overrides: setting name: value, None values are ignored
+    :return: None
+    """
+    for name, value in overrides.items():
+        if name not in SETTING_NAMES:
+            raise ValueError('Unknown setting {!s}'.format(name))
+        if value is not None:
+            _overrides[name] = value
+
+
+def _config_value(name):
+    try:
+        config = importlib.import_module('config')
+    except ImportError:
+        return ''
+    return getattr(config, name, '')
+
+
+def get(name):
+    """
+    Resolve a setting when it is first needed: configure overrides, then the VOL_TUNING_<name> environment
+    variable, then config.py. PLOT_PATH falls back to TMP_PATH, GARCH_BACKEND to 'r' and R_TRANSPORT to 'pyper'
+    :param name: one of SETTING_NAMES
+    :return: str
+    """
+    if name not in SETTING_NAMES:
+        raise ValueError('Unknown setting {!s}'.format(name))
+    value = _overrides.get(name)
+    if value is None:
+        value = os.environ.get(ENV_PREFIX + name)
+    if value is None:
+        value = _config_value(name)
+    if value == '' and name == 'PLOT_PATH':
+        return get('TMP_PATH')
+    if value == '' and name == 'GARCH_BACKEND':
+        return 'r'
+    if value == '' and name == 'R_TRANSPORT':
+        return 'pyper'
+    if value == '':
+        raise Exception('{!s} must be set, in config.py, as {!s}{!s} or on the command line'.format(
+            name, ENV_PREFIX, name))
+    return value
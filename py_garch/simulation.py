@@ -0,0 +1,251 @@
+import numpy as np
+
+
+ANNUALIZATION_DAYS = 252
+TRIM_LO = .025
+TRIM_HI = .975
+QUANTILE_PROBS = [0., .25, .5, .75, 1.]
+# cap on the arrays held at once by simulate_forecasts, fits are chunked to stay under it
+SIM_MAX_BYTES = 256 * 1024 ** 2
+# how a fit's forecast distribution is summarized: a fixed n_sims paths, batches of paths until the standard
+# error of mean_sim_ann is within ADAPTIVE_TOLERANCE (n_sims is then the cap), or the closed-form expected
+# variance where the model has one
+SIMULATE = 'simulate'
+ADAPTIVE = 'adaptive'
+ANALYTIC = 'analytic'
+FORECAST_MODES = [SIMULATE, ADAPTIVE, ANALYTIC]
+ADAPTIVE_BATCH = 500
+ADAPTIVE_TOLERANCE = .002
+
+
+class SimulationSummary(object):
+    """
+    Forecast distribution statistics for a batch of fits, row i belongs to fits[i]
+
+    Attributes:
+        mean_sim_ann: (array n_fits) trimmed mean of the annualized simulated vol
+        quantiles: (array n_fits x 5) quantiles 0, 25, 50, 75, 100 of the trimmed annualized vol, NaN for
+            analytic forecasts
+        peak_bytes: (int) largest footprint of the simulation arrays held at once
+        n_simulations: (array n_fits) paths drawn per fit, 0 for analytic forecasts
+        std_error: (array n_fits) standard error of mean_sim_ann, 0 for analytic forecasts
+        samples: list, per fit the annualized vol of every path as float32 sorted ascending, None for analytic
+            forecasts; None when the samples were not kept
+    """
+    def __init__(self, mean_sim_ann, quantiles, peak_bytes, n_simulations, std_error, samples=None):
+        self.mean_sim_ann = mean_sim_ann
+        self.quantiles = quantiles
+        self.peak_bytes = peak_bytes
+        self.n_simulations = n_simulations
+        self.std_error = std_error
+        self.samples = samples
+
+
+def trim_indices(n_simulations):
+    """
+    0-based inclusive bounds of the sorted positions rGARCH keeps, sims.sorted[cut.lo:cut.hi] in R
+    :return: lo, hi
+    """
+    cut_lo = int(n_simulations * TRIM_LO)
+    cut_hi = int(n_simulations * TRIM_HI)
+    return max(cut_lo - 1, 0), cut_hi - 1
+
+
+def trimmed_summary(path_vol, n_forecast, is_sorted=False):
+    """
+    Trimmed mean and quantiles of the annualized per-path vol, using partial partitioning instead of a sort
+    Matches R quantile type 7 over the trimmed, sorted sample
+    :param path_vol: array (n_fits x n_simulations) of sqrt(sum of squared simulated returns)
+    :param n_forecast: number of simulated days
+    :param is_sorted: rows of path_vol are already sorted ascending, they are read without partitioning
+    :return: mean_sim_ann (array n_fits), quantiles (array n_fits x 5), std_error (array n_fits) of the
+        trimmed mean
+    """
+    lo, hi = trim_indices(path_vol.shape[1])
+    n_kept = hi - lo + 1
+    h = (n_kept - 1) * np.asarray(QUANTILE_PROBS)
+    below = np.floor(h).astype(int)
+    above = np.minimum(below + 1, n_kept - 1)
+    kth = np.unique(np.concatenate([[lo, hi], lo + below, lo + above]))
+    parted = path_vol if is_sorted else np.partition(path_vol, kth, axis=1)
+    ann = np.sqrt(ANNUALIZATION_DAYS / (n_forecast - 1.))
+    kept = parted[:, lo:hi + 1]
+    mean_sim_ann = ann * np.mean(kept, axis=1)
+    std_error = ann * np.std(kept, axis=1, ddof=1) / np.sqrt(n_kept)
+    x_below = parted[:, lo + below]
+    x_above = parted[:, lo + above]
+    quantiles = ann * (x_below + (h - below) * (x_above - x_below))
+    return mean_sim_ann, quantiles, std_error
+
+
+def annualized_samples(path_vol, n_forecast):
+    """
+    Untrimmed annualized vol of every path, the sample trimmed_summary reduces, kept for later statistics
+    :param path_vol: array (n_fits x n_simulations) of sqrt(sum of squared simulated returns)
+    :return: array (n_fits x n_simulations) of float32, each row sorted ascending
+    """
+    return (np.sqrt(ANNUALIZATION_DAYS / (n_forecast - 1.)) * np.sort(path_vol, axis=1)).astype(np.float32)
+
+
+def _simulate_group(fits, n_forecast, n_simulations, rngs):
+    """
+    Sum of squared simulated returns per path for fits sharing a model and distribution
+    :return: path_vol (array n_fits x n_simulations), bytes held
+    """
+    n_fits = len(fits)
+    model = fits[0].model
+    dist = fits[0].dist
+    # parameters as (n_params, n_fits, 1) so they broadcast over (n_fits, n_simulations)
+    var_params = np.stack([f.var_params for f in fits], axis=1)[:, :, None]
+    shape = np.stack([f.shape for f in fits], axis=1)[:, :, None]
+    mu = np.array([f.mu for f in fits])[:, None]
+    abs_moment = dist.abs_moment(shape)
+    if isinstance(rngs, list):
+        # one generator per fit, so a fit's paths do not depend on what it is batched with
+        z = np.stack([dist.draw(rng, (n_simulations, n_forecast), shape[:, i, :, None])
+                      for i, rng in enumerate(rngs)])
+    else:
+        z = dist.draw(rngs, (n_fits, n_simulations, n_forecast), shape[:, :, :, None])
+    state = tuple(np.repeat(np.concatenate([f.next_state[i] for f in fits])[:, None], n_simulations, axis=1)
+                  for i in range(len(fits[0].next_state)))
+    sum_sq = np.zeros((n_fits, n_simulations))
+    for t in range(n_forecast):
+        resid = np.sqrt(state[0]) * z[:, :, t]
+        sum_sq += (mu + resid) ** 2
+        state = model.step(var_params, state, resid, abs_moment)
+    n_bytes = z.nbytes + sum_sq.nbytes + resid.nbytes + sum([s.nbytes for s in state])
+    return np.sqrt(sum_sq), n_bytes
+
+
+def simulate_forecasts(fits, n_forecast, n_simulations, rng, max_bytes=SIM_MAX_BYTES, keep_samples=False):
+    """
+    Simulate n_simulations paths of n_forecast days for every fit in batched array passes,
+    starting from the end of each fitted sample (rugarch startMethod="sample")
+    Fits may mix model types, distributions, configs and dates
+    :param fits: list of garch_engine.GarchFit
+    :param n_forecast: number of days simulated
+    :param n_simulations: number of paths per fit
+    :param rng: numpy Generator, or a list of Generators aligned with fits
+    :param max_bytes: bound on the simulation arrays held at once, kept samples aside
+    :param keep_samples: return every path's annualized vol in SimulationSummary.samples
+    :return: SimulationSummary
+    """
+    n_fits = len(fits)
+    mean_sim_ann = np.empty(n_fits)
+    quantiles = np.empty((n_fits, len(QUANTILE_PROBS)))
+    std_error = np.empty(n_fits)
+    samples = [None] * n_fits if keep_samples else None
+    peak_bytes = 0
+    per_fit_bytes = n_simulations * (n_forecast + 5) * 8
+    chunk_size = max(1, int(max_bytes // per_fit_bytes))
+    groups = {}
+    for i, fit in enumerate(fits):
+        groups.setdefault((fit.model.model_type, fit.dist.name), []).append(i)
+    for indices in groups.values():
+        for chunk_start in range(0, len(indices), chunk_size):
+            chunk = indices[chunk_start:chunk_start + chunk_size]
+            chunk_rng = [rng[i] for i in chunk] if isinstance(rng, list) else rng
+            path_vol, n_bytes = _simulate_group([fits[i] for i in chunk], n_forecast, n_simulations, chunk_rng)
+            peak_bytes = max(peak_bytes, n_bytes)
+            mean_sim_ann[chunk], quantiles[chunk], std_error[chunk] = trimmed_summary(path_vol, n_forecast)
+            if keep_samples:
+                for i, sample in zip(chunk, annualized_samples(path_vol, n_forecast)):
+                    samples[i] = sample
+    return SimulationSummary(mean_sim_ann, quantiles, peak_bytes, np.full(n_fits, n_simulations), std_error,
+                             samples)
+
+
+def merge_sorted(sorted_vol, path_vol):
+    """
+    Merge a batch of path vols into a sample already sorted ascending, sorting only the batch
+    :param sorted_vol: array sorted ascending
+    :param path_vol: array of new path vols
+    :return: array of both, sorted ascending
+    """
+    batch = np.sort(path_vol)
+    return np.insert(sorted_vol, np.searchsorted(sorted_vol, batch), batch)
+
+
+def _groups(fits, indices):
+    groups = {}
+    for i in indices:
+        groups.setdefault((fits[i].model.model_type, fits[i].dist.name), []).append(i)
+    return groups.values()
+
+
+def simulate_adaptive(fits, n_forecast, max_simulations, rng, tolerance=ADAPTIVE_TOLERANCE,
+                      batch_size=ADAPTIVE_BATCH, keep_samples=False):
+    """
+    Simulate batches of batch_size paths per fit until the standard error of its mean_sim_ann is within
+    tolerance or max_simulations paths are drawn; each fit stops on its own
+    :param max_simulations: cap on the paths per fit
+    :param rng: numpy Generator, or a list of Generators aligned with fits
+    :param keep_samples: return every path's annualized vol in SimulationSummary.samples
+    :return: SimulationSummary
+    """
+    n_fits = len(fits)
+    mean_sim_ann = np.empty(n_fits)
+    quantiles = np.empty((n_fits, len(QUANTILE_PROBS)))
+    std_error = np.empty(n_fits)
+    n_simulations = np.zeros(n_fits, dtype=int)
+    # every path drawn so far per fit, kept sorted so a round only sorts its own batch
+    paths = [np.empty(0) for _ in fits]
+    peak_bytes = 0
+    active = list(range(n_fits))
+    while len(active) > 0:
+        # active fits have all drawn the same number of paths so far
+        n_batch = min(batch_size, max_simulations - n_simulations[active[0]])
+        for indices in _groups(fits, active):
+            group_rng = [rng[i] for i in indices] if isinstance(rng, list) else rng
+            path_vol, n_bytes = _simulate_group([fits[i] for i in indices], n_forecast, n_batch, group_rng)
+            peak_bytes = max(peak_bytes, n_bytes)
+            for row, i in enumerate(indices):
+                paths[i] = merge_sorted(paths[i], path_vol[row])
+        n_simulations[active] += n_batch
+        summary = trimmed_summary(np.stack([paths[i] for i in active]), n_forecast, is_sorted=True)
+        mean_sim_ann[active], quantiles[active], std_error[active] = summary
+        active = [i for i in active if std_error[i] > tolerance and n_simulations[i] < max_simulations]
+    samples = None
+    if keep_samples:
+        samples = [annualized_samples(paths[i][None], n_forecast)[0] for i in range(n_fits)]
+    return SimulationSummary(mean_sim_ann, quantiles, peak_bytes, n_simulations, std_error, samples)
+
+
+def analytic_forecasts(fits, n_forecast):
+    """
+    Closed-form counterpart of simulate_forecasts for models with an expected variance recursion: the
+    annualized root of the expected sum of squared returns, with no paths drawn. This is the vol of the
+    expected variance rather than a trimmed mean of path vols, so it sits above the simulated value, further
+    the fatter the tails of the innovations
+    Quantiles are not available and left NaN
+    :param fits: list of garch_engine.GarchFit whose model has_expected_variance
+    :return: SimulationSummary
+    """
+    n_fits = len(fits)
+    ann = ANNUALIZATION_DAYS / (n_forecast - 1.)
+    mean_sim_ann = np.array([
+        np.sqrt(ann * np.sum(fit.mu ** 2 + fit.model.expected_variance(fit.var_params, fit.next_state, n_forecast)))
+        for fit in fits])
+    return SimulationSummary(mean_sim_ann, np.full((n_fits, len(QUANTILE_PROBS)), np.nan), 0,
+                             np.zeros(n_fits, dtype=int), np.zeros(n_fits))
+
+
+def forecast_summary(fits, n_forecast, n_simulations, rng, forecast_mode=SIMULATE, keep_samples=False):
+    """
+    Forecast distribution statistics of fits in one of FORECAST_MODES
+    :param rng: numpy Generator, or a list of Generators aligned with fits
+    :param keep_samples: also return the simulated samples, see SimulationSummary.samples
+    :return: SimulationSummary aligned with fits
+    """
+    if forecast_mode == SIMULATE:
+        return simulate_forecasts(fits, n_forecast, n_simulations, rng, keep_samples=keep_samples)
+    if forecast_mode == ADAPTIVE:
+        return simulate_adaptive(fits, n_forecast, n_simulations, rng, keep_samples=keep_samples)
+    if forecast_mode != ANALYTIC:
+        raise ValueError('Unknown forecast mode {!s}'.format(forecast_mode))
+    # a simulated fit stored as analytic would mix two estimators in one config's results
+    for fit in fits:
+        if not fit.model.has_expected_variance:
+            raise ValueError('{!s} has no closed-form forecast, it cannot run in analytic mode'.format(
+                fit.model.model_type))
+    return analytic_forecasts(fits, n_forecast)
@@ -1,8 +1,16 @@
+import numpy as np
 import pandas as pd
-from config import TMP_PATH
+from . import settings
+from .simulation import SIMULATE
 import os
 
 
+# float fields of a result held by ResultArrays: the values of RVolModelSingleResult.to_series, in its order,
+# then the number of returns behind the realized target
+VALUE_FIELDS = ['quantile0_pct', 'quantile25_pct', 'quantile50_pct', 'quantile75_pct', 'quantile100_pct',
+                'mean_sim_ann', 'vol_realized_ann', 'forecast_error', 'n_realized']
+
+
 class AllDatesVolModelRunParams(object):
     """
     Parameters for running a set of simulations across dates
@@ -11,13 +19,21 @@ class AllDatesVolModelRunParams(object):
     n_forecast: a positive integer
     n_sims: a positive integer
     window: a positive integer or -1 for full history
+    refit_every: a positive integer, re-estimate every refit_every dates and only filter the last fit forward
+        in between, as ugarchroll refit.every
+    forecast_mode: one of simulation.FORECAST_MODES; n_sims is the cap on paths when adaptive
+    asset: identifier of the price history in a multi-asset panel, '' for the single data file
     """
-    def __init__(self, model_type, test_dist, n_forecast, n_sims, window):
+    def __init__(self, model_type, test_dist, n_forecast, n_sims, window, refit_every=1, forecast_mode=SIMULATE,
+                 asset=''):
         self.model_type = model_type
         self.n_forecast = n_forecast
         self.test_dist = test_dist
         self.n_sims = n_sims
         self.window = window
+        self.refit_every = refit_every
+        self.forecast_mode = forecast_mode
+        self.asset = asset
 
     @classmethod
     def from_series(cls, series):
@@ -30,23 +46,19 @@ class AllDatesVolModelRunParams(object):
         prefix = series.pop('prefix')
         model_type, test_dist, n_sims, n_forecast, _, _ = prefix.split('_')
         window = series.pop('window')
-        return cls(model_type, test_dist, int(n_forecast), int(n_sims), int(window))
+        asset = series.pop('asset') if 'asset' in series.index else ''
+        return cls(model_type, test_dist, int(n_forecast), int(n_sims), int(window), asset=asset)
 
-    def get_start_end_dates(self, start_point, test_data_set, full_data_set):
+    @classmethod
+    def from_key_values(cls, values):
         """
-        Returns the start and end dates for an input dataset to go into the R script method
-        :param start_point: non-negative integer
-        :param test_data_set: truncated dataset of price history
-        :param full_data_set: full dataset of price history
-        :return: input_start_date (Timestamp), input_end_date (Timestamp)
+        Instance an new object from the parameter columns of RVMResultStore
+        :param values: dict<column name: value>
+        :return: new AllDatesVolModelRunParams object
         """
-        input_end_date = test_data_set.iloc[start_point].Date
-        data_set_preceding = full_data_set.set_index('Date').loc[:input_end_date]
-        if self.window > 0:
-            input_start_date = data_set_preceding.tail(self.window).index[0]
-        else:
-            input_start_date = data_set_preceding.index[0]
-        return input_start_date, input_end_date
+        return cls(values['model_type'], values['test_dist'], int(values['n_forecast']), int(values['n_sims']),
+                   int(values['window']), int(values.get('refit_every', 1)),
+                   values.get('forecast_mode', SIMULATE), values.get('asset') or '')
 
     def __eq__(self, other):
         if self.__class__.__name__ != other.__class__.__name__:
@@ -55,7 +67,10 @@ class AllDatesVolModelRunParams(object):
             self.n_forecast == other.n_forecast and \
             self.test_dist == other.test_dist and \
             self.n_sims == other.n_sims and \
-            self.window == other.window
+            self.window == other.window and \
+            self.refit_every == other.refit_every and \
+            self.forecast_mode == other.forecast_mode and \
+            self.asset == other.asset
         if not is_equal:
             return False
         return True
@@ -66,6 +81,9 @@ class AllDatesVolModelRunParams(object):
         h0 += hash(self.test_dist)
         h0 += hash(self.n_sims)
         h0 += hash(self.window)
+        h0 += hash(self.refit_every)
+        h0 += hash(self.forecast_mode)
+        h0 += hash(self.asset)
         return h0
 
 
@@ -85,7 +103,22 @@ class RVolModelSingleResult(object):
         mean_sim_ann: (float) mean simulated value
         vol_realized_ann: (float) relaized n_forecast period vol
         forecast_error: (float) realized less mean_sim_ann
+        coefficients: (str) fitted coefficients, 'name=value;...', see garch_engine.format_coefficients
+        solver_iterations: (int) optimizer iterations spent on the fit
+        fit_seconds: (float) wall time of the fit
+        warm_start: (int) 1 when the fit converged from the previous window's coefficients
+        converged: (int) 1 when the solver reported convergence, filtered results included
+        n_realized: (int) future returns behind vol_realized_ann, below n_forecast while the price history
+            is too short; None when not recorded
+        n_sims_used: (int) simulated paths behind the forecast statistics, 0 for analytic forecasts
+        sim_std_error: (float) standard error of mean_sim_ann from the simulation, 0 for analytic forecasts
+        failure: (str) why the task produced no result after its retries, e.g. a fit timeout; None for a
+            result that was fitted
     """
+    __slots__ = ['data_start_date', 'data_end_date', 'params'] + VALUE_FIELDS + \
+        ['coefficients', 'solver_iterations', 'fit_seconds', 'warm_start', 'converged', 'n_sims_used',
+         'sim_std_error', 'failure']
+
     def __init__(self, data_start_date, data_end_date, params):
         self.data_start_date = data_start_date
         self.data_end_date = data_end_date
@@ -98,6 +131,15 @@ class RVolModelSingleResult(object):
         self.mean_sim_ann = None
         self.vol_realized_ann = None
         self.forecast_error = None
+        self.coefficients = None
+        self.solver_iterations = None
+        self.fit_seconds = None
+        self.warm_start = None
+        self.converged = None
+        self.n_realized = None
+        self.n_sims_used = None
+        self.sim_std_error = None
+        self.failure = None
 
     @classmethod
     def from_series(cls, series):
@@ -111,7 +153,7 @@ class RVolModelSingleResult(object):
         data_start_date = pd.Timestamp(series.pop('data_start_date'))
         data_end_date = pd.Timestamp(series.pop('data_end_date'))
         result = cls(data_start_date, data_end_date, params)
-        for attr_name, attr_value in series.iteritems():
+        for attr_name, attr_value in series.items():
             try:
                 setattr(result, attr_name, float(attr_value))
             except ValueError:
@@ -126,6 +168,8 @@ class RVolModelSingleResult(object):
         series = self.to_series()
         series['prefix'] = self.prefix
         series['window'] = self.params.window
+        if self.params.asset:
+            series['asset'] = self.params.asset
         return series
 
     def to_series(self):
@@ -155,7 +199,7 @@ class RVolModelSingleResult(object):
         File string prefix method
         :return: str
         """
-        return '{!s}_{!s}_{!s}_{!s}_{!s}_{!s}'.format(
+        prefix = '{!s}_{!s}_{!s}_{!s}_{!s}_{!s}'.format(
             self.params.model_type,
             self.params.test_dist,
             self.params.n_sims,
@@ -163,10 +207,16 @@ class RVolModelSingleResult(object):
             self.data_start_date.strftime('%Y%m%d'),
             self.data_end_date.strftime('%Y%m%d')
         )
+        if self.params.refit_every != 1:
+            prefix = '{!s}_refit{!s}'.format(prefix, self.params.refit_every)
+        if self.params.forecast_mode != SIMULATE:
+            prefix = '{!s}_{!s}'.format(prefix, self.params.forecast_mode)
+        return prefix
 
     def set_from(self, result_dict):
         """
-        Set float value attributes using R script return dictionary
+        Set the forecast statistics and fit diagnostics from a backend result dict; the realized target is
+        set separately by set_realized
         :return: None
         """
         prefix_result = self.prefix
@@ -176,8 +226,46 @@ class RVolModelSingleResult(object):
         self.quantile75_pct = result_dict["{!s}_quantile75".format(prefix_result)]
         self.quantile100_pct = result_dict["{!s}_quantile100".format(prefix_result)]
         self.mean_sim_ann = result_dict["{!s}_mean.sim.ann".format(prefix_result)]
-        self.vol_realized_ann = result_dict["{!s}_vol.realized.ann".format(prefix_result)]
-        self.forecast_error = result_dict["{!s}_forecast.error".format(prefix_result)]
+        self.coefficients = result_dict.get("{!s}_coefficients".format(prefix_result))
+        self.solver_iterations = result_dict.get("{!s}_solver.iterations".format(prefix_result))
+        self.fit_seconds = result_dict.get("{!s}_fit.seconds".format(prefix_result))
+        self.warm_start = result_dict.get("{!s}_warm.start".format(prefix_result))
+        self.converged = result_dict.get("{!s}_converged".format(prefix_result))
+        self.n_sims_used = result_dict.get("{!s}_n.sims.used".format(prefix_result))
+        self.sim_std_error = result_dict.get("{!s}_sim.std.error".format(prefix_result))
+
+    def set_realized(self, vol_realized_ann, n_realized):
+        """
+        Replace the realized vol target and the forecast error against it
+        :return: None
+        """
+        self.vol_realized_ann = float(vol_realized_ann)
+        self.n_realized = int(n_realized)
+        self.forecast_error = self.vol_realized_ann - self.mean_sim_ann
+
+    def set_failed(self, failure):
+        """
+        Record the task as failed, with no forecast statistics
+        :param failure: str, reason the task failed
+        :return: None
+        """
+        self.failure = failure
+
+    @property
+    def is_failed(self):
+        """
+        Whether the task failed rather than produced a result, see set_failed
+        :return: bool
+        """
+        return self.failure is not None
+
+    @property
+    def is_complete(self):
+        """
+        Whether vol_realized_ann covers the full n_forecast period
+        :return: bool
+        """
+        return self.n_realized is None or self.n_realized >= self.params.n_forecast
 
     def __eq__(self, other):
         if self.__class__.__name__ != other.__class__.__name__:
@@ -194,18 +282,169 @@ class RVolModelSingleResult(object):
         return h0
 
 
+class ResultArrays(object):
+    """
+    Columnar values of every RVolModelMultiDateResult holder sharing it: one float array per VALUE_FIELDS
+    entry, a row per config and a column per end date, NaN where a config has no result for a date
+    Rows and columns grow by doubling, so a daily-step sweep adds results without per-result objects
+    capacity: initial number of end date columns
+
+    Attributes:
+        rows: dict<AllDatesVolModelRunParams: row>
+        columns: dict<Timestamp: column>, columns in the order end dates were first added
+        end_dates: list of Timestamp, by column
+    """
+    def __init__(self, capacity=256):
+        self.rows = {}
+        self.columns = {}
+        self.end_dates = []
+        self.values = np.full((len(VALUE_FIELDS), 8, capacity), np.nan)
+        self.start_dates = np.full((8, capacity), np.datetime64('NaT'), dtype='datetime64[ns]')
+
+    def _grow(self, n_rows, n_columns):
+        row_capacity, column_capacity = self.start_dates.shape
+        if n_rows <= row_capacity and n_columns <= column_capacity:
+            return
+        while row_capacity < n_rows:
+            row_capacity *= 2
+        while column_capacity < n_columns:
+            column_capacity *= 2
+        values = np.full((len(VALUE_FIELDS), row_capacity, column_capacity), np.nan)
+        values[:, :self.values.shape[1], :self.values.shape[2]] = self.values
+        start_dates = np.full((row_capacity, column_capacity), np.datetime64('NaT'), dtype='datetime64[ns]')
+        start_dates[:self.start_dates.shape[0], :self.start_dates.shape[1]] = self.start_dates
+        self.values = values
+        self.start_dates = start_dates
+
+    def add_config(self, params):
+        """
+        Row of params, added on first use
+        :param params: AllDatesVolModelRunParams
+        :return: int
+        """
+        if params not in self.rows:
+            self._grow(len(self.rows) + 1, len(self.end_dates))
+            self.rows[params] = len(self.rows)
+        return self.rows[params]
+
+    def column(self, data_end_date):
+        """
+        Column of an end date, added on first use
+        :param data_end_date: Timestamp
+        :return: int
+        """
+        column = self.columns.get(data_end_date)
+        if column is None:
+            column = len(self.end_dates)
+            self._grow(len(self.rows), column + 1)
+            self.columns[data_end_date] = column
+            self.end_dates.append(data_end_date)
+        return column
+
+    def set_result(self, row, single_result):
+        """
+        Copy the values of a RVolModelSingleResult into row, replacing any result with the same end date
+        :return: None
+        """
+        column = self.column(single_result.data_end_date)
+        self.values[:, row, column] = [np.nan if value is None else value
+                                       for value in [getattr(single_result, name) for name in VALUE_FIELDS]]
+        self.start_dates[row, column] = np.datetime64(single_result.data_start_date, 'ns')
+
+    def filled_columns(self, rows):
+        """
+        Columns holding a result for any of rows, in end date order
+        :param rows: list of int
+        :return: array of int
+        """
+        n_columns = len(self.end_dates)
+        filled = np.flatnonzero(~np.isnat(self.start_dates[rows, :n_columns]).all(axis=0))
+        order = np.argsort(np.array(self.end_dates, dtype='datetime64[ns]')[filled], kind='stable')
+        return filled[order]
+
+    def field_frame(self, field_name, rows, names):
+        """
+        Values of one field for several configs, built straight from the arrays
+        :param field_name: one of VALUE_FIELDS
+        :param rows: list of int
+        :param names: column names, aligned with rows
+        :return: DataFrame indexed by data_end_date, a column per row
+        """
+        columns = self.filled_columns(rows)
+        values = self.values[VALUE_FIELDS.index(field_name)][np.ix_(rows, columns)].T
+        index = pd.DatetimeIndex(np.array(self.end_dates, dtype='datetime64[ns]')[columns], name='data_end_date')
+        return pd.DataFrame(values, index=index, columns=names)
+
+    def config_frame(self, row):
+        """
+        Every result of one config, in end date order
+        :return: DataFrame with the RVolModelSingleResult.to_series columns and n_realized
+        """
+        columns = self.filled_columns([row])
+        frame = pd.DataFrame(self.values[:, row, columns].T, columns=VALUE_FIELDS)
+        frame.insert(0, 'data_end_date', np.array(self.end_dates, dtype='datetime64[ns]')[columns])
+        frame.insert(0, 'data_start_date', self.start_dates[row, columns])
+        return frame
+
+
+class RVolModelResultView(object):
+    """
+    Read-only single result backed by a ResultArrays cell, exposing the RVolModelSingleResult value fields
+    arrays: ResultArrays
+    row: config row
+    column: end date column
+    params: AllDatesVolModelRunParams of the row
+    """
+    __slots__ = ['arrays', 'row', 'column', 'params']
+
+    def __init__(self, arrays, row, column, params):
+        self.arrays = arrays
+        self.row = row
+        self.column = column
+        self.params = params
+
+    @property
+    def data_start_date(self):
+        return pd.Timestamp(self.arrays.start_dates[self.row, self.column])
+
+    @property
+    def data_end_date(self):
+        return self.arrays.end_dates[self.column]
+
+    def __getattr__(self, name):
+        if name in VALUE_FIELDS:
+            return float(self.arrays.values[VALUE_FIELDS.index(name), self.row, self.column])
+        raise AttributeError(name)
+
+
 class RVolModelMultiDateResult(object):
     """
-    Holds the RVolModelSingleResult, for a range of dates, for a given AllDatesVolModelRunParams
+    Holds the results, for a range of dates, for a given AllDatesVolModelRunParams
+    Values live in a ResultArrays, usually shared by every holder of a sweep, rather than in per-date objects
     Provides access methods for accumulating RVolModelSingleResult data
+    params: AllDatesVolModelRunParams
+    arrays: ResultArrays to hold the values in, a new one when None
 
     attributes:
         params: AllDatesVolModelRunParams
-        results: dict<Timestamp: RVolModelSingleResult>
+        arrays: ResultArrays
+        row: row of params in arrays
     """
-    def __init__(self, params):
+    def __init__(self, params, arrays=None):
         self.params = params
-        self.results = {}
+        self.arrays = ResultArrays() if arrays is None else arrays
+        self.row = self.arrays.add_config(params)
+
+    @property
+    def results(self):
+        """
+        :return: dict<Timestamp: RVolModelResultView> of held results
+        """
+        return dict((self.arrays.end_dates[column], RVolModelResultView(self.arrays, self.row, column, self.params))
+                    for column in self.arrays.filled_columns([self.row]))
+
+    def __len__(self):
+        return len(self.arrays.filled_columns([self.row]))
 
     def add_result(self, single_result):
         """
@@ -214,28 +453,22 @@ class RVolModelMultiDateResult(object):
         :return: None
         """
         if self.params == single_result.params:
-            self.results[single_result.data_end_date] = single_result
+            self.arrays.set_result(self.row, single_result)
 
     def get_result_field(self, field_name):
         """
-        Return a list of values across held RVolModelSingleResult for attribute field_name
-        :param field_name: str
+        Return a list of values across held results for field_name, in end date order
+        :param field_name: str, one of VALUE_FIELDS
         :return: list<values>
         """
-        return map(
-            lambda result_end_date: getattr(self.results[result_end_date], field_name),
-            sorted(self.results.keys()))
+        return self.arrays.field_frame(field_name, [self.row], [field_name])[field_name].tolist()
 
     def get_result_frame(self):
         """
-        Return a frame of series across held RVolModelSingleResult
-        :return: DataFrame<RVolModelSingleResult.to_series()>
+        Return a frame of held results, in end date order
+        :return: DataFrame with the RVolModelSingleResult.to_series() columns and n_realized
         """
-        list_results = map(
-            lambda result_end_date: self.results[result_end_date].to_series(),
-            sorted(self.results.keys())
-        )
-        return pd.DataFrame(list_results)
+        return self.arrays.config_frame(self.row)
 
 
 class RVMSingleResultCache(object):
@@ -249,16 +482,22 @@ class RVMSingleResultCache(object):
             data_start_date.strftime('%Y%m%d'),
             data_end_date.strftime('%Y%m%d')
         )
-        fn = os.path.join(TMP_PATH, fn)
+        if params.asset:
+            fn = '{!s}_{!s}'.format(params.asset, fn)
+        fn = os.path.join(settings.get('TMP_PATH'), fn)
         return fn
 
+    @classmethod
+    def read(cls, file_name):
+        result_series = pd.read_csv(file_name,sep='\t',header=None,index_col=0)[1]
+        result_series.index.name = ''
+        return RVolModelSingleResult.from_series(result_series)
+
     @classmethod
     def check_exists(cls, data_start_date, data_end_date, params):
         file_check = cls.filename(data_start_date, data_end_date, params)
         if os.path.exists(file_check):
-            result_series = pd.read_csv(file_check,sep='\t',header=None,index_col=0)[1]
-            result_series.index.name = ''
-            return RVolModelSingleResult.from_series(result_series)
+            return cls.read(file_check)
         return None
 
     @classmethod
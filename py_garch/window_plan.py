@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+
+
+class DateWindowPlan(object):
+    """
+    Input start and end dates for every start_point and window, computed once from the date index
+    A fit ends on the date start_point rows into the test data set and starts window rows back in the full
+    history, clipped to its first date, or on that first date for a full history window
+    full_dates: sorted array of the full price history dates
+    first_test_position: position in full_dates of the first row of the test data set
+    start_points: array of non-negative positions in the test data set
+    windows: iterable of positive window lengths, or -1 for full history
+
+    Attributes:
+        end_dates: DatetimeIndex, input end date per start_point
+        start_dates: dict<window: DatetimeIndex>, input start date per start_point
+    """
+    def __init__(self, full_dates, first_test_position, start_points, windows):
+        full_dates = np.asarray(full_dates, dtype='datetime64[ns]')
+        self.start_points = np.asarray(start_points, dtype=int)
+        end_positions = first_test_position + self.start_points
+        self.end_dates = pd.DatetimeIndex(full_dates[end_positions])
+        # .loc[:end_date] on the full set keeps every row dated on or before the end date
+        last_positions = np.searchsorted(full_dates, full_dates[end_positions], side='right') - 1
+        self.start_dates = {}
+        for window in sorted(set(windows)):
+            if window > 0:
+                start_positions = np.maximum(last_positions - window + 1, 0)
+            else:
+                start_positions = np.zeros_like(last_positions)
+            self.start_dates[window] = pd.DatetimeIndex(full_dates[start_positions])
+
+    @classmethod
+    def from_data_sets(cls, start_points, windows, test_data_set, full_data_set, date_var='Date'):
+        """
+        :param test_data_set: truncated dataset of price history, a date-sorted tail of full_data_set
+        :param full_data_set: full dataset of price history
+        :return: DateWindowPlan
+        """
+        full_dates = full_data_set[date_var].values
+        first_test_position = np.searchsorted(full_dates, test_data_set[date_var].values[0], side='left')
+        return cls(full_dates, first_test_position, start_points, windows)
+
+    @classmethod
+    def from_price_store(cls, start_points, windows, price_store, first_test_date):
+        """
+        :param price_store: PriceStore of the full price history, its date index is read in place
+        :param first_test_date: first date of the test data set
+        :return: DateWindowPlan
+        """
+        return cls(price_store.dates, price_store.position(first_test_date), start_points, windows)
+
+    def get_start_end_dates(self, index, window):
+        """
+        :param index: position in start_points
+        :param window: window length, or -1 for full history
+        :return: input_start_date (Timestamp), input_end_date (Timestamp)
+        """
+        return self.start_dates[window][index], self.end_dates[index]
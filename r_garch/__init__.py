@@ -0,0 +1,6 @@
+import os.path
+
+cur_path = os.path.dirname(os.path.realpath(__file__))
+script_path = os.path.join(cur_path, "../scripts")
+SOURCE_FILE = os.path.join(script_path, 'rGarch.r')
+BRIDGE_FILE = os.path.join(script_path, 'rBridge.r')
@@ -1,17 +1,166 @@
+import time
+from py_garch.garch_backend import GarchBackend
+from py_garch.garch_engine import format_coefficients, JOB_LENGTH
+from py_garch.price_store import PriceStore
+from py_garch.simulation import SIMULATE
 from .r_utilities import RUtilities
 
 
-def initialized_single_run(r_conn, x_frame, start_date, end_date, n_forecast, model_type, test_dist, n_simulations):
-    r_conn['nForecastDays'] = n_forecast
-    RUtilities.create_time_series_frame(r_conn, x_frame, 'Date', 'data')
-    r_conn['vModel'] = model_type
-    r_conn['dist'] = test_dist
-    r_conn['nSimulations'] = n_simulations
-    r_conn['dt.test.start'] = start_date.strftime('%Y-%m-%d')
-    r_conn['dt.test.end'] = end_date.strftime('%Y-%m-%d')
-    r_conn(
-        'result <- rGARCH(data, dt.test.start, dt.test.end, vModel, ' +
-        'nForecastDays=nForecastDays, nSimulations=nSimulations, dist=dist)'
-    )
-    result_dict = r_conn['result']
-    return result_dict
+def _bytes_sent(r_conn):
+    # CountingR keeps bytes_sent in __dict__, a bare pyper connection would look the name up as an R variable
+    return r_conn.__dict__.get('bytes_sent', 0)
+
+
+class RGarchBackend(GarchBackend):
+    """
+    rugarch engine, driving the rGARCH function of scripts/rGarch.r over a pyper connection
+    Price frames are shipped to the session once and later fits refer to them by handle
+    r_conn: connection from r_connection_initialized
+
+    Attributes:
+        data_handles: dict<frame fingerprint: R variable name> of frames resident in the session
+        last_fit_bytes: (int) bytes of R source sent for the latest fit, data loading included
+        last_timings: dict of transfer, compute and fetch seconds of the latest call
+    """
+    name = 'r'
+
+    def __init__(self, r_conn):
+        self.r_conn = r_conn
+        self.data_handles = {}
+        self.last_fit_bytes = 0
+
+    @classmethod
+    def for_connection(cls, r_conn):
+        """
+        Backend bound to a bare pyper connection, kept on the connection so resident data survives across calls
+        :return: RGarchBackend
+        """
+        # through __dict__, as CountingR.bytes_sent: pyper reads and assigns any other attribute as an R variable
+        backend = r_conn.__dict__.get('garch_backend')
+        if backend is None:
+            backend = cls(r_conn)
+            r_conn.__dict__['garch_backend'] = backend
+        return backend
+
+    @property
+    def session_pid(self):
+        return self.r_conn.prog.pid
+
+    def data_handle(self, x_frame):
+        """
+        Name of the R variable holding x_frame as a price xts, loading it on first use
+        :param x_frame: DataFrame with Date and Close columns, or PriceStore
+        :return: str
+        """
+        if isinstance(x_frame, PriceStore):
+            fingerprint = x_frame.fingerprint
+        else:
+            fingerprint = RUtilities.frame_fingerprint(x_frame, 'Date')
+        if fingerprint not in self.data_handles:
+            handle = 'data.{!s}'.format(len(self.data_handles))
+            if isinstance(x_frame, PriceStore):
+                x_frame = x_frame.frame()
+            RUtilities.create_time_series_frame(self.r_conn, x_frame, 'Date', handle)
+            self.r_conn('{var} <- rGARCHPrices({var})'.format(var=handle))
+            self.data_handles[fingerprint] = handle
+        return self.data_handles[fingerprint]
+
+    def load_data(self, x_frame):
+        self.data_handle(x_frame)
+
+    def single_run(self, x_frame, start_date, end_date, n_forecast, model_type, test_dist, n_simulations,
+                   seed=None, start_coef=None, fixed_coef=None, refit_every=1, forecast_mode=SIMULATE):
+        r_conn = self.r_conn
+        bytes_start = _bytes_sent(r_conn)
+        time_start = time.perf_counter()
+        data_handle = self.data_handle(x_frame)
+        r_conn['nForecastDays'] = n_forecast
+        r_conn['vModel'] = model_type
+        r_conn['dist'] = test_dist
+        r_conn['nSimulations'] = n_simulations
+        r_conn['dt.test.start'] = start_date.strftime('%Y-%m-%d')
+        r_conn['dt.test.end'] = end_date.strftime('%Y-%m-%d')
+        r_conn('rseed <- {!s}'.format('NA' if seed is None else int(seed)))
+        r_conn['startPars'] = '' if start_coef is None else format_coefficients(start_coef)
+        r_conn['fixedPars'] = '' if fixed_coef is None else format_coefficients(fixed_coef)
+        r_conn['refitEvery'] = refit_every or 1
+        r_conn['forecastMode'] = forecast_mode or SIMULATE
+        time_sent = time.perf_counter()
+        r_conn(
+            'result <- rGARCH(' + data_handle + ', dt.test.start, dt.test.end, vModel, ' +
+            'nForecastDays=nForecastDays, nSimulations=nSimulations, dist=dist, rseed=rseed, startPars=startPars, ' +
+            'fixedPars=fixedPars, refitEvery=refitEvery, forecastMode=forecastMode)'
+        )
+        time_computed = time.perf_counter()
+        result_dict = r_conn['result']
+        self.last_fit_bytes = _bytes_sent(r_conn) - bytes_start
+        self.last_timings = {'transfer': time_sent - time_start,
+                             'compute': time_computed - time_sent,
+                             'fetch': time.perf_counter() - time_computed}
+        return result_dict
+
+    def multi_run(self, x_frame, jobs, warm_start=False):
+        """
+        Ship all jobs as one table and run them with a single rGARCHBatch call and one result fetch
+        Warm-started chains run one fit per call, each seeded from the fit before it
+        :param jobs: list of job tuples, see garch_engine.JOB_LENGTH
+        :return: dict keyed as the rGARCH result list, holding every job's results
+        """
+        if warm_start:
+            return GarchBackend.multi_run(self, x_frame, jobs, warm_start)
+        jobs = [tuple(job) + (None,) * (JOB_LENGTH - len(job)) for job in jobs]
+        r_conn = self.r_conn
+        bytes_start = _bytes_sent(r_conn)
+        time_start = time.perf_counter()
+        data_handle = self.data_handle(x_frame)
+        RUtilities.create_data_frame(r_conn, [
+            ('start', [job[0].strftime('%Y-%m-%d') for job in jobs]),
+            ('end', [job[1].strftime('%Y-%m-%d') for job in jobs]),
+            ('nForecastDays', [int(job[2]) for job in jobs]),
+            ('vModel', [job[3] for job in jobs]),
+            ('dist', [job[4] for job in jobs]),
+            ('nSimulations', [int(job[5]) for job in jobs]),
+            ('rseed', [float('nan') if job[6] is None else float(job[6]) for job in jobs]),
+            ('startPars', ['' if job[7] is None else format_coefficients(job[7]) for job in jobs]),
+            ('fixedPars', ['' if job[8] is None else format_coefficients(job[8]) for job in jobs]),
+            ('refitEvery', [int(job[9] or 1) for job in jobs]),
+            ('forecastMode', [job[10] or SIMULATE for job in jobs])
+        ], 'jobs')
+        time_sent = time.perf_counter()
+        r_conn('result <- rGARCHBatch({!s}, jobs)'.format(data_handle))
+        time_computed = time.perf_counter()
+        result_dict = r_conn['result']
+        self.last_fit_bytes = (_bytes_sent(r_conn) - bytes_start) / float(len(jobs))
+        self.last_timings = {'transfer': time_sent - time_start,
+                             'compute': time_computed - time_sent,
+                             'fetch': time.perf_counter() - time_computed}
+        return result_dict
+
+
+def initialized_single_run(r_conn, x_frame, start_date, end_date, n_forecast, model_type, test_dist, n_simulations,
+                           seed=None, start_coef=None, fixed_coef=None, refit_every=1, forecast_mode=SIMULATE):
+    """
+    Fit and simulate one date window
+    :param r_conn: GarchBackend, or a pyper connection from r_connection_initialized
+    :param seed: optional simulation seed, see garch_engine.simulation_seed
+    :param start_coef: optional dict of starting coefficients for the optimizer
+    :param fixed_coef: optional dict of coefficients to filter with instead of fitting
+    :param refit_every: refit frequency of the run, used in the result keys
+    :param forecast_mode: one of simulation.FORECAST_MODES
+    :return: dict keyed as the rGARCH result list
+    """
+    backend = r_conn if isinstance(r_conn, GarchBackend) else RGarchBackend.for_connection(r_conn)
+    return backend.single_run(x_frame, start_date, end_date, n_forecast, model_type, test_dist, n_simulations,
+                              seed, start_coef, fixed_coef, refit_every, forecast_mode)
+
+
+def initialized_batch_run(r_conn, x_frame, jobs, warm_start=False):
+    """
+    Fit and simulate several date windows and configs in one backend call
+    :param r_conn: GarchBackend, or a pyper connection from r_connection_initialized
+    :param jobs: list of job tuples, see garch_engine.JOB_LENGTH
+    :param warm_start: jobs are one chain in date order, each fit seeded from the previous one
+    :return: dict keyed as the rGARCH result list, holding every job's results
+    """
+    backend = r_conn if isinstance(r_conn, GarchBackend) else RGarchBackend.for_connection(r_conn)
+    return backend.multi_run(x_frame, jobs, warm_start)
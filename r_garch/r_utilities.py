@@ -1,35 +1,298 @@
+import datetime
+import os
+import shutil
+import struct
+import tempfile
+import numpy as np
 import pandas as pd
 from contextlib import contextmanager
-from pyper import R, RError
-from config import R_PATH
-import os.path
+from pyper import R, RError, Str4R
+from py_garch import settings
+from . import SOURCE_FILE, BRIDGE_FILE
 
-cur_path = os.path.dirname(os.path.realpath(__file__))
-script_path = os.path.join(cur_path, "../scripts")
-SOURCE_FILE = os.path.join(script_path, 'rGarch.r')
 
+# binary transfer format shared with scripts/rBridge.r: little-endian arrays, NUL terminated strings, dates as
+# int32 days since 1970-01-01; scalar lists are written as one section per type, in COLUMN_TYPES order
+COLUMN_TYPES = ['double', 'integer', 'date', 'character']
+COLUMN_DTYPES = {'double': '<f8', 'integer': '<i4', 'date': '<i4'}
+UNSUPPORTED = 0
+SCALAR_LIST = 1
+FRAME = 2
+VECTOR = 3
+# arrays shorter than this are sent as R source text, a file round trip costs more than it saves
+BINARY_MIN_LENGTH = 64
+# R's NA_integer_, which a missing date crosses as
+R_NA_INTEGER = -2 ** 31
+
+
+def r_file_path(path):
+    """
+    :return: str, path quoted for R source, with forward slashes
+    """
+    return '"{!s}"'.format(path.replace('\\', '/'))
+
+
+def r_strings(values):
+    """
+    R source of a character vector, for names and type tags; pyper escapes backslashes itself, and values may
+    not hold double quotes
+    :return: str
+    """
+    return 'c({!s})'.format(', '.join(['"{!s}"'.format(value) for value in values]))
+
+
+def encode_column(values):
+    """
+    :param values: sequence of numbers, strings or dates
+    :return: column type (one of COLUMN_TYPES), bytes
+    """
+    values = np.asarray(values)
+    if values.dtype.kind == 'O' and len(values) > 0 and isinstance(values[0], (datetime.date, np.datetime64)):
+        values = pd.to_datetime(values).values
+    if values.dtype.kind == 'M':
+        days = values.astype('datetime64[D]').astype('int64')
+        days[np.isnat(values)] = R_NA_INTEGER
+        return 'date', days.astype(COLUMN_DTYPES['date']).tobytes()
+    if values.dtype.kind in 'OUS':
+        return 'character', b''.join([str(value).encode('utf-8') + b'\0' for value in values])
+    if values.dtype.kind in 'iub':
+        return 'integer', values.astype(COLUMN_DTYPES['integer']).tobytes()
+    return 'double', values.astype(COLUMN_DTYPES['double']).tobytes()
+
+
+class BinaryReader(object):
+    """
+    Cursor over a transfer written by rBridgeWrite
+    data: bytes
+    """
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def int32(self, n=1):
+        values = struct.unpack_from('<{!s}i'.format(n), self.data, self.offset)
+        self.offset += 4 * n
+        return values[0] if n == 1 else values
+
+    def strings(self, n):
+        """
+        :return: list of n strings
+        """
+        if n == 0:
+            return []
+        end = self.offset
+        for _ in range(n):
+            end = self.data.index(b'\0', end) + 1
+        strings = self.data[self.offset:end - 1].decode('utf-8').split('\0')
+        self.offset = end
+        return strings
+
+    def values(self, column_type, n):
+        """
+        :return: array of n values of column_type, a list for character
+        """
+        if column_type == 'character':
+            return self.strings(n)
+        values = np.frombuffer(self.data, COLUMN_DTYPES[column_type], n, self.offset)
+        self.offset += values.nbytes
+        if column_type == 'date':
+            return np.where(values == R_NA_INTEGER, np.datetime64('NaT', 'D'), values.astype('datetime64[D]'))
+        return values
+
+    def column(self, n):
+        """
+        :return: array of a column written with its type, dates as datetime64[ns]
+        """
+        column_type = self.strings(1)[0]
+        values = self.values(column_type, n)
+        return values.astype('datetime64[ns]') if column_type == 'date' else values
+
+
+def decode_transfer(data):
+    """
+    Decode an object written by rBridgeWrite
+    :param data: bytes
+    :return: (bool supported, value): dict for a named list of scalars, DataFrame for a data.frame, array for a
+        vector
+    """
+    reader = BinaryReader(data)
+    kind = reader.int32()
+    if kind == SCALAR_LIST:
+        result = {}
+        for column_type in COLUMN_TYPES:
+            n = reader.int32()
+            names = reader.strings(n)
+            values = reader.values(column_type, n)
+            result.update(zip(names, values if column_type == 'character' else values.tolist()))
+        return True, result
+    if kind == FRAME:
+        n_columns, n_rows = reader.int32(2)
+        names = reader.strings(n_columns)
+        return True, pd.DataFrame(dict((name, reader.column(n_rows)) for name in names), columns=names)
+    if kind == VECTOR:
+        n = reader.int32()
+        return True, np.asarray(reader.column(n))
+    return False, None
+
+
+class BinaryTransport(object):
+    """
+    Bulk transfers for an R connection through binary files: arrays and tables are written once with numpy and
+    read in R with one readBin per column, and R objects are written with writeBin and decoded with
+    np.frombuffer, instead of crossing the pipe as R source text. Anything else, and short arrays, fall back to
+    the connection's own text marshalling
+    Mixed in ahead of a pyper style connection class, whose __call__ runs R commands and which counts
+    bytes_sent; state is kept in __dict__ as pyper sends other attribute assignments to R
+
+    Attributes:
+        transfer_path: directory of the transfer files, removed by close_transfers
+        bytes_transferred: (int) bytes written to and read from transfer files
+    """
+    def open_transfers(self, transfer_path=None):
+        """
+        :param transfer_path: directory of the transfer files, a new temporary one when None
+        """
+        if transfer_path is None:
+            transfer_path = tempfile.mkdtemp(prefix='r_bridge_')
+        os.makedirs(transfer_path, exist_ok=True)
+        self.__dict__['transfer_path'] = transfer_path
+        self.__dict__['bytes_transferred'] = 0
+
+    def close_transfers(self):
+        shutil.rmtree(self.transfer_path, ignore_errors=True)
+
+    def _transfer_file(self, name):
+        return os.path.join(self.transfer_path, '{!s}.bin'.format(name))
+
+    def _write_transfer(self, name, payloads):
+        path = self._transfer_file(name)
+        with open(path, 'wb') as transfer_file:
+            for payload in payloads:
+                transfer_file.write(payload)
+        n_bytes = sum([len(payload) for payload in payloads])
+        self.bytes_transferred += n_bytes
+        self.bytes_sent += n_bytes
+        return path
+
+    def assign_columns(self, var_name, columns):
+        """
+        Assign an R data.frame from (name, values) pairs of equal length
+        :param columns: list of (str, sequence)
+        :return: None
+        """
+        encoded = [(name,) + encode_column(values) for name, values in columns]
+        n_rows = len(columns[0][1]) if len(columns) > 0 else 0
+        path = self._write_transfer(var_name, [payload for _, _, payload in encoded])
+        self('{var} <- rBridgeReadFrame({path}, {names}, {types}, {n})'.format(
+            var=var_name, path=r_file_path(path), n=n_rows,
+            names=r_strings([name for name, _, _ in encoded]),
+            types=r_strings([column_type for _, column_type, _ in encoded])))
+
+    def assign_vector(self, var_name, values):
+        """
+        Assign an R vector from a sequence of numbers, strings or dates
+        :return: None
+        """
+        column_type, payload = encode_column(values)
+        path = self._write_transfer(var_name, [payload])
+        self('{var} <- rBridgeReadVector({path}, "{column_type}", {n})'.format(
+            var=var_name, path=r_file_path(path), column_type=column_type, n=len(values)))
+
+    def __setitem__(self, obj, val):
+        if isinstance(val, pd.DataFrame):
+            self.assign_columns(obj, [(name, val[name].values) for name in val.columns])
+        elif isinstance(val, (np.ndarray, pd.Series)) and np.ndim(val) == 1 and len(val) >= BINARY_MIN_LENGTH:
+            self.assign_vector(obj, val)
+        else:
+            super(BinaryTransport, self).__setitem__(obj, val)
+
+    def __getitem__(self, obj, *args, **kwargs):
+        path = self._transfer_file('from_r')
+        if os.path.exists(path):
+            os.remove(path)
+        self('rBridgeWrite({!s}, {!s})'.format(obj, r_file_path(path)))
+        if os.path.exists(path):
+            with open(path, 'rb') as transfer_file:
+                data = transfer_file.read()
+            self.bytes_transferred += len(data)
+            supported, value = decode_transfer(data)
+            if supported:
+                return value
+        return super(BinaryTransport, self).__getitem__(obj, *args, **kwargs)
+
+
+class CountingR(R):
+    """
+    pyper R connection that counts the bytes of R source sent down the pipe, assignments included
+    """
+    def __init__(self, *args, **kwargs):
+        # set through __dict__, pyper's __setattr__ would assign an R variable instead
+        self.__dict__['bytes_sent'] = 0
+        R.__init__(self, *args, **kwargs)
+
+    def __call__(self, CMDS=[], use_try=None):
+        self.bytes_sent += len(CMDS) if isinstance(CMDS, str) else len('; '.join(CMDS))
+        return R.__call__(self, CMDS, use_try=use_try)
+
+
+class BinaryR(BinaryTransport, CountingR):
+    """
+    CountingR whose bulk transfers go through binary files, see BinaryTransport; bytes_sent counts the
+    transfer files written on top of the R source
+    """
+    def __init__(self, *args, **kwargs):
+        CountingR.__init__(self, *args, **kwargs)
+        self.open_transfers()
+        self('source({!s})'.format(r_file_path(BRIDGE_FILE)))
+
+    def close(self):
+        self.prog.terminate()
+        self.close_transfers()
 
 
 @contextmanager
 def r_connection():
-    r = R(RCMD=R_PATH)
+    r = CountingR(RCMD=settings.get('R_PATH'))
     yield r
     r.prog.terminate()
 
 
 @contextmanager
 def r_connection_initialized(initialization_string):
-    r = R(RCMD=R_PATH)
+    r = CountingR(RCMD=settings.get('R_PATH'))
     r(initialization_string)
     yield r
     r.prog.terminate()
 
 
+@contextmanager
+def binary_r_connection():
+    """
+    Drop-in replacement for r_connection moving bulk data as binary files, see BinaryR
+    """
+    r = BinaryR(RCMD=settings.get('R_PATH'))
+    yield r
+    r.close()
+
+
+@contextmanager
+def binary_r_connection_initialized(initialization_string):
+    """
+    Drop-in replacement for r_connection_initialized moving bulk data as binary files, see BinaryR
+    """
+    r = BinaryR(RCMD=settings.get('R_PATH'))
+    r(initialization_string)
+    yield r
+    r.close()
+
+
 class RUtilities(object):
 
     @classmethod
     def create_date_series(cls, r_conn, date_list, date_list_var_name):
-        if len(date_list) > 0:
+        if isinstance(r_conn, BinaryTransport) and len(date_list) > 0:
+            r_conn.assign_columns(date_list_var_name, [('Date', list(date_list))])
+        elif len(date_list) > 0:
             date_list_str = map(lambda d: d.strftime('%Y-%m-%d'), date_list)
             r_conn[date_list_var_name] = date_list_str
             r_conn('{var} = data.frame({var}, stringsAsFactors=F)'.format(var=date_list_var_name))
@@ -41,21 +304,45 @@ class RUtilities(object):
 
     @classmethod
     def create_time_series_frame(cls, r_conn, data_frame, date_var, data_frame_var_name):
-        data_frame = data_frame.fillna(pd.np.nan)
+        data_frame = data_frame.fillna(np.nan)
         if date_var not in data_frame.columns:
             data_frame.reset_index(inplace=True)
             if date_var not in data_frame.columns:
                 raise Exception('date var not in data frame')
+        if isinstance(r_conn, BinaryTransport):
+            r_conn.assign_columns(data_frame_var_name, [(name, data_frame[name].values)
+                                                        for name in data_frame.columns])
+            return
         data_frame[date_var] = data_frame[date_var].apply(lambda d: d.strftime('%Y-%m-%d'))
         r_conn[data_frame_var_name] = data_frame.values
         r_conn('{var} <- data.frame({var},stringsAsFactors=F)'.format(var=data_frame_var_name))
         colnames = data_frame.columns.tolist()
         r_conn['cns'] = colnames
         r_conn('colnames({var}) <- cns'.format(var=data_frame_var_name))
-        colnames.remove(date_var)
         r_conn('{var}${date_var} <- as.Date({var}${date_var})'.format(var=data_frame_var_name, date_var=date_var))
-        list(map(
-            lambda col_name: r_conn('{var}${col_name} <- as.double({var}${col_name})'.
-                                    format(var=data_frame_var_name, col_name=col_name)),
-            colnames))
+        r_conn('{var}[setdiff(cns, \'{date_var}\')] <- lapply({var}[setdiff(cns, \'{date_var}\')], as.double)'.
+               format(var=data_frame_var_name, date_var=date_var))
         return
+
+    @classmethod
+    def create_data_frame(cls, r_conn, columns, data_frame_var_name):
+        """
+        Assign an R data.frame from (name, list of values) pairs with a single R command
+        :param columns: list of (str, list)
+        """
+        if isinstance(r_conn, BinaryTransport):
+            r_conn.assign_columns(data_frame_var_name, columns)
+            return
+        r_conn('{var} <- data.frame({cols}, stringsAsFactors=F)'.format(
+            var=data_frame_var_name,
+            cols=', '.join(['{!s}={!s}'.format(name, Str4R(values)) for name, values in columns])))
+        return
+
+    @classmethod
+    def frame_fingerprint(cls, data_frame, date_var):
+        """
+        Cheap identity of a price frame, used to tell whether an R session already holds it
+        :return: tuple
+        """
+        dates = data_frame[date_var]
+        return data_frame.shape, dates.iloc[0], dates.iloc[-1], float(data_frame.drop(columns=date_var).sum().sum())
@@ -0,0 +1,106 @@
+# binary transfers for r_garch.r_utilities.BinaryR: columns cross as little-endian arrays in a file, read and
+# written with one readBin/writeBin call each, in place of pyper's R source text
+# column types, in the order the sections of a scalar list are written: double, integer, date (days since
+# 1970-01-01 as integer), character (NUL terminated)
+BRIDGE.TYPES <- c("double", "integer", "date", "character")
+BRIDGE.UNSUPPORTED <- 0L
+BRIDGE.SCALAR.LIST <- 1L
+BRIDGE.FRAME <- 2L
+BRIDGE.VECTOR <- 3L
+
+
+rBridgeReadColumn <- function(con, colType, n)
+{
+	if (colType == "double") return(readBin(con, "double", n=n, size=8, endian="little"))
+	if (colType == "integer") return(readBin(con, "integer", n=n, size=4, endian="little"))
+	if (colType == "date") return(as.Date(readBin(con, "integer", n=n, size=4, endian="little"), origin="1970-01-01"))
+	if (colType == "character") return(readBin(con, "character", n=n))
+	stop(paste("unknown bridge column type", colType))
+}
+
+
+# data.frame of n rows from the columns written by BinaryTransport.assign_columns
+rBridgeReadFrame <- function(path, colNames, colTypes, n)
+{
+	con <- file(path, "rb")
+	on.exit(close(con))
+	cols <- lapply(colTypes, function(colType) rBridgeReadColumn(con, colType, n))
+	names(cols) <- colNames
+	return(as.data.frame(cols, stringsAsFactors=FALSE, optional=TRUE))
+}
+
+
+# vector of n values written by BinaryTransport.assign_vector
+rBridgeReadVector <- function(path, colType, n)
+{
+	con <- file(path, "rb")
+	on.exit(close(con))
+	return(rBridgeReadColumn(con, colType, n))
+}
+
+
+rBridgeType <- function(v)
+{
+	if (inherits(v, "Date")) return("date")
+	if (is.character(v) || is.factor(v)) return("character")
+	# integer NA has no NaN to stand for it, such columns go as double
+	if ((is.integer(v) || is.logical(v)) && !anyNA(v)) return("integer")
+	return("double")
+}
+
+
+rBridgeWriteValues <- function(con, v, colType)
+{
+	if (colType == "double") writeBin(as.double(v), con, size=8, endian="little")
+	else if (colType == "integer" || colType == "date") writeBin(as.integer(v), con, size=4, endian="little")
+	else writeBin(as.character(v), con)
+}
+
+
+rBridgeWriteColumn <- function(con, v)
+{
+	colType <- rBridgeType(v)
+	writeBin(colType, con)
+	rBridgeWriteValues(con, v, colType)
+}
+
+
+# write x for BinaryTransport.__getitem__: a named list of scalars (as rGARCH results) in one section per type,
+# a data.frame column by column, or an atomic vector; anything else is flagged unsupported and read as text
+rBridgeWrite <- function(x, path)
+{
+	con <- file(path, "wb")
+	on.exit(close(con))
+	if (is.data.frame(x))
+	{
+		writeBin(c(BRIDGE.FRAME, ncol(x), nrow(x)), con, size=4, endian="little")
+		writeBin(as.character(names(x)), con)
+		for (col in x) rBridgeWriteColumn(con, col)
+	}
+	else if (is.list(x) && (length(x) == 0 || !is.null(names(x))) &&
+		all(vapply(x, function(v) is.atomic(v) && length(v) == 1, logical(1))))
+	{
+		writeBin(BRIDGE.SCALAR.LIST, con, size=4, endian="little")
+		types <- vapply(x, rBridgeType, character(1))
+		for (colType in BRIDGE.TYPES)
+		{
+			section <- x[types == colType]
+			writeBin(length(section), con, size=4, endian="little")
+			writeBin(as.character(names(section)), con)
+			# unlist would turn factors into their codes
+			values <- unlist(section, use.names=FALSE)
+			if (colType == "character") values <- vapply(section, as.character, character(1), USE.NAMES=FALSE)
+			rBridgeWriteValues(con, values, colType)
+		}
+	}
+	else if (is.atomic(x) && is.null(dim(x)))
+	{
+		writeBin(c(BRIDGE.VECTOR, length(x)), con, size=4, endian="little")
+		rBridgeWriteColumn(con, x)
+	}
+	else
+	{
+		writeBin(BRIDGE.UNSUPPORTED, con, size=4, endian="little")
+	}
+	invisible(NULL)
+}
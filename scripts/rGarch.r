@@ -1,70 +1,239 @@
 library(rugarch)
 library(xts)
 
+# adaptive forecasts draw paths in batches until the standard error of mean.sim.ann is within the tolerance,
+# as simulation.ADAPTIVE_BATCH and simulation.ADAPTIVE_TOLERANCE
+ADAPTIVE.BATCH <- 500
+ADAPTIVE.TOLERANCE <- 0.002
 
-rGARCH <- function(data, dt.test.start, dt.test.end, vModel, nForecastDays=21, nSimulations=5000, dist="norm")
+
+# price xts used by rGARCH, built once per session from a Date/Close data frame
+rGARCHPrices <- function(data)
+{
+	dates   <- as.Date(data$Date, "%m/%d/%Y")
+	return(as.xts(data$Close, order.by=dates))
+}
+
+
+# parse "mu=0.0003;omega=1.2e-06;..." into a named list of starting parameters, NULL when empty
+rGARCHParsePars <- function(startPars)
+{
+	if (is.na(startPars) || startPars == "")
+	{
+		return(NULL)
+	}
+	pairs <- strsplit(strsplit(startPars, ";")[[1]], "=")
+	pars <- lapply(pairs, function(p) as.numeric(p[2]))
+	names(pars) <- sapply(pairs, function(p) p[1])
+	return(pars)
+}
+
+
+rGARCH <- function(data, dt.test.start, dt.test.end, vModel, nForecastDays=21, nSimulations=5000, dist="norm", rseed=NA,
+	startPars="", fixedPars="", refitEvery=1, forecastMode="simulate")
 {
 	result.list = list()
+	if (forecastMode == "analytic" && vModel == "eGARCH")
+	{
+		# a simulated fit stored as analytic would mix two estimators in one config's results
+		stop("eGARCH has no closed-form forecast, it cannot run in analytic mode")
+	}
     if (is.data.frame(data))
+	{
+		data <- rGARCHPrices(data)
+	}
+    if (is.xts(data))
 	{
 		dt.test.start <- as.Date(dt.test.start)
         dt.test.end <- as.Date(dt.test.end)
-		dates   <- as.Date(data$Date, "%m/%d/%Y")
-		prices.xts <- as.xts(data$Close, order.by=dates)
+		prices.xts <- data
 		
 		# filter price dates past test date
         prices.xts.past = prices.xts[paste(as.character(dt.test.start), "/", as.character(dt.test.end),sep="")]
-        
-		# filter price dates prior test date
-        prices.xts.fut = prices.xts[paste(as.character(dt.test.end), "/",sep="")]
 	    
 		# test date truncated return set
       	returns.xts.past = na.omit(diff(log(prices.xts.past),1))
-
-        # test date truncated return set
-      	returns.xts.fut = na.omit(diff(log(prices.xts.fut),1))
         
 		# Define the GARCH model
 		uspec <- ugarchspec(variance.model = list(model=vModel, garchOrder=c( 1,1 ), submodel=NULL),
 				mean.model=list(armaOrder=c( 0,0 ),
 						include.mean=TRUE),distribution.model=dist)
         
-		# fit the GARCH model
-		fit.garch = ugarchfit(spec = uspec, data = returns.xts.past, solver="hybrid")
+		# fit the GARCH model, from the previous fit's coefficients when given, cold if that fails to converge
+		time.fit <- proc.time()[["elapsed"]]
+		start.pars <- rGARCHParsePars(startPars)
+		fixed.pars <- rGARCHParsePars(fixedPars)
+		warm.start <- 0
+		fit.garch <- NULL
+		solver.iterations <- 0
+		if (!is.null(fixed.pars))
+		{
+			# between refits: filter the new window with the last fit's coefficients, no estimation
+			uspec.fixed <- uspec
+			setfixed(uspec.fixed) <- fixed.pars
+			filt.garch <- ugarchfilter(uspec.fixed, returns.xts.past)
+		}
+		else if (!is.null(start.pars))
+		{
+			uspec.warm <- uspec
+			setstart(uspec.warm) <- start.pars
+			fit.garch <- tryCatch(ugarchfit(spec = uspec.warm, data = returns.xts.past, solver="hybrid"),
+				error=function(e) NULL)
+			if (!is.null(fit.garch) && convergence(fit.garch) == 0)
+			{
+				warm.start <- 1
+			}
+			else
+			{
+				if (!is.null(fit.garch)) solver.iterations <- rGARCHIterations(fit.garch)
+				fit.garch <- NULL
+			}
+		}
+		if (is.null(fit.garch) && is.null(fixed.pars))
+		{
+			fit.garch = ugarchfit(spec = uspec, data = returns.xts.past, solver="hybrid")
+		}
+		if (is.null(fixed.pars))
+		{
+			solver.iterations <- solver.iterations + rGARCHIterations(fit.garch)
+			fit.coef = coef(fit.garch)
+			converged = as.integer(convergence(fit.garch) == 0)
+		}
+		else
+		{
+			fit.coef = unlist(fixed.pars)
+			converged = 1
+		}
+		fit.seconds <- proc.time()[["elapsed"]] - time.fit
 		result.list = list()
 
-        # simulate the model forward
-        sim  = ugarchsim(fit.garch, n.sim=nForecastDays, n.start=0, m.sim=nSimulations, startMethod="sample")
-
-        # calculate the RMS of the simulated returns
-        sims =  sqrt((colSums(fitted(sim)^2, na.rm=T)))
-        sims.sorted = sort(sims)
-        # filter out the most extreme 5% of values
-        cut.lo = as.integer(nSimulations * .025)
-        cut.hi = as.integer(nSimulations * .975)
-        sims.cut = sims.sorted[cut.lo:cut.hi]
-        # annualize
-        sim.ann      = sqrt(252 / (nForecastDays-1)) * sims.cut
-        mean.sim.ann = mean(sim.ann)
+        # simulate the model forward, from the end of the filtered window between refits; returns the RMS of
+        # each simulated return path
+		simulatePaths <- function(mSim, seed)
+		{
+			if (is.null(fixed.pars))
+			{
+				sim  = ugarchsim(fit.garch, n.sim=nForecastDays, n.start=0, m.sim=mSim, startMethod="sample",
+					rseed=seed)
+			}
+			else
+			{
+				sim = ugarchpath(uspec.fixed, n.sim=nForecastDays, n.start=0, m.sim=mSim,
+					presigma=tail(as.numeric(sigma(filt.garch)), 1), prereturns=tail(as.numeric(returns.xts.past), 1),
+					preresiduals=tail(as.numeric(residuals(filt.garch)), 1), rseed=seed)
+			}
+			return(sqrt((colSums(fitted(sim)^2, na.rm=T))))
+		}
 
-        qnt = quantile(sim.ann)
-
-        ret.future = head(returns.xts.fut, nForecastDays)
-        vol.realized = sqrt(sum(ret.future^2) / (nForecastDays-1))
-        vol.realized.ann = sqrt(252) * vol.realized
-
-        forecast.error = vol.realized.ann - mean.sim.ann
+		if (forecastMode == "analytic")
+		{
+			# expected variance of each forecast day in closed form, no paths; quantiles are not available
+			if (is.null(fixed.pars))
+			{
+				fc = ugarchforecast(fit.garch, n.ahead=nForecastDays)
+			}
+			else
+			{
+				fc = ugarchforecast(uspec.fixed, data=returns.xts.past, n.ahead=nForecastDays)
+			}
+			mean.sim.ann = sqrt(252 / (nForecastDays-1) * sum(as.numeric(sigma(fc))^2 + as.numeric(fitted(fc))^2))
+			qnt = rep(NA, 5)
+			n.sims.used = 0
+			std.error = 0
+		}
+		else if (forecastMode == "adaptive")
+		{
+			# batches of paths until the standard error is within tolerance, nSimulations paths at most
+			sims = c()
+			repeat
+			{
+				mSim = min(ADAPTIVE.BATCH, nSimulations - length(sims))
+				batch.seed = if (is.na(rseed)) NA else rseed + length(sims)
+				sims = c(sims, simulatePaths(mSim, batch.seed))
+				summary = rGARCHTrimmedSummary(sims, nForecastDays)
+				if (summary$std.error <= ADAPTIVE.TOLERANCE || length(sims) >= nSimulations) break
+			}
+			mean.sim.ann = summary$mean.sim.ann
+			qnt = summary$qnt
+			n.sims.used = length(sims)
+			std.error = summary$std.error
+		}
+		else
+		{
+			summary = rGARCHTrimmedSummary(simulatePaths(nSimulations, rseed), nForecastDays)
+			mean.sim.ann = summary$mean.sim.ann
+			qnt = summary$qnt
+			n.sims.used = nSimulations
+			std.error = summary$std.error
+		}
 
         prefix = paste(vModel, dist, as.character(nSimulations),
             as.character(nForecastDays), strftime(dt.test.start,'%Y%m%d'), strftime(dt.test.end,'%Y%m%d'), sep='_')
+        if (refitEvery != 1)
+        {
+            prefix = paste(prefix, paste0('refit', as.character(refitEvery)), sep='_')
+        }
+        if (forecastMode != "simulate")
+        {
+            prefix = paste(prefix, forecastMode, sep='_')
+        }
         result.list[[paste(prefix, 'quantile0', sep='_')]] = qnt[[1]]
         result.list[[paste(prefix, 'quantile25', sep='_')]] = qnt[[2]]
         result.list[[paste(prefix, 'quantile50', sep='_')]] = qnt[[3]]
         result.list[[paste(prefix, 'quantile75', sep='_')]] = qnt[[4]]
         result.list[[paste(prefix, 'quantile100', sep='_')]] = qnt[[5]]
         result.list[[paste(prefix, 'mean.sim.ann', sep='_')]] = mean.sim.ann
-        result.list[[paste(prefix, 'vol.realized.ann', sep='_')]] = vol.realized.ann
-        result.list[[paste(prefix, 'forecast.error', sep='_')]] = forecast.error
+        result.list[[paste(prefix, 'coefficients', sep='_')]] = paste(names(fit.coef), sprintf("%.17g", fit.coef),
+            sep='=', collapse=';')
+        result.list[[paste(prefix, 'solver.iterations', sep='_')]] = solver.iterations
+        result.list[[paste(prefix, 'fit.seconds', sep='_')]] = fit.seconds
+        result.list[[paste(prefix, 'warm.start', sep='_')]] = warm.start
+        result.list[[paste(prefix, 'converged', sep='_')]] = converged
+        result.list[[paste(prefix, 'n.sims.used', sep='_')]] = n.sims.used
+        result.list[[paste(prefix, 'sim.std.error', sep='_')]] = std.error
     }
 	return(result.list)
-}
\ No newline at end of file
+}
+
+
+# trimmed mean, quantiles and standard error of the trimmed mean of annualized path vols
+rGARCHTrimmedSummary <- function(sims, nForecastDays)
+{
+	sims.sorted = sort(sims)
+	# filter out the most extreme 5% of values
+	cut.lo = as.integer(length(sims) * .025)
+	cut.hi = as.integer(length(sims) * .975)
+	sims.cut = sims.sorted[cut.lo:cut.hi]
+	# annualize
+	sim.ann = sqrt(252 / (nForecastDays-1)) * sims.cut
+	return(list(mean.sim.ann=mean(sim.ann), qnt=quantile(sim.ann),
+		std.error=sd(sim.ann) / sqrt(length(sim.ann))))
+}
+
+
+# outer iterations reported by the solver that produced the fit, NA when it does not report them
+rGARCHIterations <- function(fit)
+{
+	iterations <- tryCatch(fit@fit$solver$sol$outer.iter, error=function(e) NULL)
+	if (is.null(iterations)) NA else iterations
+}
+
+
+# run every row of a jobs table (start, end, nForecastDays, vModel, dist, nSimulations, rseed, startPars, fixedPars,
+# refitEvery, forecastMode) against one price series, returning all results in a single list keyed as rGARCH keys them
+rGARCHBatch <- function(data, jobs)
+{
+	if (is.data.frame(data))
+	{
+		data <- rGARCHPrices(data)
+	}
+	results <- lapply(seq_len(nrow(jobs)), function(i) {
+		rseed <- jobs$rseed[i]
+		if (is.nan(rseed)) rseed <- NA
+		rGARCH(data, jobs$start[i], jobs$end[i], jobs$vModel[i],
+			nForecastDays=jobs$nForecastDays[i], nSimulations=jobs$nSimulations[i], dist=jobs$dist[i], rseed=rseed,
+			startPars=jobs$startPars[i], fixedPars=jobs$fixedPars[i], refitEvery=jobs$refitEvery[i],
+			forecastMode=jobs$forecastMode[i])
+	})
+	return(do.call(c, results))
+}
@@ -0,0 +1,19 @@
+import os
+import sys
+import pytest
+
+# the packages live at the repository root, next to this directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+
+@pytest.fixture
+def numpy_settings(tmp_path, monkeypatch):
+    """
+    Settings of a run on the numpy backend with its cache under tmp_path, through the environment so worker
+    processes started by the test see them too
+    :return: tmp_path
+    """
+    monkeypatch.setenv('VOL_TUNING_TMP_PATH', str(tmp_path))
+    monkeypatch.setenv('VOL_TUNING_PLOT_PATH', str(tmp_path))
+    monkeypatch.setenv('VOL_TUNING_GARCH_BACKEND', 'numpy')
+    return tmp_path
@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+from benchmarks.synthetic import synthetic_prices, synthetic_results
+from py_garch.metrics import MetricPanel
+from py_garch.result_store import RVMResultStore
+from py_garch.result_viz import SummaryResults
+from exercise import comparison, daily_update
+from exercise.comparison import populate_result_holders
+
+
+def test_incomplete_targets_are_not_scored():
+    end_dates = pd.bdate_range('2018-01-02', periods=5)
+    model_results = populate_result_holders([504], ['norm'], ['gjrGARCH', 'eGARCH'], 21, 200)
+    holders = dict((result_holder.params, result_holder) for result_holder in model_results)
+    results = synthetic_results(list(holders), end_dates)
+    for result in results:
+        # the last target covers 11 of its 21 returns
+        result.set_realized(result.vol_realized_ann, 11 if result.data_end_date == end_dates[-1] else 21)
+        holders[result.params].add_result(result)
+    summary = SummaryResults(model_results)
+    assert summary.forecast_error_frame.iloc[-1].isnull().all() and np.isnan(summary.realized_series.iloc[-1])
+    assert summary.forecast_error_frame.iloc[:-1].notnull().all().all()
+    frame = summary.metric_engine(['mse', 'qlike']).evaluate([0], [len(end_dates)])
+    complete = summary.forecast_error_frame.iloc[:-1]
+    ratio = summary.realized_series.iloc[:-1].values[:, None] ** 2 / summary.sim_frame.iloc[:-1].values ** 2
+    assert np.allclose(frame[frame.metric == 'mse'].value.values, (complete ** 2).mean().values)
+    assert np.allclose(frame[frame.metric == 'qlike'].value.values, (ratio - np.log(ratio) - 1.).mean(axis=0))
+
+    # the target is scored once a later update revises it with the full n_forecast returns
+    revised = [result for result in results if result.data_end_date == end_dates[-1]]
+    for result in revised:
+        result.set_realized(result.vol_realized_ann, 21)
+    summary.update_results(revised)
+    assert summary.forecast_error_frame.notnull().all().all() and not summary.incomplete_frame.any().any()
+    panel = MetricPanel.from_summary(summary)
+    assert np.isfinite(panel.field('forecast_error')).all() and np.isfinite(panel.realized).all()
+
+
+def test_update_plans_the_sweep_grid(numpy_settings, monkeypatch):
+    prices = synthetic_prices(1200)
+    data_file = str(numpy_settings / 'prices.txt')
+    for name, value in [('LOOK_BACKS', [504]), ('TEST_DISTS', ['norm']), ('MODEL_TYPES', ['gjrGARCH', 'eGARCH']),
+                        ('N_SIM', 200), ('REFIT_EVERY', [1]), ('FORECAST_MODES', ['simulate']), ('N_WORKERS', 1),
+                        ('START_DATE', prices.Date.iloc[1000])]:
+        monkeypatch.setattr(daily_update, name, value)
+    monkeypatch.setattr(daily_update, 'load_price_store', lambda: comparison.load_price_store(data_file))
+    summary_path = str(numpy_settings / 'summary.pkl')
+    n_dates = []
+    for n_prices in [1100, 1200]:
+        prices.iloc[:n_prices].rename(columns={'Date': 'date'}).to_csv(data_file, sep='\t', index=False,
+                                                                      date_format='%Y-%m-%d')
+        summary = daily_update.run_daily_update(summary_path)
+        # every forecast has a full target, the newest start point is n_forecast prices before the last one
+        window_plan = comparison.sweep_window_plan(comparison.load_price_store(data_file), [504],
+                                                   prices.Date.iloc[1000], 21)
+        assert list(summary.forecast_error_frame.index) == list(window_plan.end_dates)
+        assert summary.forecast_error_frame.notnull().all().all()
+        n_dates.append(len(window_plan.end_dates))
+    assert n_dates == [4, 9]
+    with RVMResultStore() as result_store:
+        status = result_store.status()
+    assert int(status.n_results.sum()) == 18 and int(status.n_incomplete.sum()) == 0
@@ -0,0 +1,68 @@
+import os
+import numpy as np
+import pytest
+from benchmarks.synthetic import synthetic_prices, synthetic_results
+from py_garch import result_viz
+from py_garch.window_plan import DateWindowPlan
+from py_garch.figure_render import FigureRenderer, summary_figure_specs
+from exercise.comparison import populate_result_holders
+
+
+def _summary(refit_everys=(1,), forecast_modes=('simulate',)):
+    prices = synthetic_prices(1200)
+    window_plan = DateWindowPlan.from_data_sets(np.arange(0, 180, 21), [504, -1], prices.iloc[1000:], prices)
+    model_results = populate_result_holders([504, -1], ['norm', 'std'], ['gjrGARCH', 'eGARCH'], 21, 500,
+                                            refit_everys, forecast_modes)
+    holders = dict((result_holder.params, result_holder) for result_holder in model_results)
+    for result in synthetic_results(list(holders), window_plan.end_dates, window_plan):
+        holders[result.params].add_result(result)
+    return result_viz.SummaryResults(model_results)
+
+
+@pytest.fixture
+def metric_specs():
+    specs = summary_figure_specs(_summary())
+    return [spec for spec in specs if spec.plot_function == 'summary_frame_metric_plots'][:2]
+
+
+@pytest.mark.parametrize('n_workers', [1, 2])
+def test_figures_written_to_renderer_path(numpy_settings, metric_specs, n_workers):
+    plot_path = numpy_settings / 'report'
+    plot_path.mkdir()
+    renderer = FigureRenderer(str(plot_path), n_workers)
+    assert renderer.render(metric_specs) == (2, 0)
+    file_names = [file_name for spec in metric_specs for file_name in spec.file_names]
+    assert all(os.path.exists(plot_path / file_name) for file_name in file_names)
+    # settings PLOT_PATH is untouched, a later default render still writes there
+    assert not any(os.path.exists(numpy_settings / file_name) for file_name in file_names)
+    assert result_viz.plot_path() == str(numpy_settings)
+    assert renderer.render(metric_specs) == (0, 2)
+
+
+def test_variants_drawn_apart(numpy_settings):
+    summary = _summary([1, 5], ['simulate', 'adaptive'])
+    specs = summary_figure_specs(summary)
+    file_names = [file_name for spec in specs for file_name in spec.file_names]
+    assert len(file_names) == len(set(file_names)) == 4 * 27
+    assert 'mse_win_model_dist_all.png' in file_names and 'mse_win_model_dist_all_refit5_adaptive.png' in file_names
+    for spec in specs:
+        if spec.plot_function == 'summary_frame_metric_plots':
+            # one bar per model, distribution and window: nothing is averaged over refit_every or forecast_mode
+            frame = spec.data['summary_frame']
+            assert len(frame) == 8 and frame[['refit_every', 'forecast_mode']].drop_duplicates().shape[0] == 1
+        else:
+            frame = spec.data.get('sim_frame', spec.data.get('resid_frame'))
+            assert frame.shape[1] == 2 and frame.columns.droplevel(['model_type', 'window']).nunique() == 1
+    spec = [spec for spec in specs if spec.file_names == ['sim_forecast_comp_gjrGARCH_std_refit5.png']][0]
+    assert FigureRenderer(str(numpy_settings), 1).render([spec]) == (1, 0)
+    assert os.path.exists(numpy_settings / spec.file_names[0])
+
+
+def test_variant_without_every_model(numpy_settings):
+    # analytic holds no eGARCH configs, its figures draw gjrGARCH alone
+    specs = summary_figure_specs(_summary(forecast_modes=['simulate', 'analytic']))
+    file_names = [file_name for spec in specs for file_name in spec.file_names]
+    assert 'sim_forecast_comp_eGARCH_std.png' in file_names
+    assert 'sim_forecast_comp_eGARCH_std_analytic.png' not in file_names
+    analytic = [spec for spec in specs if spec.file_names[0].endswith('_analytic.png')]
+    assert FigureRenderer(str(numpy_settings), 1).render(analytic) == (len(analytic), 0)
@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+from py_garch.metrics import MetricPanel, MetricEngine, CONFIG_LEVELS
+
+
+def _panel(n_dates=21):
+    rng = np.random.default_rng(0)
+    columns = pd.MultiIndex.from_tuples([('', model_type, 'norm', 504, 1, 'simulate')
+                                         for model_type in ['gjrGARCH', 'eGARCH']], names=CONFIG_LEVELS)
+    mean_sim_ann = rng.uniform(.1, .2, (n_dates, len(columns)))
+    realized = rng.uniform(.1, .2, n_dates)
+    fields = {'forecast_error': realized[:, None] - mean_sim_ann, 'mean_sim_ann': mean_sim_ann}
+    return MetricPanel(pd.bdate_range('2018-01-02', periods=n_dates), columns, fields, realized)
+
+
+def test_more_splits_than_dates():
+    panel = _panel()
+    frame = MetricEngine(panel, ['mse', 'q3_abs']).splits(100)
+    assert frame.window_id.nunique() == 100
+    assert frame.n_dates.groupby(frame.window_id).first().sum() == panel.n_dates
+    empty = frame[frame.n_dates == 0]
+    assert len(empty) > 0
+    assert empty.start_date.isnull().all() and empty.end_date.isnull().all() and empty.value.isnull().all()
+    filled = frame[frame.n_dates > 0]
+    assert (filled.start_date == filled.end_date).all() and filled.value.notnull().all()
+    assert set(filled.start_date) == set(panel.dates)
+
+
+def test_window_past_the_last_date():
+    panel = _panel()
+    frame = MetricEngine(panel).evaluate([panel.n_dates, 0], [panel.n_dates - 1, panel.n_dates])
+    past = frame[frame.window_id == 0]
+    assert (past.n_dates == 0).all() and past.start_date.isnull().all() and past.value.isnull().all()
+    full = frame[frame.window_id == 1]
+    assert (full.start_date == panel.dates[0]).all() and (full.end_date == panel.dates[-1]).all()
+    mse = full[full.metric == 'mse'].value.values
+    assert np.allclose(mse, np.mean(panel.field('forecast_error') ** 2, axis=0))
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+from benchmarks.synthetic import synthetic_prices, synthetic_returns
+from py_garch.garch_engine import fit_garch, log_likelihood, VARIANCE_MODELS, INNOVATION_DISTS
+from exercise import parity
+from exercise.comparison import load_full_data_set
+
+
+REFERENCE = parity.load_reference() or []
+# coefficients of benchmarks.synthetic.synthetic_prices
+SYNTHETIC_COEF = {'mu': 3e-4, 'omega': 2e-6, 'alpha1': .03, 'gamma1': .1, 'beta1': .9}
+# (model_type, test_dist, coefficients of benchmarks.synthetic.synthetic_returns, tolerance per recovered
+# coefficient); csGARCH beta1 trades off against the permanent component and is not pinned down by 4000 returns
+RECOVERY_CASES = [
+    ('eGARCH', 'norm', {'mu': 3e-4, 'omega': -.2, 'alpha1': -.08, 'beta1': .975, 'gamma1': .12},
+     {'alpha1': .03, 'beta1': .015, 'gamma1': .04}),
+    ('eGARCH', 'std', {'mu': 3e-4, 'omega': -.2, 'alpha1': -.08, 'beta1': .975, 'gamma1': .12, 'shape': 6.},
+     {'alpha1': .03, 'beta1': .015, 'gamma1': .04, 'shape': 1.}),
+    ('csGARCH', 'norm', {'mu': 3e-4, 'omega': 2e-6, 'alpha1': .08, 'beta1': .8, 'eta11': .98, 'eta21': .05},
+     {'alpha1': .04, 'eta11': .025, 'eta21': .03}),
+    ('csGARCH', 'std', {'mu': 3e-4, 'omega': 2e-6, 'alpha1': .08, 'beta1': .8, 'eta11': .98, 'eta21': .05,
+                        'shape': 6.}, {'alpha1': .04, 'eta11': .025, 'eta21': .03, 'shape': 1.}),
+    ('gjrGARCH', 'std', dict(SYNTHETIC_COEF, shape=6.), {'alpha1': .03, 'beta1': .03, 'gamma1': .05, 'shape': 1.})]
+
+
+@pytest.mark.skipif(len(REFERENCE) == 0, reason='no R reference at {!s}, write it with python -m exercise.parity '
+                                                '--write-reference on a host with R'.format(parity.REFERENCE_FILE))
+@pytest.mark.parametrize('case', REFERENCE, ids=lambda case: '{!s}_{!s}_{!s}'.format(
+    case['model_type'], case['test_dist'], case['window']))
+def test_numpy_matches_r_reference(case):
+    for field, diff, tolerance in parity.reference_parity(case, load_full_data_set()):
+        assert diff <= tolerance, field
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_gjr_fit_recovers_known_coefficients(seed):
+    returns = np.diff(np.log(synthetic_prices(4000, seed=seed).Close.values))
+    fit = fit_garch(returns, 'gjrGARCH', 'norm')
+    # a maximum likelihood fit scores at least as well as the coefficients that generated the data
+    assert fit.log_likelihood >= log_likelihood(returns, 'gjrGARCH', 'norm', SYNTHETIC_COEF)
+    persistence = fit.coef['alpha1'] + .5 * fit.coef['gamma1'] + fit.coef['beta1']
+    assert abs(persistence - .98) < .03
+    assert abs(fit.coef['beta1'] - .9) < .05
+
+
+@pytest.mark.parametrize('model_type,test_dist,coef,tolerances', RECOVERY_CASES,
+                         ids=['{!s}_{!s}'.format(case[0], case[1]) for case in RECOVERY_CASES])
+@pytest.mark.parametrize('seed', [0, 1])
+def test_fit_recovers_known_coefficients(model_type, test_dist, coef, tolerances, seed):
+    returns = synthetic_returns(4000, model_type, test_dist, coef, seed)
+    fit = fit_garch(returns, model_type, test_dist)
+    assert fit.log_likelihood >= log_likelihood(returns, model_type, test_dist, coef)
+    for name, tolerance in tolerances.items():
+        assert abs(fit.coef[name] - coef[name]) < tolerance, name
+    # an interior optimum: no variance or shape coefficient stopped on its bound
+    model = VARIANCE_MODELS[model_type]
+    dist = INNOVATION_DISTS[test_dist]
+    bounds = model.bounds(np.var(returns)) + dist.bounds()
+    for name, (lower, upper) in zip(model.variance_names + dist.shape_names, bounds):
+        margin = 1e-3 * (upper - lower)
+        assert lower + margin < fit.coef[name] < upper - margin, name
@@ -0,0 +1,63 @@
+import numpy as np
+from benchmarks.synthetic import synthetic_prices
+from py_garch.window_plan import DateWindowPlan
+from py_garch.result_store import RVMResultStore
+from py_garch.instrumentation import RunMonitor
+from exercise import comparison
+from exercise.comparison import populate_result_holders, store_failed, run_plan, run_compute
+from exercise.planner import WorkPlan, FIT_STAGE, FILTER_STAGE, REFIT_UNAVAILABLE
+
+
+def _refit_plan(result_store, first_index=0):
+    prices = synthetic_prices(1200)
+    window_plan = DateWindowPlan.from_data_sets(np.arange(0, 84, 21), [504], prices.iloc[1000:], prices)
+    model_results = populate_result_holders([504], ['norm'], ['gjrGARCH'], 21, 200, refit_everys=(2,))
+    return prices, WorkPlan.build(result_store, window_plan, model_results, first_index)
+
+
+def test_filter_of_failed_refit_is_left_out(tmp_path):
+    with RVMResultStore(str(tmp_path / 'results.sqlite')) as result_store:
+        _, plan = _refit_plan(result_store)
+        first_refit, second_refit = [pending[0] for pending in plan.work_batches(stage=FIT_STAGE)]
+        store_failed(result_store, [first_refit], 'timeout')
+        second_refit[1].coefficients = 'mu=0.0003;omega=2e-06;alpha1=0.03;beta1=0.9;gamma1=0.1'
+        unavailable = plan.unavailable_filters()
+        filter_batches = plan.work_batches(stage=FILTER_STAGE)
+        jobs = plan.job_batches(stage=FILTER_STAGE)
+    assert [result.data_end_date for _, result in unavailable] == [plan.filter_batches[0][0][1].data_end_date]
+    assert len(filter_batches) == 1 and filter_batches[0][0][1] is plan.filter_batches[1][0][1]
+    assert jobs[0][0][8]['beta1'] == .9
+
+
+def test_filter_without_refit_is_stored_failed(numpy_settings):
+    with RVMResultStore(str(numpy_settings / 'results.sqlite')) as result_store:
+        # planned from the second start_point, the refit of its filter task is neither stored nor planned
+        prices, plan = _refit_plan(result_store, first_index=1)
+        filter_result = plan.filter_batches[0][0][1]
+        with RunMonitor(plan.n_to_fit, write=False) as monitor:
+            run_plan(plan, result_store, prices, monitor=monitor)
+        stored = result_store.lookup(filter_result.data_start_date, filter_result.data_end_date,
+                                     filter_result.params)
+    assert stored.failure == REFIT_UNAVAILABLE
+    assert [record['cache'] for record in monitor.records].count('failed') == 1
+    assert [record['cache'] for record in monitor.records].count('miss') == 2
+
+
+def test_compute_file_and_panel(numpy_settings, monkeypatch):
+    prices = synthetic_prices(1200)
+    for name, value in [('LOOK_BACKS', [504]), ('TEST_DISTS', ['norm']), ('MODEL_TYPES', ['gjrGARCH']),
+                        ('N_SIM', 200), ('REFIT_EVERY', [1]), ('FORECAST_MODES', ['simulate']),
+                        ('START_DATE', prices.Date.iloc[1100])]:
+        monkeypatch.setattr(comparison, name, value)
+    data_file = str(numpy_settings / 'prices.txt')
+    prices.rename(columns={'Date': 'date'}).to_csv(data_file, sep='\t', index=False, date_format='%Y-%m-%d')
+    panel_file = str(numpy_settings / 'panel.txt')
+    panel = prices.rename(columns={'Date': 'date', 'Close': 'a'})
+    panel['b'] = 2. * panel.a
+    panel.to_csv(panel_file, sep='\t', index=False, date_format='%Y-%m-%d')
+    # both run the sweep_plan of the file, four start points from START_DATE for each asset
+    plan, model_results = run_compute(data_file)
+    assert plan.n_to_fit == 4 and len(model_results[0].results) == 4
+    plan, model_results = run_compute(data_file, panel_file=panel_file, layout='wide')
+    assert plan.n_to_fit == 8 and sorted(h.params.asset for h in model_results) == ['a', 'b']
+    assert run_compute(data_file, panel_file=panel_file, layout='wide', dry_run=True)[0].n_to_fit == 0
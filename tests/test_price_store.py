@@ -0,0 +1,32 @@
+import os
+import numpy as np
+from benchmarks.synthetic import synthetic_prices
+from py_garch.price_store import PriceStore
+
+
+def test_rewrite_leaves_open_store_readable(tmp_path):
+    path = str(tmp_path / 'prices.prices')
+    old_prices = synthetic_prices(300, seed=0)
+    new_prices = synthetic_prices(400, seed=1)
+    old_store = PriceStore.write(old_prices, path)
+    new_store = PriceStore.write(new_prices, path)
+    # the memory-mapped files of the first store were replaced, not written over
+    assert np.array_equal(old_store.close, old_prices.Close.values)
+    assert np.array_equal(new_store.close, new_prices.Close.values)
+    assert len(PriceStore(path)) == 400
+    assert os.listdir(str(tmp_path)) == ['prices.prices']
+
+
+def test_panel_rewrite(tmp_path):
+    data_file = tmp_path / 'panel.txt'
+    data_file.write_text('')
+    path = str(tmp_path / 'panel.panel')
+    panels = [dict((asset, synthetic_prices(200, seed=seed)) for seed, asset in enumerate(assets))
+              for assets in [['AAA', 'BBB'], ['CCC']]]
+    old_stores = PriceStore.for_panel_file(str(data_file), lambda _: panels[0], path)
+    os.utime(str(data_file), ns=(0, 0))
+    new_stores = PriceStore.for_panel_file(str(data_file), lambda _: panels[1], path)
+    assert list(new_stores) == ['CCC'] and sorted(os.listdir(path)) == ['CCC', 'meta.json']
+    assert np.array_equal(old_stores['BBB'].close, panels[0]['BBB'].Close.values)
+    assert PriceStore.is_current(path, str(data_file))
+    assert sorted(os.listdir(str(tmp_path))) == ['panel.panel', 'panel.txt']
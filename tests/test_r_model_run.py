@@ -0,0 +1,54 @@
+import pandas as pd
+from benchmarks.synthetic import synthetic_prices
+from r_garch.r_model_run import RGarchBackend, initialized_single_run
+
+
+class PyperLikeR(object):
+    """
+    Stand-in for a bare pyper R connection with its attribute access: an attribute missing from the instance
+    is evaluated in R, which fails with an R error rather than AttributeError, and assigning one sends it to
+    R as a variable; commands are recorded, never run
+
+    Attributes:
+        commands: list of the R commands sent, values of assignments left out
+        assigned: list of the attribute names sent to R
+    """
+    def __init__(self, responses=None):
+        self.__dict__['responses'] = {} if responses is None else responses
+        self.__dict__['commands'] = []
+        self.__dict__['assigned'] = []
+
+    def __call__(self, CMDS=[], use_try=None):
+        self.commands.append(CMDS)
+        return ''
+
+    def __setitem__(self, obj, val):
+        self('{!s} <- ...'.format(obj))
+
+    def __getitem__(self, obj):
+        return self.responses.get(obj)
+
+    def __getattr__(self, obj):
+        raise RuntimeError("Error: object '{!s}' not found".format(obj))
+
+    def __setattr__(self, obj, val):
+        if obj in self.__dict__:
+            self.__dict__[obj] = val
+        else:
+            self.assigned.append(obj)
+
+
+def test_backend_kept_on_pyper_connection():
+    r_conn = PyperLikeR({'result': {}})
+    prices = synthetic_prices(600)
+    end_date = prices.Date.iloc[-1]
+    args = (prices, end_date - pd.offsets.BDay(504), end_date, 21, 'gjrGARCH', 'norm', 200)
+    assert initialized_single_run(r_conn, *args) == {}
+    backend = RGarchBackend.for_connection(r_conn)
+    assert list(backend.data_handles.values()) == ['data.0']
+    n_commands = len(r_conn.commands)
+    # the second call finds the backend and its resident prices, only the fit is sent
+    assert initialized_single_run(r_conn, *args) == {}
+    assert RGarchBackend.for_connection(r_conn) is backend and len(backend.data_handles) == 1
+    assert not any('rGARCHPrices' in command for command in r_conn.commands[n_commands:])
+    assert r_conn.assigned == []
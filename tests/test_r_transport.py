@@ -0,0 +1,59 @@
+import datetime
+import importlib.util
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import pytest
+from py_garch import settings
+from r_garch.r_utilities import encode_column, decode_transfer, VECTOR
+
+
+def _r_available():
+    try:
+        r_path = settings.get('R_PATH')
+    except Exception:
+        return False
+    if importlib.util.find_spec('pyper') is None:
+        return False
+    return shutil.which(r_path) is not None or os.path.isfile(r_path)
+
+
+requires_r = pytest.mark.skipif(not _r_available(), reason='R_PATH does not point to an R install')
+
+
+def test_missing_dates_cross_as_r_na():
+    dates = pd.to_datetime(['1969-12-31', '2018-01-02', None]).values
+    column_type, payload = encode_column(dates)
+    assert column_type == 'date'
+    assert np.frombuffer(payload, '<i4').tolist() == [-1, 17533, -2 ** 31]
+    supported, decoded = decode_transfer(np.array([VECTOR, 3], '<i4').tobytes() + b'date\0' + payload)
+    assert supported and np.array_equal(decoded[:2], dates[:2]) and np.isnat(decoded[2])
+
+
+@requires_r
+def test_columns_round_trip():
+    from r_garch.r_utilities import binary_r_connection
+    dates = pd.to_datetime(['1969-12-31', '2018-01-02', None, '2038-01-20'])
+    values = [1.5, np.nan, -2.5e-300, np.inf]
+    names = ['a', '', 'spaces and ünicode', 'NA']
+    with binary_r_connection() as r_conn:
+        r_conn.assign_columns('x', [('Date', dates.values), ('value', values), ('name', names)])
+        assert r_conn['is.na(x$Date)'].tolist() == [0, 0, 1, 0]
+        assert r_conn['is.na(x$value)'].tolist() == [0, 1, 0, 0]
+        assert r_conn['class(x$Date)'].tolist() == ['Date']
+        frame = r_conn['x']
+        r_conn('y <- data.frame(d=as.Date(c("2018-01-02", NA, "2018-01-04")), v=c(1, NA, NaN), i=c(1L, NA, 3L), '
+               's=c("a", "b", "c"), stringsAsFactors=FALSE)')
+        from_r = r_conn['y']
+        scalars = r_conn['list(a=1.5, b=NA, c="x", d=as.Date("2018-01-02"), e=3L)']
+    assert list(frame.columns) == ['Date', 'value', 'name']
+    assert frame.Date.equals(pd.Series(dates, name='Date'))
+    assert np.array_equal(frame.value.values, values, equal_nan=True)
+    assert frame.name.tolist() == names
+    assert from_r.d.isnull().tolist() == [False, True, False]
+    assert np.isnan(from_r.v.values[1:]).all() and from_r.v.values[0] == 1.
+    assert np.array_equal(from_r.i.values, [1., np.nan, 3.], equal_nan=True)
+    assert from_r.s.tolist() == ['a', 'b', 'c']
+    assert scalars['a'] == 1.5 and np.isnan(scalars['b']) and scalars['c'] == 'x' and scalars['e'] == 3
+    assert scalars['d'] == datetime.date(2018, 1, 2)
@@ -0,0 +1,88 @@
+import sqlite3
+import pandas as pd
+from benchmarks.synthetic import synthetic_results
+from py_garch.result_store import RVMResultStore, VALUE_COLUMNS, FIT_COLUMNS
+from py_garch.vol_estimator import AllDatesVolModelRunParams, RVMSingleResultCache
+
+END_DATES = pd.bdate_range('2018-01-02', periods=4)
+PARAMS = [AllDatesVolModelRunParams('gjrGARCH', 'norm', 21, 200, 504),
+          AllDatesVolModelRunParams('gjrGARCH', 'norm', 21, 200, 504, refit_every=2),
+          AllDatesVolModelRunParams('csGARCH', 'std', 21, 200, -1, forecast_mode='analytic', asset='b')]
+# the results table as written before refit_every, forecast_mode, asset and the fit diagnostics were stored
+OLD_SCHEMA = 'CREATE TABLE results (model_type TEXT, test_dist TEXT, n_sims INTEGER, n_forecast INTEGER, ' \
+             'window INTEGER, data_start_date TEXT, data_end_date TEXT, {!s})'.format(
+                 ', '.join('{!s} REAL'.format(name) for name in VALUE_COLUMNS))
+
+
+def _results():
+    results = synthetic_results(PARAMS, END_DATES)
+    for i, result in enumerate(results):
+        result.coefficients = 'mu=0.0003;omega=2e-06;alpha1=0.03;beta1=0.9;gamma1=0.1'
+        result.solver_iterations = 10 + i
+        result.fit_seconds = .5
+        result.warm_start = i % 2
+        result.converged = 1
+        result.n_sims_used = 200
+        result.sim_std_error = .001
+        result.set_realized(result.vol_realized_ann, 21)
+    return results
+
+
+def _assert_same(stored, result):
+    assert stored is not None and stored.params == result.params
+    for name in VALUE_COLUMNS + [name for name, _ in FIT_COLUMNS]:
+        assert getattr(stored, name) == getattr(result, name), name
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'results.sqlite')
+    results = _results()
+    results[-1].set_realized(results[-1].vol_realized_ann, 11)
+    results[0].set_failed('timeout')
+    with RVMResultStore(path) as result_store:
+        result_store.append(results)
+    with RVMResultStore(path) as result_store:
+        for result in results:
+            _assert_same(result_store.lookup(result.data_start_date, result.data_end_date, result.params), result)
+        assert result_store.assets() == ['', 'b']
+        # failed tasks are not incomplete results
+        assert result_store.incomplete() == [results[-1]]
+        status = result_store.status()
+    assert list(status.n_results) == [4] * 3 and int(status.n_incomplete.sum()) == 1
+    assert int(status.n_failed.sum()) == 1
+    assert status.loc[('csGARCH', 'std', 200, 21, -1, 1, 'analytic', 'b')].last_end_date == '2018-01-05'
+
+
+def test_old_schema_migrated(tmp_path):
+    path = str(tmp_path / 'results.sqlite')
+    conn = sqlite3.connect(path)
+    conn.execute(OLD_SCHEMA)
+    conn.execute('CREATE UNIQUE INDEX results_key ON results (model_type, test_dist, n_sims, n_forecast, window, '
+                 'data_start_date, data_end_date)')
+    conn.execute('INSERT INTO results VALUES ({!s})'.format(', '.join(['?'] * (7 + len(VALUE_COLUMNS)))),
+                 ('gjrGARCH', 'norm', 200, 21, 504, '2018-01-02', '2018-01-02') + (.2,) * len(VALUE_COLUMNS))
+    conn.commit()
+    conn.close()
+    with RVMResultStore(path) as result_store:
+        old = result_store.lookup(END_DATES[0], END_DATES[0], PARAMS[0])
+        assert old.mean_sim_ann == .2 and old.coefficients is None and old.n_realized is None
+        assert old.is_complete and result_store.incomplete() == []
+        # the key index now spans the added columns, a refit_every variant of the old row is its own row
+        result_store.append(_results()[4:5])
+        status = result_store.status()
+    assert list(status.n_results) == [1, 1] and list(status.index.get_level_values('refit_every')) == [1, 2]
+    assert list(status.n_incomplete) == [0, 0]
+
+
+def test_migrate_file_cache(numpy_settings):
+    # the file cache predates refit_every and forecast_mode, its files hold baseline configs
+    params = [PARAMS[0], AllDatesVolModelRunParams('eGARCH', 'std', 21, 200, -1, asset='b')]
+    results = synthetic_results(params, END_DATES)
+    for result in results:
+        RVMSingleResultCache.cache_local(result)
+    with RVMResultStore(str(numpy_settings / 'results.sqlite')) as result_store:
+        assert result_store.migrate_file_cache(batch_size=5) == len(results)
+        for result in results:
+            stored = result_store.lookup(result.data_start_date, result.data_end_date, result.params)
+            assert stored is not None and stored.mean_sim_ann == result.mean_sim_ann
+            assert stored.vol_realized_ann == result.vol_realized_ann
@@ -0,0 +1,72 @@
+import multiprocessing
+import numpy as np
+import pandas as pd
+from benchmarks.synthetic import synthetic_prices, synthetic_results
+from py_garch import sample_store as sample_store_module
+from py_garch.result_store import RVMResultStore
+from py_garch.sample_store import SampleStore, trimmed_mean_statistic, trimmed_quantile_statistic
+from py_garch.vol_estimator import AllDatesVolModelRunParams
+from exercise import comparison
+from exercise.comparison import run_compute
+
+QUANTILE_FIELDS = [('quantile0_pct', 0.), ('quantile25_pct', .25), ('quantile50_pct', .5),
+                   ('quantile75_pct', .75), ('quantile100_pct', 1.)]
+
+
+def _sample(result, n_samples):
+    # a distinct, sorted sample per result, so a row written over another's shows
+    return np.sort(np.float32(result.data_end_date.toordinal()) + np.arange(n_samples, dtype=np.float32))
+
+
+def _append(path, params, end_dates):
+    with SampleStore(path) as sample_store:
+        for result in synthetic_results([params], end_dates):
+            sample_store.append([(result, _sample(result, 50))])
+
+
+def test_trimmed_statistics_reproduce_results(numpy_settings, monkeypatch):
+    prices = synthetic_prices(1200)
+    data_file = str(numpy_settings / 'prices.txt')
+    prices.rename(columns={'Date': 'date'}).to_csv(data_file, sep='\t', index=False, date_format='%Y-%m-%d')
+    for name, value in [('LOOK_BACKS', [504]), ('TEST_DISTS', ['norm']), ('MODEL_TYPES', ['gjrGARCH', 'eGARCH']),
+                        ('N_SIM', 1000), ('REFIT_EVERY', [1]), ('FORECAST_MODES', ['simulate', 'adaptive']),
+                        ('START_DATE', prices.Date.iloc[1100]), ('KEEP_SAMPLES', True)]:
+        monkeypatch.setattr(comparison, name, value)
+    run_compute(data_file)
+    statistics = dict([('mean_sim_ann', trimmed_mean_statistic())] +
+                      [(field, trimmed_quantile_statistic(prob)) for field, prob in QUANTILE_FIELDS])
+    with RVMResultStore() as result_store, SampleStore() as sample_store:
+        frame = sample_store.evaluate(statistics, sample_store.join_realized(sample_store.index(), result_store))
+        stored = result_store.preload()
+    assert len(frame) == 16 and frame.vol_realized_ann.notnull().all()
+    # adaptive samples stop short of the n_sims row width
+    assert (frame.n_samples < frame.width).any()
+    keys = frame[list(sample_store.key_columns)].itertuples(index=False)
+    results = [stored[tuple(key)] for key in keys]
+    for field in statistics:
+        expected = np.array([getattr(result, field) for result in results])
+        assert np.allclose(frame[field].values, expected, rtol=1e-6), field
+
+
+def test_concurrent_append(tmp_path, monkeypatch):
+    # small chunks, so the processes also race to open new chunk files
+    monkeypatch.setattr(sample_store_module, 'CHUNK_ROWS', 8)
+    path = str(tmp_path / 'samples')
+    params = [AllDatesVolModelRunParams(model_type, 'norm', 21, 50, 504) for model_type in ['gjrGARCH', 'eGARCH']]
+    end_dates = pd.bdate_range('2018-01-02', periods=20)
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target=_append, args=(path, p, end_dates)) for p in params for _ in range(2)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=120)
+    assert [process.exitcode for process in processes] == [0] * len(processes)
+    with SampleStore(path) as sample_store:
+        index = sample_store.index()
+        # two writers per fit share its row, no two fits share one
+        assert len(index) == 40 and not index[['width', 'chunk', 'row']].duplicated().any()
+        rows = index.set_index(list(sample_store.key_columns))
+        for result in synthetic_results(params, end_dates):
+            row = rows.loc[RVMResultStore.result_key(result)]
+            held = sample_store._chunk(int(row.width), int(row.chunk))[int(row.row)]
+            assert np.array_equal(held, _sample(result, 50))
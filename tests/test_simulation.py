@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+from benchmarks.synthetic import synthetic_prices
+from py_garch.garch_engine import fit_garch
+from py_garch.simulation import merge_sorted, simulate_adaptive, trim_indices, trimmed_summary, forecast_summary, \
+    ANNUALIZATION_DAYS, ANALYTIC
+from exercise.comparison import populate_result_holders
+
+
+def _fits(model_types):
+    returns = np.diff(np.log(synthetic_prices(1000).Close.values))
+    return [fit_garch(returns, model_type, 'norm') for model_type in model_types]
+
+
+# (n_simulations, 0-based kept positions, trimmed mean, type 7 quantiles 0, 25, 50, 75, 100, standard error) of
+# the path vols 1 to n_simulations, worked by hand from rGARCH's sims.sorted[cut.lo:cut.hi] with
+# cut.lo = as.integer(n * .025), cut.hi = as.integer(n * .975); the kept values are cut.lo to cut.hi, and the
+# type 7 quantile at p sits (n_kept - 1) * p positions in
+TRIM_REFERENCE = [(200, (4, 194), 100., [5., 52.5, 100., 147.5, 195.], 4.),
+                  (40, (0, 38), 20., [1., 10.5, 20., 29.5, 39.], np.sqrt(130. / 39.)),
+                  (10, (0, 8), 5., [1., 3., 5., 7., 9.], np.sqrt(7.5 / 9.))]
+
+
+@pytest.mark.parametrize('n_simulations,kept,mean,quantiles,std_error', TRIM_REFERENCE)
+def test_trim_matches_r(n_simulations, kept, mean, quantiles, std_error):
+    assert trim_indices(n_simulations) == kept
+    path_vol = np.random.default_rng(0).permutation(np.arange(1., n_simulations + 1.))[None]
+    # 253 forecast days annualize by 1
+    summary = trimmed_summary(path_vol, 253)
+    assert np.allclose(summary[0], mean) and np.allclose(summary[1], quantiles)
+    assert np.allclose(summary[2], std_error)
+
+
+def test_merge_sorted():
+    rng = np.random.default_rng(0)
+    sample = np.empty(0)
+    drawn = []
+    for n_batch in [5, 1, 40, 7]:
+        batch = rng.standard_normal(n_batch)
+        drawn.append(batch)
+        sample = merge_sorted(sample, batch)
+    assert np.array_equal(sample, np.sort(np.concatenate(drawn)))
+
+
+def test_adaptive_summarizes_every_path():
+    fits = _fits(['gjrGARCH', 'eGARCH'])
+    summary = simulate_adaptive(fits, 21, 2000, [np.random.default_rng(i) for i in range(2)], tolerance=0.,
+                                batch_size=300, keep_samples=True)
+    assert list(summary.n_simulations) == [2000, 2000]
+    ann = np.sqrt(ANNUALIZATION_DAYS / 20.)
+    path_vol = np.stack(summary.samples).astype(float) / ann
+    assert (np.diff(path_vol, axis=1) >= 0).all()
+    # the running sorted sample gives the statistics of a summary over all paths at once
+    mean_sim_ann, quantiles, std_error = trimmed_summary(path_vol, 21)
+    assert np.allclose(summary.mean_sim_ann, mean_sim_ann, rtol=1e-6)
+    assert np.allclose(summary.quantiles, quantiles, rtol=1e-6)
+    assert np.allclose(summary.std_error, std_error, rtol=1e-4)
+
+
+def test_analytic_needs_closed_form():
+    fits = _fits(['gjrGARCH', 'eGARCH'])
+    summary = forecast_summary(fits[:1], 21, 200, np.random.default_rng(0), ANALYTIC)
+    assert summary.n_simulations[0] == 0 and np.isnan(summary.quantiles).all()
+    with pytest.raises(ValueError):
+        forecast_summary(fits, 21, 200, np.random.default_rng(0), ANALYTIC)
+    model_results = populate_result_holders([504], ['norm'], ['gjrGARCH', 'eGARCH'], 21, 200,
+                                            forecast_modes=('simulate', 'analytic'))
+    assert sorted((h.params.model_type, h.params.forecast_mode) for h in model_results) == \
+        [('eGARCH', 'simulate'), ('gjrGARCH', 'analytic'), ('gjrGARCH', 'simulate')]
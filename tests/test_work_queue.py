@@ -0,0 +1,80 @@
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
+import time
+from benchmarks.synthetic import synthetic_prices
+from py_garch.garch_backend import NumpyGarchBackend
+from py_garch.result_store import RVMResultStore
+from exercise import comparison
+from exercise.work_queue import WorkQueue, seed_queue, drain_queue, DONE, LEASED
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+
+
+def _seed(tmp_path, monkeypatch):
+    prices = synthetic_prices(1200)
+    data_file = str(tmp_path / 'prices.txt')
+    prices.rename(columns={'Date': 'date'}).to_csv(data_file, sep='\t', index=False, date_format='%Y-%m-%d')
+    for name, value in [('LOOK_BACKS', [504]), ('TEST_DISTS', ['norm']), ('MODEL_TYPES', ['gjrGARCH', 'eGARCH']),
+                        ('N_SIM', 200), ('REFIT_EVERY', [1]), ('FORECAST_MODES', ['simulate']),
+                        ('START_DATE', prices.Date.iloc[1100])]:
+        monkeypatch.setattr(comparison, name, value)
+    queue_path = str(tmp_path / 'queue.sqlite')
+    plan = seed_queue(data_file, None, 'wide', False, queue_path)
+    assert plan.n_to_fit > 0
+    return plan, queue_path
+
+
+def _tasks(queue_path):
+    with WorkQueue(queue_path) as work_queue:
+        return work_queue.conn.execute('SELECT task_id, status, worker, attempts FROM tasks').fetchall()
+
+
+def _assert_all_stored(plan):
+    with RVMResultStore() as result_store:
+        stored = [result_store.lookup(result.data_start_date, result.data_end_date, result.params)
+                  for _, result in plan.pending_results]
+    assert all(result is not None and not result.is_failed for result in stored)
+
+
+def _hung_drain(queue_path, lease_seconds):
+    # the fit never returns while this worker lives, its backend session exits once the worker is killed
+    def hang(self, *args, **kwargs):
+        parent = os.getppid()
+        while os.getppid() == parent:
+            time.sleep(.1)
+        os._exit(1)
+    NumpyGarchBackend.multi_run = hang
+    drain_queue(queue_path, 'hung', lease_seconds)
+
+
+def test_workers_drain_queue(numpy_settings, monkeypatch):
+    plan, queue_path = _seed(numpy_settings, monkeypatch)
+    workers = [subprocess.Popen([sys.executable, '-m', 'exercise', 'queue', 'work', '--queue-file', queue_path,
+                                 '--lease', '30', '--worker-id', 'worker-{!s}'.format(i)], cwd=REPO_ROOT)
+               for i in range(2)]
+    assert [worker.wait(timeout=600) for worker in workers] == [0, 0]
+    tasks = _tasks(queue_path)
+    assert all(status == DONE and attempts == 1 for _, status, _, attempts in tasks)
+    _assert_all_stored(plan)
+
+
+def test_killed_worker_lease_reclaimed(numpy_settings, monkeypatch):
+    plan, queue_path = _seed(numpy_settings, monkeypatch)
+    hung = multiprocessing.Process(target=_hung_drain, args=(queue_path, 2.))
+    hung.start()
+    deadline = time.time() + 120
+    leased = []
+    while len(leased) == 0 and time.time() < deadline:
+        time.sleep(.2)
+        leased = [task_id for task_id, status, worker, _ in _tasks(queue_path) if status == LEASED]
+    assert len(leased) == 1
+    os.kill(hung.pid, signal.SIGKILL)
+    hung.join()
+    assert drain_queue(queue_path, 'healthy', 2., poll_seconds=.2) == len(_tasks(queue_path))
+    tasks = dict((task_id, (status, worker, attempts)) for task_id, status, worker, attempts in _tasks(queue_path))
+    assert tasks[leased[0]] == (DONE, 'healthy', 2)
+    assert all(status == DONE for status, _, _ in tasks.values())
+    _assert_all_stored(plan)
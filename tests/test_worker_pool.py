@@ -0,0 +1,43 @@
+import time
+import pandas as pd
+from benchmarks.synthetic import synthetic_prices
+from py_garch.garch_backend import NumpyGarchBackend
+from exercise import worker_pool
+from exercise.worker_pool import BackendWorkerPool
+
+
+def _job_batches(prices, n_batches=2):
+    end_dates = prices.Date.iloc[-n_batches * 21::21]
+    return [[(end_date - pd.offsets.BDay(504), end_date, 21, model_type, 'norm', 200, 0)
+             for model_type in ['gjrGARCH', 'eGARCH']] for end_date in end_dates]
+
+
+def test_fit_timeout_runs_from_task_start(monkeypatch):
+    # loading the prices takes longer than the fits are allowed, and is not charged to them
+    monkeypatch.setattr(NumpyGarchBackend, 'load_data', lambda self, x_frame: time.sleep(2.))
+    prices = synthetic_prices(1200)
+    with BackendWorkerPool('numpy', None, {'': prices}, 2, fit_timeout=.5) as pool:
+        results = list(pool.run(_job_batches(prices)))
+    assert sorted(result[0] for result in results) == [0, 1]
+    assert all(result[4] is None for result in results)
+
+
+def test_session_start_timeout(monkeypatch):
+    monkeypatch.setattr(worker_pool, 'START_TIMEOUT', 0.)
+    prices = synthetic_prices(1200)
+    with BackendWorkerPool('numpy', None, {'': prices}, 1, fit_timeout=60) as pool:
+        results = list(pool.run(_job_batches(prices, 1)))
+    assert [result[4] for result in results] == [worker_pool.START_TIMEOUT_FAILURE]
+
+
+def test_recycled_session_is_ended(monkeypatch):
+    # a session that does not exit on the sentinel is killed rather than left running beside its replacement
+    monkeypatch.setattr(worker_pool, 'EXIT_TIMEOUT', 1.)
+    monkeypatch.setattr(NumpyGarchBackend, 'close', lambda self: time.sleep(3600.))
+    prices = synthetic_prices(1200)
+    with BackendWorkerPool('numpy', None, {'': prices}, 1, recycle_after=1) as pool:
+        first = pool.slots[0].process
+        results = list(pool.run(_job_batches(prices)))
+        assert pool.n_restarts == 1 and pool.slots[0].process is not first
+        assert not first.is_alive()
+    assert all(result[4] is None for result in results)